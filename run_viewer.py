@@ -4,20 +4,55 @@ Simple HTTP server to serve the Telegram message viewer.
 This is needed because browsers don't allow loading local JSON files directly.
 """
 
-import http.server
-import socketserver
 import webbrowser
 import os
 import sys
 import json
-from pathlib import Path
+import io
+import gzip
 import base64
-from http.server import HTTPServer, SimpleHTTPRequestHandler
+import shutil
+import sqlite3
+import time
+import threading
+import email.utils
+from datetime import date
+from collections import OrderedDict
+from pathlib import Path
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+from src.backup.archive import archived_file
+from src.backup.metrics import Metrics
+from src.viewer.messages import MESSAGE_TYPES, MessageCache
+from src.viewer.search import SearchIndex
+
+try:
+    import brotli
+except ImportError:  # Optional: gzip is used when brotli is not installed
+    brotli = None
+
+# Responses of these types are compressed when the client accepts it
+COMPRESSIBLE_TYPES = ("application/json", "text/", "application/javascript")
+# Smaller files are not worth compressing
+COMPRESS_MIN_SIZE = 1024
+# Compressed bodies kept in memory, so a large dump.json is compressed only once
+COMPRESS_CACHE_BYTES = 64 * 1024 * 1024
+# Thumbnails (see src/backup/thumbnails.py) never change once made, so browsers keep them for a year
+THUMBS_FOLDER = ".thumbs"
+THUMB_MAX_AGE = 365 * 24 * 60 * 60
+# Request metrics served at /metrics (Prometheus text format)
+VIEWER_METRICS = {
+    "viewer_requests_total": "Requests answered, by kind and status",
+    "viewer_request_seconds": "Time to answer a request, by kind",
+    "viewer_bytes_sent_total": "Bytes sent (headers and body), by kind",
+}
+API_ENDPOINTS = ("messages", "backups", "search")
 
 def load_config():
     """Load configuration from config.json"""
     try:
-        with open('config.json', 'r') as f:
+        with open('config.json', 'r', encoding='utf-8') as f:
             config = json.load(f)
             return config
     except FileNotFoundError:
@@ -27,6 +62,485 @@ def load_config():
         print("⚠️  Invalid config.json format. Using default credentials.")
         return {"username": "admin", "password": "default"}
 
+class CompressionCache:
+    """Thread-safe LRU cache of compressed file bodies keyed by path, ETag and encoding."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def cached_length(self, path, etag, encoding):
+        """Returns the length of a cached compressed body, None if it is not cached."""
+        with self.lock:
+            body = self.entries.get((path, etag, encoding))
+        return len(body) if body is not None else None
+
+    def get(self, path, etag, encoding):
+        key = (path, etag, encoding)
+        with self.lock:
+            body = self.entries.get(key)
+            if body is not None:
+                self.entries.move_to_end(key)
+                return body
+
+        with open(path, 'rb') as f:
+            data = f.read()
+        if encoding == "br":
+            body = brotli.compress(data, quality=5)
+        else:
+            body = gzip.compress(data, compresslevel=6)
+
+        with self.lock:
+            if key not in self.entries and len(body) <= self.max_bytes:
+                # Drop older versions of the same file first, then the least recently used
+                for old_key in [k for k in self.entries if k[0] == path]:
+                    self.size -= len(self.entries.pop(old_key))
+                self.entries[key] = body
+                self.size += len(body)
+                while self.size > self.max_bytes:
+                    _, old_body = self.entries.popitem(last=False)
+                    self.size -= len(old_body)
+        return body
+
+
+class CountingWriter:
+    """Wraps the response stream to count the bytes sent."""
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.count = 0
+
+    def write(self, data):
+        self.count += len(data)
+        return self.raw.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self.raw, name)
+
+
+def request_kind(path):
+    """Groups request paths for the metrics, so file names do not become labels."""
+    path = urlsplit(path).path
+    if path.startswith("/api/"):
+        endpoint = path[len("/api/"):]
+        return f"api_{endpoint}" if endpoint in API_ENDPOINTS else "api_other"
+    if path == "/metrics":
+        return "metrics"
+    if f"/{THUMBS_FOLDER}/" in path:
+        return "thumbnail"
+    if path.startswith("/backup/"):
+        return "dump" if path.endswith((".json", ".jsonl")) else "media"
+    return "static"
+
+
+compression_cache = CompressionCache(COMPRESS_CACHE_BYTES)
+message_cache = MessageCache()
+metrics = Metrics(VIEWER_METRICS)
+
+
+def backup_folder(group, thread):
+    """
+    Resolves the backup folder of a group and thread ("no-thread" or empty for the
+    whole group). Only numeric IDs are accepted, so requests cannot leave backup/.
+    """
+    if not group.isdigit():
+        return None
+    folder = os.path.join("backup", group)
+    if thread and thread != "no-thread":
+        if not thread.isdigit():
+            return None
+        folder = os.path.join(folder, f"thread_{thread}")
+    return folder if os.path.isdir(folder) else None
+
+
+def backup_listing(backup_path):
+    """
+    Lists the backed-up groups and their threads from backup/manifest.json (written
+    by the exporter), walking the folders only when there is no manifest yet.
+    """
+    try:
+        with open(backup_path / "manifest.json", 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        pass
+    groups = {}
+    if backup_path.is_dir():
+        for group in sorted(backup_path.iterdir()):
+            if not group.is_dir() or not group.name.isdigit():
+                continue
+            threads = sorted(
+                (d.name.removeprefix('thread_') for d in group.iterdir()
+                 if d.is_dir() and d.name.startswith('thread_')),
+                key=lambda thread: int(thread) if thread.isdigit() else 0,
+            )
+            groups[group.name] = {"group_id": int(group.name), "threads": ["no-thread"] + threads}
+    return {"groups": groups}
+
+
+class AuthHandler(SimpleHTTPRequestHandler):
+    """
+    Serves the viewer and backup files behind Basic auth, with byte ranges
+    (seekable video), ETag/Last-Modified revalidation and compressed JSON.
+    """
+
+    config = {}
+    search_index = None
+    status_code = None  # Status of the current response, for the metrics
+    range_length = None  # Bytes to send of a range or of a file inside an archive
+
+    def setup(self):
+        super().setup()
+        self.wfile = CountingWriter(self.wfile)
+
+    def handle_one_request(self):
+        """Handles a request and records its latency, status and bytes sent."""
+        self.status_code = None
+        start = time.perf_counter()
+        sent = self.wfile.count
+        try:
+            super().handle_one_request()
+        finally:
+            if self.status_code is not None:
+                kind = request_kind(getattr(self, "path", ""))
+                metrics.inc("viewer_requests_total", kind=kind, status=self.status_code)
+                metrics.observe("viewer_request_seconds", time.perf_counter() - start, kind=kind)
+                metrics.inc("viewer_bytes_sent_total", self.wfile.count - sent, kind=kind)
+
+    def send_response(self, code, message=None):
+        self.status_code = code
+        super().send_response(code, message)
+
+    def do_HEAD(self):
+        if self.check_access():
+            super().do_HEAD()
+
+    def do_AUTHHEAD(self):
+        self.send_response(401)
+        self.send_header('WWW-Authenticate', 'Basic realm="Telegram Viewer"')
+        self.send_header('Content-type', 'text/html')
+        self.end_headers()
+
+    def do_GET(self):
+        if not self.check_access():
+            return
+        if self.path.startswith("/api/"):
+            self.handle_api()
+            return
+        if urlsplit(self.path).path == "/metrics":
+            self.send_metrics()
+            return
+        # Continue with normal file serving
+        super().do_GET()
+
+    def handle_api(self):
+        url = urlsplit(self.path)
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        if url.path == "/api/messages":
+            self.api_messages(params)
+        elif url.path == "/api/backups":
+            self.send_json(backup_listing(Path("backup")))
+        elif url.path == "/api/search":
+            self.api_search(params)
+        else:
+            self.send_json({"error": "Unknown API endpoint"}, 404)
+
+    def api_messages(self, params):
+        """Sorted, paginated messages of a backup: /api/messages?group=&thread=&type=&cursor=&limit=&order="""
+        folder = backup_folder(params.get("group", ""), params.get("thread", ""))
+        if folder is None:
+            self.send_json({"error": "Backup not found"}, 404)
+            return
+        type_filter = params.get("type", "all")
+        order = params.get("order", "desc")
+        if type_filter not in MESSAGE_TYPES or order not in ("asc", "desc"):
+            self.send_json({"error": "Invalid type or order"}, 400)
+            return
+        try:
+            limit = int(params.get("limit", 100))
+            page = message_cache.page(folder, type_filter, params.get("cursor") or None, limit, order)
+        except ValueError:
+            self.send_json({"error": "Invalid limit or cursor"}, 400)
+            return
+        self.send_json(page)
+
+    def api_search(self, params):
+        """Ranked full-text search: /api/search?q=&group=&thread=&since=&until=&user=&type=&offset=&limit="""
+        if self.search_index is None:
+            self.send_json({"error": "Search index unavailable"}, 503)
+            return
+        group = params.get("group", "")
+        thread = params.get("thread", "")
+        type_filter = params.get("type", "all")
+        try:
+            group_id = int(group) if group else None
+            thread_id = None if not thread else 0 if thread == "no-thread" else int(thread)
+            since = date.fromisoformat(params["since"]) if params.get("since") else None
+            until = date.fromisoformat(params["until"]) if params.get("until") else None
+            deleted_by = int(params["user"]) if params.get("user") else None
+            limit = int(params.get("limit", 50))
+            offset = max(0, int(params.get("offset", 0)))
+        except ValueError:
+            self.send_json({"error": "Invalid search parameters"}, 400)
+            return
+        if type_filter not in MESSAGE_TYPES:
+            self.send_json({"error": "Invalid type"}, 400)
+            return
+        # Picks up backups written since the last search
+        self.search_index.refresh_if_stale()
+        page = self.search_index.search(
+            params.get("q", ""), group_id, thread_id, since, until,
+            deleted_by, type_filter, limit, offset,
+        )
+        page["indexing"] = self.search_index.indexing
+        self.send_json(page)
+
+    def send_json(self, data, status=200):
+        """Sends a JSON API response, compressed when the client accepts it."""
+        body = json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        encoding = self.choose_encoding("application/json", len(body))
+        if encoding == "br":
+            body = brotli.compress(body, quality=5)
+        elif encoding == "gzip":
+            body = gzip.compress(body, compresslevel=6)
+        self.send_response(status)
+        self.send_header("Content-type", "application/json; charset=utf-8")
+        if encoding:
+            self.send_header("Content-Encoding", encoding)
+            self.send_header("Vary", "Accept-Encoding")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Cache-Control", "no-store")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_metrics(self):
+        """Sends the request metrics in the Prometheus text format."""
+        body = metrics.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Cache-Control", "no-store")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def check_access(self):
+        """Blocks config files and checks Basic auth; returns True if the request may continue."""
+        # Block access to config files (but allow users.json)
+        if self.path.split('?', 1)[0].endswith('/config.json'):
+            self.send_error(403, "Access denied")
+            return False
+
+        # Check for authorization header
+        if self.headers.get('Authorization') is None:
+            self.do_AUTHHEAD()
+            self.wfile.write(b'Authentication required')
+            return False
+
+        # Decode and verify credentials
+        auth_header = self.headers.get('Authorization')
+        if not self.verify_credentials(auth_header):
+            self.do_AUTHHEAD()
+            self.wfile.write(b'Invalid credentials')
+            return False
+        return True
+
+    def verify_credentials(self, auth_header):
+        # Extract base64 encoded credentials
+        encoded_creds = auth_header.split(' ')[1]
+        decoded_creds = base64.b64decode(encoded_creds).decode('utf-8')
+        username, password = decoded_creds.split(':')
+
+        # Check against credentials from config.json
+        return username == self.config.get("username", "admin") and password == self.config.get("password", "default")
+
+    def send_head(self):
+        """Opens a file and sends its headers, handling conditional, range and compressed responses."""
+        self.range_length = None
+        path = self.translate_path(self.path)
+        if os.path.isdir(path):
+            # Directory redirects, index.html and listings
+            return super().send_head()
+        archived = None
+        try:
+            f = open(path, 'rb')
+        except OSError:
+            # Files of packed backups are read from their archive
+            archived = self.find_archived(path)
+            if archived is None:
+                self.send_error(404, "File not found")
+                return None
+            try:
+                f = open(archived[0].path, 'rb')
+            except OSError:
+                self.send_error(404, "File not found")
+                return None
+
+        try:
+            st = os.fstat(f.fileno())
+            if archived is None:
+                base, size, mtime = 0, st.st_size, st.st_mtime
+                version = f"{st.st_mtime_ns:x}-{size:x}"
+            else:
+                base, size, mtime = archived[1]
+                version = f"{st.st_mtime_ns:x}-{base:x}-{size:x}"
+            ctype = self.guess_type(path)
+            etag = f'"{version}"'
+            last_modified = self.date_time_string(mtime)
+
+            encoding = self.choose_encoding(ctype, size) if archived is None else None
+            if encoding:
+                etag = f'"{version}-{encoding}"'
+
+            if self.not_modified(etag, mtime):
+                f.close()
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.send_header("Last-Modified", last_modified)
+                self.end_headers()
+                return None
+
+            if encoding:
+                f.close()
+                if self.command == "HEAD":
+                    # Headers only: the length is sent if the body was compressed before
+                    body = None
+                    length = compression_cache.cached_length(path, etag, encoding)
+                else:
+                    body = compression_cache.get(path, etag, encoding)
+                    length = len(body)
+                self.send_response(200)
+                self.send_header("Content-type", ctype)
+                self.send_header("Content-Encoding", encoding)
+                if length is not None:
+                    self.send_header("Content-Length", str(length))
+                self.send_header("Vary", "Accept-Encoding")
+                self.send_cache_headers(etag, last_modified)
+                self.end_headers()
+                return io.BytesIO(body) if body is not None else None
+
+            byte_range = self.requested_range(size, etag)
+            if byte_range == "unsatisfiable":
+                f.close()
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{size}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return None
+
+            if byte_range:
+                start, end = byte_range
+                f.seek(base + start)
+                self.range_length = end - start + 1
+                self.send_response(206)
+                self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+                self.send_header("Content-Length", str(self.range_length))
+            else:
+                if archived is not None:
+                    # Stop at the end of the file, not of the archive
+                    f.seek(base)
+                    self.range_length = size
+                self.send_response(200)
+                self.send_header("Content-Length", str(size))
+            self.send_header("Content-type", ctype)
+            self.send_header("Accept-Ranges", "bytes")
+            self.send_cache_headers(etag, last_modified)
+            self.end_headers()
+            return f
+        except Exception:
+            f.close()
+            raise
+
+    def find_archived(self, path):
+        """Looks a missing file under backup/ up in the archives of packed backups."""
+        backup_root = os.path.join(self.directory, "backup")
+        if not path.startswith(backup_root + os.sep):
+            return None
+        return archived_file(path, backup_root)
+
+    def send_cache_headers(self, etag, last_modified):
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", last_modified)
+        if f"/{THUMBS_FOLDER}/" in self.path:
+            self.send_header("Cache-Control", f"public, max-age={THUMB_MAX_AGE}, immutable")
+        else:
+            # Always revalidate; unchanged files are answered with 304
+            self.send_header("Cache-Control", "no-cache")
+
+    def not_modified(self, etag, mtime):
+        """Evaluates If-None-Match / If-Modified-Since."""
+        if_none_match = self.headers.get("If-None-Match")
+        if if_none_match:
+            tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+            return etag in tags or "*" in tags
+        if_modified_since = self.headers.get("If-Modified-Since")
+        if if_modified_since:
+            try:
+                since = email.utils.parsedate_to_datetime(if_modified_since)
+            except (TypeError, ValueError, IndexError, OverflowError):
+                return False
+            return since is not None and int(mtime) <= since.timestamp()
+        return False
+
+    def choose_encoding(self, ctype, size):
+        """Picks br or gzip for compressible files the client accepts, None otherwise."""
+        if size < COMPRESS_MIN_SIZE or self.headers.get("Range"):
+            return None
+        if not ctype.startswith(COMPRESSIBLE_TYPES):
+            return None
+        accepted = set()
+        for part in self.headers.get("Accept-Encoding", "").split(","):
+            token, _, params = part.strip().partition(";")
+            if params.strip().replace(" ", "") in ("q=0", "q=0.0"):
+                continue
+            accepted.add(token.strip().lower())
+        if brotli is not None and "br" in accepted:
+            return "br"
+        if "gzip" in accepted:
+            return "gzip"
+        return None
+
+    def requested_range(self, size, etag):
+        """Parses a single "bytes=" Range header into (start, end), "unsatisfiable" or None."""
+        header = self.headers.get("Range")
+        if not header or not header.startswith("bytes=") or "," in header:
+            return None
+        # A stale If-Range means the client must get the whole new file
+        if_range = self.headers.get("If-Range")
+        if if_range and if_range.strip() != etag:
+            return None
+        start_text, _, end_text = header[len("bytes="):].strip().partition("-")
+        try:
+            if start_text:
+                start = int(start_text)
+                end = int(end_text) if end_text else size - 1
+            else:
+                # Suffix range: the last N bytes
+                length = int(end_text)
+                if length <= 0:
+                    return "unsatisfiable"
+                start = max(0, size - length)
+                end = size - 1
+        except ValueError:
+            return None
+        if start >= size or start > end:
+            return "unsatisfiable"
+        return start, min(end, size - 1)
+
+    def copyfile(self, source, outputfile):
+        """Copies the response body, stopping at the end of a requested range."""
+        remaining = self.range_length
+        if remaining is None:
+            shutil.copyfileobj(source, outputfile)
+            return
+        while remaining > 0:
+            chunk = source.read(min(64 * 1024, remaining))
+            if not chunk:
+                break
+            outputfile.write(chunk)
+            remaining -= len(chunk)
+
+
 def main():
     import argparse
     
@@ -54,15 +568,18 @@ def main():
     if backup_path.exists():
         print(f"✅ Backup folder found: {backup_path}")
         
-        # List available groups and threads
-        groups = [d for d in backup_path.iterdir() if d.is_dir()]
+        # List available groups and threads (from the manifest when there is one)
+        groups = backup_listing(backup_path)["groups"]
         if groups:
             print(f"📂 Available groups:")
-            for group in groups:
-                print(f"   - Group {group.name}")
-                threads = [d for d in group.iterdir() if d.is_dir() and d.name.startswith('thread_')]
+            for name, group in groups.items():
+                if "messages" in group:
+                    print(f"   - Group {name} ({group['messages']} messages, {group['media']} media files)")
+                else:
+                    print(f"   - Group {name}")
+                threads = [thread for thread in group["threads"] if thread != "no-thread"]
                 if threads:
-                    print(f"     Threads: {', '.join([t.name.replace('thread_', '') for t in threads])}")
+                    print(f"     Threads: {', '.join(threads)}")
         else:
             print("⚠️  No backup groups found in backup folder")
     else:
@@ -80,51 +597,20 @@ def main():
 
     # Load config once at startup
     config = load_config()
-    
-    class AuthHandler(SimpleHTTPRequestHandler):
-        def do_HEAD(self):
-            self.send_response(200)
-            self.end_headers()
-            
-        def do_AUTHHEAD(self):
-            self.send_response(401)
-            self.send_header('WWW-Authenticate', 'Basic realm="Telegram Viewer"')
-            self.send_header('Content-type', 'text/html')
-            self.end_headers()
+    AuthHandler.config = config
 
-        def do_GET(self):
-            # Block access to config files (but allow users.json)
-            if self.path.endswith('/config.json'):
-                self.send_error(403, "Access denied")
-                return
-            
-            # Check for authorization header
-            if self.headers.get('Authorization') is None:
-                self.do_AUTHHEAD()
-                self.wfile.write(b'Authentication required')
-                return
-            
-            # Decode and verify credentials
-            auth_header = self.headers.get('Authorization')
-            if not self.verify_credentials(auth_header):
-                self.do_AUTHHEAD()
-                self.wfile.write(b'Invalid credentials')
-                return
-                
-            # Continue with normal file serving
-            super().do_GET()
-        
-        def verify_credentials(self, auth_header):
-            # Extract base64 encoded credentials
-            encoded_creds = auth_header.split(' ')[1]
-            decoded_creds = base64.b64decode(encoded_creds).decode('utf-8')
-            username, password = decoded_creds.split(':')
-            
-            # Check against credentials from config.json
-            return username == config.get("username", "admin") and password == config.get("password", "default")
+    # Full-text search index, brought up to date in the background
+    try:
+        AuthHandler.search_index = SearchIndex("backup")
+    except sqlite3.Error as e:
+        print(f"⚠️  Search index unavailable: {e}")
+    else:
+        threading.Thread(target=AuthHandler.search_index.refresh, daemon=True).start()
 
     try:
-        with socketserver.TCPServer((HOST, PORT), AuthHandler) as httpd:
+        # One thread per request, so a slow media download does not block other users
+        with ThreadingHTTPServer((HOST, PORT), AuthHandler) as httpd:
+            httpd.daemon_threads = True
             print(f"🎉 Server started successfully!")
             
             if not args.headless:
@@ -0,0 +1 @@
+"""Backup of deleted Telegram messages and media (run with `python3 -m src.backup`)."""
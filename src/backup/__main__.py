@@ -2,331 +2,443 @@
 This module handles the export of deleted Telegram messages and media using Telethon.
 It supports various export models based on user inputs,
 including exporting all deleted messages, media only, or text-only messages.
+
+Without arguments the settings are requested interactively. With --config the
+channels listed in a batch file are backed up concurrently over one client
+without any prompt (see batch.json.example). With --watch the process keeps
+running after the backup and appends new deletions as they appear, until it
+receives SIGTERM or Ctrl+C. --metrics-port serves Prometheus metrics of the
+run and --stats-file writes them to a JSON file periodically.
 """
 
 import os
+import sys
 import json
 import asyncio
+import argparse
+from datetime import datetime, timedelta
 from telethon import TelegramClient
-from telethon.tl.types import PeerChannel
 from telethon.errors import RPCError
 
-# Requesting user credentials
-api_id: int = int(input("Enter your api_id: "))
-api_hash: str = input("Enter your api_hash: ")
+from .exporter import (
+    ADMIN_LOG_PAGE_MAX,
+    DEFAULT_DOWNLOAD_WORKERS,
+    DEFAULT_MAX_IN_FLIGHT,
+    export_messages,
+    parse_date,
+    thread_output_folder,
+)
+from .downloads import DEFAULT_DOWNLOAD_PARTS
+from .metrics import BACKUP_METRICS, STATS_INTERVAL, Metrics, StatsFile, serve_metrics
+from .scheduler import RequestScheduler
+from .serializer import MESSAGE_PROFILES
+from .storage import STORAGE_FORMATS
+from .watch import DEFAULT_MAX_INTERVAL, DEFAULT_MIN_INTERVAL, install_stop_handlers
+
+DEFAULT_SESSION: str = "session_name"
+DEFAULT_BACKUP_ROOT: str = "backup"
+DEFAULT_CHANNEL_CONCURRENCY: int = 2
+
+
+def parse_thread_ids(thread_input) -> list[int]:
+    """
+    Parses thread IDs given as 0 (no filter), a single ID, "[19,20,23]" or a list.
+
+    :param thread_input: Thread IDs as entered by the user or read from the config.
+    """
+    if isinstance(thread_input, list):
+        return [int(x) for x in thread_input] or [0]
+    if isinstance(thread_input, int):
+        return [thread_input]
+    thread_input = str(thread_input).strip()
+    if thread_input.startswith("[") and thread_input.endswith("]"):
+        # Parse array format like [19, 20, 23]
+        thread_str = thread_input[1:-1]  # Remove brackets
+        return [int(x.strip()) for x in thread_str.split(",") if x.strip()] or [0]
+    # Single thread ID (0 = no thread filter)
+    return [int(thread_input)]
+
+
+def group_backup_folder(group_id: int, backup_root: str = DEFAULT_BACKUP_ROOT) -> str:
+    """
+    Returns the base backup folder of a group (leading minus removed from the ID).
+
+    :param group_id: Group or channel ID.
+    :param backup_root: Folder holding all group backups.
+    """
+    return os.path.join(backup_root, str(abs(group_id)))
+
+
+def channel_job(settings: dict, defaults: dict | None = None) -> dict:
+    """
+    Builds the export arguments of one channel from batch config settings.
+
+    :param settings: Channel entry of the batch config.
+    :param defaults: Settings shared by all channels, overridden per channel.
+    """
+    settings = {**(defaults or {}), **settings}
+    if "group_id" not in settings:
+        raise ValueError("Every channel needs a group_id")
+    group_id = int(settings["group_id"])
+    storage = settings.get("storage", "json")
+    if storage not in STORAGE_FORMATS:
+        raise ValueError(f"Unknown storage format: {storage}")
+    message_profile = settings.get("fields", "full")
+    if message_profile not in MESSAGE_PROFILES:
+        raise ValueError(f"Unknown fields profile: {message_profile}")
+    until = parse_date(settings.get("until") or "")
+    if until:
+        # until is inclusive, so it is moved to the next midnight
+        until += timedelta(days=1)
+    return {
+        "target_group_id": group_id,
+        "mode": int(settings.get("mode", 1)),
+        "min_id": int(settings.get("min_id", 0)),
+        "max_id": int(settings.get("max_id", 0)),
+        "filter_user_id": int(settings.get("filter_user_id", 0)),
+        "message_thread_ids": parse_thread_ids(settings.get("threads", 0)),
+        "base_folder": group_backup_folder(
+            group_id, settings.get("backup_root", DEFAULT_BACKUP_ROOT)
+        ),
+        "download_workers": int(settings.get("download_workers", DEFAULT_DOWNLOAD_WORKERS)),
+        "max_in_flight": int(settings.get("max_in_flight", DEFAULT_MAX_IN_FLIGHT)),
+        "download_parts": int(settings.get("download_parts", DEFAULT_DOWNLOAD_PARTS)),
+        "storage": storage,
+        "since": parse_date(settings.get("since") or ""),
+        "until": until,
+        "page_size": int(settings.get("page_size", ADMIN_LOG_PAGE_MAX)),
+        "message_profile": message_profile,
+        "compact": bool(settings.get("compact", False)),
+        "thumbnails": bool(settings.get("thumbnails", True)),
+    }
+
+
+def prompt_job() -> dict:
+    """
+    Requests the export settings of one channel from the user.
+    """
+    export_mode: int = int(
+        input("Enter export mode (1 - all, 2 - media only, 3 - text only): ")
+    )
+    min_message_id: int = int(
+        input("Enter the minimum message ID (0 to start from the first): ")
+    )
+    max_message_id: int = int(input("Enter the maximum message ID (0 to retrieve all): "))
+    group_id: int = int(input("Enter the group or channel ID: "))
+    filter_user_id: int = int(input("Enter user ID to filter by who deleted messages (0 for no filter): "))
+    # Deletion date range (until is inclusive, so it is moved to the next midnight)
+    since_date: datetime | None = parse_date(
+        input("Only messages deleted on or after (YYYY-MM-DD, empty for no limit): ")
+    )
+    until_date: datetime | None = parse_date(
+        input("Only messages deleted on or before (YYYY-MM-DD, empty for no limit): ")
+    )
+    if until_date:
+        until_date += timedelta(days=1)
+    storage_format: str = input(
+        "Enter storage format (json - single dump.json, jsonl - streaming segments) [json]: "
+    ).strip() or "json"
+    if storage_format not in STORAGE_FORMATS:
+        raise ValueError(f"Unknown storage format: {storage_format}")
+
+    # Support for multiple thread IDs
+    print("\nThread Options:")
+    print("  0 = Backup ALL messages (no thread filter)")
+    print("  19 = Single thread ID")
+    print("  [19,20,23] = Multiple threads")
+    message_thread_ids = parse_thread_ids(input("Enter thread/topic ID(s): "))
+    if len(message_thread_ids) > 1:
+        print(f"Processing {len(message_thread_ids)} threads: {message_thread_ids}")
+
+    return {
+        "target_group_id": group_id,
+        "mode": export_mode,
+        "min_id": min_message_id,
+        "max_id": max_message_id,
+        "filter_user_id": filter_user_id,
+        "message_thread_ids": message_thread_ids,
+        "base_folder": group_backup_folder(group_id),
+        "storage": storage_format,
+        "since": since_date,
+        "until": until_date,
+    }
+
+
+def describe_job(job: dict) -> None:
+    """
+    Prints the filters and output folders of a channel export.
+
+    :param job: Export arguments of the channel.
+    """
+    if job["filter_user_id"] != 0:
+        print(f"Filtering messages deleted by user ID: {job['filter_user_id']}")
+    else:
+        print("No user filter applied - showing messages deleted by anyone")
 
-session_name: str = "session_name"
-session_file: str = f"{session_name}.session"
+    if job["message_thread_ids"] == [0]:
+        print("No thread filter applied - showing messages from all threads/topics")
+    else:
+        print(f"Will process {len(job['message_thread_ids'])} thread(s): {job['message_thread_ids']}")
 
-# Output folder will be set dynamically for each thread
-output_folder: str = ""
+    # All threads are exported in a single pass over the admin log
+    for thread_id in job["message_thread_ids"]:
+        print(f"Backup will be saved to folder: {thread_output_folder(job['base_folder'], thread_id)}")
 
-# Remove session file if it exists
-if os.path.exists(session_file):
-    os.remove(session_file)
-    print(f"Existing session file removed: {session_file}")
 
-# Initialize Telegram client
-client: TelegramClient = TelegramClient(session_name, api_id, api_hash)
+def enable_watch(job: dict, watch_interval: tuple[float, float], stop: asyncio.Event) -> None:
+    """
+    Turns a channel export into a watching one that keeps polling for new deletions.
+
+    :param job: Export arguments of the channel.
+    :param watch_interval: (min, max) poll interval in seconds.
+    :param stop: Event that ends the watch.
+    :raises ValueError: If the channel is not backed up with jsonl storage.
+    """
+    if job.get("storage") != "jsonl":
+        # Watching never ends, so the dump must be streamed to disk instead of kept in memory.
+        # Switching the format here would leave a backup that later json runs cannot continue.
+        raise ValueError(
+            f"Watch mode needs jsonl storage, but {job['target_group_id']} uses {job.get('storage')}. "
+            "Choose jsonl storage for it; an existing dump.json is converted into the first segment once"
+        )
+    job["watch_interval"] = watch_interval
+    job["stop"] = stop
+
 
+def create_client(session_name: str, api_id: int, api_hash: str, fresh_session: bool) -> TelegramClient:
+    """
+    Creates the Telegram client, reusing the saved session unless a fresh login is requested.
 
-async def export_messages(
-    target_group_id: int,
-    mode: int,
-    min_id: int = 0,
-    max_id: int = 0,
-    filter_user_id: int = 0,
-    message_thread_id: int = 0,
-) -> None:
+    :param session_name: Session file name (without .session).
+    :param api_id: Telegram API ID.
+    :param api_hash: Telegram API hash.
+    :param fresh_session: Remove the saved session and log in again.
     """
-    Exports messages from a Telegram group or channel.
-
-    :param target_group_id: ID of the Telegram group or channel.
-    :param mode: Export mode (1 - all, 2 - media only, 3 - text only).
-    :param min_id: Minimum message ID to export.
-    :param max_id: Maximum message ID to export.
-    :param filter_user_id: User ID to filter by (who deleted the message). 0 = no filter.
-    :param message_thread_id: Thread ID to filter by (topic/thread). 0 = no filter.
+    session_file: str = f"{session_name}.session"
+    # Remove session file if requested
+    if fresh_session and os.path.exists(session_file):
+        os.remove(session_file)
+        print(f"Existing session file removed: {session_file}")
+
+    # Telethon sleeps through short FloodWaits of the login calls; see scheduler_takes_over
+    return TelegramClient(session_name, api_id, api_hash)
+
+
+def scheduler_takes_over(client: TelegramClient) -> None:
     """
-    group: PeerChannel = await client.get_entity(PeerChannel(target_group_id))
-    # Define the dump file path
-    dump_file = os.path.join(output_folder, "dump.json")
-    # Check if the file exists to append data instead of overwriting
-    file_mode: str = "a" if os.path.exists(dump_file) else "w"
-
-    # Initialize JSON structure
-    messages = []
-    if file_mode == "a" and os.path.exists(dump_file):
-        # Load existing messages if appending
+    Makes every FloodWait reach the caller instead of being slept through by
+    Telethon. Called once the client is logged in: from then on every API
+    call goes through the request scheduler, which backs off on FloodWait.
+
+    :param client: Logged-in Telegram client.
+    """
+    client.flood_sleep_threshold = 0
+
+
+async def run_interactive(
+    client: TelegramClient,
+    watch_interval: tuple[float, float] | None = None,
+    metrics: Metrics | None = None,
+    thumbnails: bool = True,
+) -> bool:
+    """
+    Exports one channel with settings requested from the user.
+
+    :param client: Telegram client (logged in interactively if needed).
+    :param watch_interval: (min, max) poll interval to keep watching after the export, None to stop.
+    :param metrics: Registry the export reports to.
+    :param thumbnails: Create thumbnails of the downloaded media.
+    :return: True if the channel was exported.
+    """
+    job = prompt_job()
+    job["thumbnails"] = thumbnails
+    if watch_interval is not None:
         try:
-            with open(dump_file, 'r', encoding='utf-8') as f:
-                content = f.read().strip()
-                if content:
-                    # Handle the old malformed format
-                    if content.startswith('['):
-                        messages = json.loads(content)
-                    else:
-                        # Convert old comma-separated format
-                        if content.endswith(','):
-                            content = content[:-1]
-                        messages = json.loads(f"[{content}]")
-        except (json.JSONDecodeError, FileNotFoundError):
-            messages = []
-    
-    c: int = 0  # Counter for text messages
-    m: int = 0  # Counter for media messages
-
-    limit_per_request: int = 100  # Number of events per request
+            enable_watch(job, watch_interval, asyncio.Event())
+        except ValueError as e:
+            print(f"❌ {e}")
+            return False
+        install_stop_handlers(job["stop"])
+    os.makedirs(job["base_folder"], exist_ok=True)
+    describe_job(job)
 
     try:
-        while True:
-            events = [
-                event
-                async for event in client.iter_admin_log(
-                    group,
-                    min_id=min_id or 0,
-                    max_id=max_id or 0,
-                    limit=limit_per_request,
-                    delete=True,  # Interested only in deleted messages
-                )
-            ]
-
-            if not events:
-                print("Loading complete, no new messages.")
-                break
-
-            # Filter and process messages
-            for event in events:
-                # Check if message was deleted and meets ID criteria
-                if event.deleted_message and event.old.id >= min_id:
-                    # Apply user filter if specified (0 means no filter)
-                    if filter_user_id != 0 and event.user_id != filter_user_id:
-                        continue
-                    
-                    # Apply thread filter if specified (0 means no filter)
-                    if message_thread_id != 0:
-                        # Check for forum-style topics first
-                        message_reply_to = getattr(event.old, 'reply_to', None)
-                        
-                        if message_reply_to:
-                            # Check for forum topic ID (reply_to_top_id is the actual topic ID)
-                            forum_topic_id = getattr(message_reply_to, 'reply_to_top_id', None)
-                            reply_msg_id = getattr(message_reply_to, 'reply_to_msg_id', None)
-                            is_forum_topic = getattr(message_reply_to, 'forum_topic', False)
-                            
-                            if is_forum_topic and forum_topic_id is not None:
-                                # This is a forum topic message
-                                if forum_topic_id != message_thread_id:
-                                    continue
-                            elif reply_msg_id is not None:
-                                # This is a regular reply thread
-                                if reply_msg_id != message_thread_id:
-                                    continue
-                            else:
-                                continue
-                        else:
-                            # If no reply_to, check if the message itself is the thread starter
-                            if event.old.id != message_thread_id:
-                                continue
-                    if mode == 1:  # Export all text and media
-                        message_json = json.loads(event.old.to_json())
-                        
-                        # Initialize media file info
-                        media_file_info = None
-                        
-                        if event.old.media:
-                            # Check if message is part of a media group (album)
-                            grouped_id = getattr(event.old, 'grouped_id', None)
-                            if grouped_id:
-                                # Use grouped_id for media group folder
-                                message_media_folder = os.path.join(output_folder, f"album_{grouped_id}")
-                                folder_info = f"album {grouped_id}"
-                            else:
-                                # Individual message folder
-                                message_media_folder = os.path.join(output_folder, f"msg_{event.old.id}")
-                                folder_info = f"message {event.old.id}"
-                            
-                            os.makedirs(message_media_folder, exist_ok=True)
-                            
-                            try:
-                                # Download media with automatic filename generation
-                                downloaded_path = await client.download_media(
-                                    event.old.media,
-                                    message_media_folder
-                                )
-                                if downloaded_path:
-                                    m += 1
-                                    # Convert absolute path to relative path for portability
-                                    relative_path = os.path.relpath(downloaded_path, output_folder)
-                                    media_file_info = {
-                                        "local_path": relative_path,
-                                        "absolute_path": downloaded_path,
-                                        "filename": os.path.basename(downloaded_path),
-                                        "folder_type": "album" if grouped_id else "message",
-                                        "folder_id": grouped_id if grouped_id else event.old.id
-                                    }
-                                    print(
-                                        f"Saved media file {m} from {folder_info} (ID: {event.old.id}, Path: {downloaded_path}, Date: {event.old.date}, Deleted by: {event.user_id})"
-                                    )
-                                else:
-                                    print(f"Failed to download media for message {event.old.id}")
-                            except Exception as e:
-                                print(f"Error downloading media for message {event.old.id}: {e}")
-                        
-                        # Add media file info to message JSON
-                        if media_file_info:
-                            message_json["local_media_file"] = media_file_info
-                        
-                        messages.append(message_json)
-                        c += 1
-                        print(
-                            f"Saved message {c} (ID: {event.old.id}, Date: {event.old.date}, Deleted by: {event.user_id})"
-                        )
-
-                    elif mode == 2 and event.old.media:  # Export media only
-                        # Check if message is part of a media group (album)
-                        grouped_id = getattr(event.old, 'grouped_id', None)
-                        if grouped_id:
-                            # Use grouped_id for media group folder
-                            message_media_folder = os.path.join(output_folder, f"album_{grouped_id}")
-                            folder_info = f"album {grouped_id}"
-                        else:
-                            # Individual message folder
-                            message_media_folder = os.path.join(output_folder, f"msg_{event.old.id}")
-                            folder_info = f"message {event.old.id}"
-                        
-                        os.makedirs(message_media_folder, exist_ok=True)
-                        
-                        try:
-                            # Download media with automatic filename generation
-                            downloaded_path = await client.download_media(
-                                event.old.media,
-                                message_media_folder
-                            )
-                            if downloaded_path:
-                                m += 1
-                                print(
-                                    f"Saved media file {m} from {folder_info} (ID: {event.old.id}, Path: {downloaded_path}, Date: {event.old.date}, Deleted by: {event.user_id})"
-                                )
-                            else:
-                                print(f"Failed to download media for message {event.old.id}")
-                        except Exception as e:
-                            print(f"Error downloading media for message {event.old.id}: {e}")
-
-                    elif mode == 3 and not event.old.media:  # Export text only
-                        message_json = json.loads(event.old.to_json())
-                        messages.append(message_json)
-                        c += 1
-                        print(
-                            f"Saved text message {c} (ID: {event.old.id}, Date: {event.old.date}, Deleted by: {event.user_id})"
-                        )
-
-                    await asyncio.sleep(0.1)  # Short pause to avoid flooding API
-
-            max_id = (
-                events[-1].id - 1
-            )  # Exclude the last received event from the next request
-
-            if max_id < min_id:
-                print("Reached the lower message ID limit.")
-                break
-
+        await client.start()
+        scheduler_takes_over(client)
+        await export_messages(client, metrics=metrics, **job)
     except RPCError as e:
         print(f"An error occurred: {e}")
-    
-    # Save messages as proper JSON array
-    with open(dump_file, 'w', encoding='utf-8') as f:
-        json.dump(messages, f, indent=2, ensure_ascii=False)
-    print(f"Saved {len(messages)} messages to {dump_file}")
+        return False
+    finally:
+        # Stops Telethon's sender and update tasks before the event loop closes
+        await client.disconnect()
 
+    if len(job["message_thread_ids"]) > 1:
+        print(f"\n{'='*50}")
+        print(f"All {len(job['message_thread_ids'])} threads processed successfully!")
+        print(f"{'='*50}")
+    return True
 
-# Request additional details from the user
-export_mode: int = int(
-    input("Enter export mode (1 - all, 2 - media only, 3 - text only): ")
-)
-min_message_id: int = int(
-    input("Enter the minimum message ID (0 to start from the first): ")
-)
-max_message_id: int = int(input("Enter the maximum message ID (0 to retrieve all): "))
-group_id: int = int(input("Enter the group or channel ID: "))
-filter_user_id: int = int(input("Enter user ID to filter by who deleted messages (0 for no filter): "))
-
-# Support for multiple thread IDs
-print("\nThread Options:")
-print("  0 = Backup ALL messages (no thread filter)")
-print("  19 = Single thread ID")
-print("  [19,20,23] = Multiple threads")
-thread_input = input("Enter thread/topic ID(s): ").strip()
-if thread_input == "0":
-    message_thread_ids = [0]
-elif thread_input.startswith("[") and thread_input.endswith("]"):
-    # Parse array format like [19, 20, 23]
-    thread_str = thread_input[1:-1]  # Remove brackets
-    message_thread_ids = [int(x.strip()) for x in thread_str.split(",") if x.strip()]
-    print(f"Processing {len(message_thread_ids)} threads: {message_thread_ids}")
-else:
-    # Single thread ID
-    message_thread_ids = [int(thread_input)]
-
-# Create base output folder based on group ID (remove leading minus if present)
-folder_name = str(abs(group_id))  # abs() removes the minus sign
-base_output_folder: str = os.path.join("backup", folder_name)
-
-# Create base folder
-os.makedirs(base_output_folder, exist_ok=True)
-
-if filter_user_id != 0:
-    print(f"Filtering messages deleted by user ID: {filter_user_id}")
-else:
-    print("No user filter applied - showing messages deleted by anyone")
-
-if message_thread_ids == [0]:
-    print("No thread filter applied - showing messages from all threads/topics")
-else:
-    print(f"Will process {len(message_thread_ids)} thread(s): {message_thread_ids}")
-
-
-async def main() -> None:
+
+async def run_batch(
+    client: TelegramClient,
+    jobs: list[dict],
+    channel_concurrency: int,
+    watch_interval: tuple[float, float] | None = None,
+    metrics: Metrics | None = None,
+) -> bool:
     """
-    Main function to start the export process.
+    Exports several channels concurrently over one authorized client.
+
+    :param client: Telegram client with an authorized session.
+    :param jobs: Export arguments of each channel.
+    :param channel_concurrency: Maximum number of channels exported at the same time.
+    :param watch_interval: (min, max) poll interval to keep watching every channel, None to stop.
+    :param metrics: Registry every export reports to.
+    :return: True if every channel was exported.
     """
-    await client.start()
-    
-    # Process each thread ID
-    for i, thread_id in enumerate(message_thread_ids, 1):
-        if len(message_thread_ids) > 1:
-            print(f"\n{'='*50}")
-            print(f"Processing thread {i}/{len(message_thread_ids)}: {thread_id}")
-            print(f"{'='*50}")
-        
-        # Set output folder for this thread
-        if thread_id != 0:
-            current_output_folder = os.path.join(base_output_folder, f"thread_{thread_id}")
-        else:
-            current_output_folder = base_output_folder
-        
-        # Create thread-specific folder
-        os.makedirs(current_output_folder, exist_ok=True)
-        print(f"Backup will be saved to folder: {current_output_folder}")
-        
-        # Temporarily set global output_folder for export_messages function
-        global output_folder
-        output_folder = current_output_folder
-        
-        await export_messages(
-            group_id, export_mode, min_id=min_message_id, max_id=max_message_id, 
-            filter_user_id=filter_user_id, message_thread_id=thread_id
-        )
-        
-        if len(message_thread_ids) > 1:
-            print(f"Completed thread {thread_id}")
-    
-    if len(message_thread_ids) > 1:
+    if watch_interval is not None:
+        stop = asyncio.Event()
+        try:
+            for job in jobs:
+                enable_watch(job, watch_interval, stop)
+        except ValueError as e:
+            print(f"❌ {e}")
+            return False
+
+    await client.connect()
+    try:
+        if not await client.is_user_authorized():
+            print("❌ The session is not logged in. "
+                  "Run `python3 -m src.backup` once interactively to log in.")
+            return False
+        scheduler_takes_over(client)
+
+        # One request budget for the whole account
+        metrics = metrics or Metrics(BACKUP_METRICS)
+        scheduler = RequestScheduler(metrics=metrics)
+        if watch_interval is not None:
+            install_stop_handlers(stop)
+            # Watching channels never finish, so they all run at once (mostly waiting between polls)
+            channel_concurrency = len(jobs)
+        slots = asyncio.Semaphore(max(1, channel_concurrency))
+
+        async def run_job(job: dict) -> None:
+            async with slots:
+                print(f"Starting backup of {job['target_group_id']} into {job['base_folder']}")
+                os.makedirs(job["base_folder"], exist_ok=True)
+                await export_messages(client, scheduler=scheduler, metrics=metrics, **job)
+                print(f"Finished backup of {job['target_group_id']}")
+
+        results = await asyncio.gather(*(run_job(job) for job in jobs), return_exceptions=True)
+        failed = 0
+        for job, result in zip(jobs, results):
+            if isinstance(result, BaseException):
+                failed += 1
+                print(f"❌ Backup of {job['target_group_id']} failed: {result}")
+
         print(f"\n{'='*50}")
-        print(f"All {len(message_thread_ids)} threads processed successfully!")
+        print(f"{len(jobs) - failed}/{len(jobs)} channels backed up")
         print(f"{'='*50}")
+        return failed == 0
+    finally:
+        # Stops Telethon's sender and update tasks before the event loop closes
+        await client.disconnect()
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    """Parses the command line."""
+    parser = argparse.ArgumentParser(
+        prog="python3 -m src.backup",
+        description="Backup deleted Telegram messages from the admin log. "
+                    "Without --config the settings are requested interactively.",
+    )
+    parser.add_argument('--config', help='Batch config (JSON) listing the channels to back up')
+    parser.add_argument('--api-id', type=int, help='Telegram api_id (or TG_API_ID, or api_id in the config)')
+    parser.add_argument('--api-hash', help='Telegram api_hash (or TG_API_HASH, or api_hash in the config)')
+    parser.add_argument('--session', help=f'Session name (default: {DEFAULT_SESSION})')
+    parser.add_argument('--fresh-session', action='store_true',
+                        help='Remove the saved session and log in again')
+    parser.add_argument('--channel-concurrency', type=int,
+                        help=f'Channels backed up at the same time (default: {DEFAULT_CHANNEL_CONCURRENCY})')
+    parser.add_argument('--watch', action='store_true',
+                        help='Keep running and append new deletions as they appear (stop with SIGTERM or Ctrl+C)')
+    parser.add_argument('--min-interval', type=float, default=DEFAULT_MIN_INTERVAL,
+                        help=f'Shortest poll interval in watch mode, in seconds (default: {DEFAULT_MIN_INTERVAL:g})')
+    parser.add_argument('--max-interval', type=float, default=DEFAULT_MAX_INTERVAL,
+                        help=f'Longest poll interval in watch mode, in seconds (default: {DEFAULT_MAX_INTERVAL:g})')
+    parser.add_argument('--no-thumbnails', action='store_true',
+                        help='Do not create thumbnails of the downloaded media (overrides the config)')
+    parser.add_argument('--metrics-port', type=int,
+                        help='Serve Prometheus metrics at http://<metrics-host>:<port>/metrics')
+    parser.add_argument('--metrics-host', default='127.0.0.1',
+                        help='Address the metrics endpoint binds to (default: 127.0.0.1)')
+    parser.add_argument('--stats-file', help='Write the metrics to this JSON file periodically')
+    parser.add_argument('--stats-interval', type=float, default=STATS_INTERVAL,
+                        help=f'Seconds between two stats file updates (default: {STATS_INTERVAL:g})')
+    return parser.parse_args(argv)
+
+
+def main(argv: list[str] | None = None) -> int:
+    """
+    Main function to start the export process.
+    """
+    args = parse_args(argv)
+
+    config = {}
+    if args.config:
+        with open(args.config, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+
+    # Requesting user credentials (arguments, environment, config, then prompt)
+    api_id = args.api_id or os.environ.get("TG_API_ID") or config.get("api_id")
+    api_hash = args.api_hash or os.environ.get("TG_API_HASH") or config.get("api_hash")
+    if not args.config:
+        api_id = api_id or input("Enter your api_id: ")
+        api_hash = api_hash or input("Enter your api_hash: ")
+    if not api_id or not api_hash:
+        print("❌ api_id and api_hash are required (--api-id/--api-hash, TG_API_ID/TG_API_HASH or the config)")
+        return 1
+
+    client = create_client(
+        args.session or config.get("session", DEFAULT_SESSION),
+        int(api_id), str(api_hash), args.fresh_session,
+    )
+
+    watch_interval = (args.min_interval, args.max_interval) if args.watch else None
+
+    metrics = Metrics(BACKUP_METRICS)
+    metrics_server = stats_file = None
+    if args.metrics_port is not None:
+        metrics_server = serve_metrics(metrics, args.metrics_host, args.metrics_port)
+        print(f"Serving metrics at http://{args.metrics_host}:{metrics_server.server_address[1]}/metrics")
+    if args.stats_file:
+        stats_file = StatsFile(metrics, args.stats_file, args.stats_interval)
+        stats_file.start()
+
+    try:
+        if not args.config:
+            ok = asyncio.run(run_interactive(client, watch_interval, metrics, not args.no_thumbnails))
+            return 0 if ok else 1
+
+        jobs = [channel_job(channel, config.get("defaults")) for channel in config.get("channels", [])]
+        if not jobs:
+            print("❌ No channels listed in the config")
+            return 1
+        if args.no_thumbnails:
+            for job in jobs:
+                job["thumbnails"] = False
+        channel_concurrency = args.channel_concurrency or config.get(
+            "channel_concurrency", DEFAULT_CHANNEL_CONCURRENCY
+        )
+        ok = asyncio.run(run_batch(client, jobs, channel_concurrency, watch_interval, metrics))
+        return 0 if ok else 1
+    finally:
+        if stats_file is not None:
+            stats_file.close()
+        if metrics_server is not None:
+            metrics_server.shutdown()
 
 
 if __name__ == "__main__":
-    loop = asyncio.get_event_loop()
-    loop.run_until_complete(main())
+    sys.exit(main())
@@ -0,0 +1,340 @@
+"""
+Single-file archives of finished backups.
+
+A backup folder packed by ``python -m src.backup.pack`` is stored in one
+``backup.pack`` file next to it:
+
+- the magic bytes ``TGPACK1\\n``;
+- one compressed JSON-lines section per packed backup (the folder itself is
+  ``"."``, its threads ``"thread_<id>"``), zstd-compressed when the optional
+  ``zstandard`` package is installed, gzip otherwise;
+- the media and thumbnail files, stored as they are (they are compressed
+  already), each file once even when several messages or threads use it;
+- a JSON index with the position of every section and file;
+- a footer with the offset and length of the index and the magic bytes again.
+
+Files are looked up by their path relative to the archive's folder, so the
+``local_path`` of the messages keeps working: a reader seeks to the file's
+offset instead of unpacking anything.
+"""
+
+import os
+import json
+import glob
+import zlib
+import shutil
+import struct
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Iterator
+
+try:
+    import zstandard as zstd
+except ImportError:  # Optional: archives are gzip-compressed without zstandard
+    zstd = None
+
+ARCHIVE_FILE: str = "backup.pack"
+ARCHIVE_VERSION: int = 1
+MAGIC: bytes = b"TGPACK1\n"
+# Index offset, index length, magic
+FOOTER: struct.Struct = struct.Struct("<QQ8s")
+OWN_SECTION: str = "."
+CHUNK_SIZE: int = 1024 * 1024
+# Parsed archive indexes kept in memory, keyed by (path, mtime_ns, size)
+ARCHIVE_CACHE_SIZE: int = 64
+
+_archives: OrderedDict = OrderedDict()
+_archives_lock: threading.Lock = threading.Lock()
+
+
+class ArchiveError(Exception):
+    """Raised when a file is not a readable backup archive."""
+
+
+def _compressor(compression: str, level: int):
+    if compression == "zstd":
+        return zstd.ZstdCompressor(level=level).compressobj()
+    return zlib.compressobj(level, zlib.DEFLATED, 31)  # gzip container
+
+
+def _decompressor(compression: str):
+    if compression == "zstd":
+        if zstd is None:
+            raise ArchiveError("This archive is zstd-compressed; install zstandard (pip install zstandard)")
+        return zstd.ZstdDecompressor().decompressobj()
+    return zlib.decompressobj(31)
+
+
+def archive_key(path: str, archive_folder: str) -> str:
+    """
+    Returns the key a file is stored under: its normalized path relative to the archive's folder.
+
+    :param path: Path of the file.
+    :param archive_folder: Folder holding the archive.
+    """
+    return os.path.relpath(os.path.normpath(path), os.path.normpath(archive_folder)).replace(os.sep, "/")
+
+
+class ArchiveWriter:
+    """
+    Streams message sections and files into a new archive, which replaces
+    path atomically when closed.
+
+    :param path: Destination archive file.
+    :param level: Compression level of the message sections.
+    """
+
+    def __init__(self, path: str, level: int | None = None) -> None:
+        self.path: str = path
+        self.compression: str = "zstd" if zstd is not None else "gzip"
+        self.level: int = level if level is not None else (10 if zstd is not None else 6)
+        self.sections: dict[str, dict] = {}
+        self.files: dict[str, list] = {}
+        self._inodes: dict[tuple[int, int], list] = {}
+        self._tmp_path: str = f"{path}.{os.getpid()}.tmp"
+        self._f = open(self._tmp_path, 'wb')
+        self._f.write(MAGIC)
+
+    def add_records(self, section: str, records) -> int:
+        """
+        Writes the messages of one backup as a compressed JSON-lines section.
+
+        :param section: Section name ("." or "thread_<id>").
+        :param records: Message records.
+        :return: Number of records written.
+        """
+        offset = self._f.tell()
+        compressor = _compressor(self.compression, self.level)
+        count = raw_length = 0
+        buffer = []
+        buffered = 0
+        for record in records:
+            line = (json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8")
+            buffer.append(line)
+            buffered += len(line)
+            count += 1
+            if buffered >= CHUNK_SIZE:
+                self._f.write(compressor.compress(b"".join(buffer)))
+                raw_length += buffered
+                buffer, buffered = [], 0
+        self._f.write(compressor.compress(b"".join(buffer)) + compressor.flush())
+        raw_length += buffered
+        self.sections[section] = {
+            "offset": offset,
+            "length": self._f.tell() - offset,
+            "raw_length": raw_length,
+            "count": count,
+            "compression": self.compression,
+        }
+        return count
+
+    def add_file(self, key: str, source_path: str) -> bool:
+        """
+        Stores a file unless its key is stored already. Hard links of a stored
+        file (the shared media store) point to the same bytes.
+
+        :param key: Key to store the file under (see archive_key).
+        :param source_path: File to copy.
+        :return: True if the file was added.
+        """
+        if key in self.files:
+            return False
+        st = os.stat(source_path)
+        entry = self._inodes.get((st.st_dev, st.st_ino))
+        if entry is None:
+            offset = self._f.tell()
+            with open(source_path, 'rb') as source:
+                shutil.copyfileobj(source, self._f, CHUNK_SIZE)
+            entry = [offset, self._f.tell() - offset, int(st.st_mtime)]
+            self._inodes[(st.st_dev, st.st_ino)] = entry
+        self.files[key] = entry
+        return True
+
+    def add_entry(self, key: str, source: "BackupArchive", entry: list) -> bool:
+        """
+        Copies a file from another archive (when a packed backup is packed again).
+
+        :param key: Key to store the file under.
+        :param source: Archive holding the file.
+        :param entry: [offset, size, mtime] of the file in the source archive.
+        """
+        if key in self.files:
+            return False
+        offset = self._f.tell()
+        for chunk in source.read_file(entry):
+            self._f.write(chunk)
+        self.files[key] = [offset, entry[1], entry[2]]
+        return True
+
+    def close(self) -> None:
+        """Writes the index and footer and moves the archive into place."""
+        index = json.dumps({
+            "version": ARCHIVE_VERSION,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "sections": self.sections,
+            "files": self.files,
+        }, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        index_offset = self._f.tell()
+        self._f.write(index)
+        self._f.write(FOOTER.pack(index_offset, len(index), MAGIC))
+        self._f.flush()
+        os.fsync(self._f.fileno())
+        self._f.close()
+        os.replace(self._tmp_path, self.path)
+
+    def abort(self) -> None:
+        """Discards the unfinished archive."""
+        self._f.close()
+        try:
+            os.remove(self._tmp_path)
+        except OSError:
+            pass
+
+
+class BackupArchive:
+    """
+    Read access to an archive; every read opens its own file handle, so one
+    instance can be shared by several threads.
+
+    :param path: Archive file.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path: str = path
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ArchiveError(f"{path} is not a backup archive")
+            f.seek(-FOOTER.size, os.SEEK_END)
+            index_offset, index_length, magic = FOOTER.unpack(f.read(FOOTER.size))
+            if magic != MAGIC:
+                raise ArchiveError(f"{path} is incomplete (no index)")
+            f.seek(index_offset)
+            index = json.loads(f.read(index_length))
+        if index.get("version") != ARCHIVE_VERSION:
+            raise ArchiveError(f"{path} has unsupported version {index.get('version')}")
+        self.sections: dict[str, dict] = index["sections"]
+        self.files: dict[str, list] = index["files"]
+        self.created_at: str | None = index.get("created_at")
+
+    def iter_records(self, section: str) -> Iterator[dict]:
+        """
+        Yields the messages of a section, decompressing as it reads.
+
+        :param section: Section name ("." or "thread_<id>").
+        """
+        info = self.sections[section]
+        decompressor = _decompressor(info["compression"])
+        pending = b""
+        with open(self.path, 'rb') as f:
+            f.seek(info["offset"])
+            remaining = info["length"]
+            while remaining > 0:
+                chunk = f.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                lines = (pending + decompressor.decompress(chunk)).split(b"\n")
+                pending = lines.pop()
+                for line in lines:
+                    if line:
+                        yield json.loads(line)
+        if pending.strip():
+            yield json.loads(pending)
+
+    def read_file(self, entry: list, start: int = 0, length: int | None = None) -> Iterator[bytes]:
+        """
+        Yields the bytes of a stored file, or of a range of it.
+
+        :param entry: [offset, size, mtime] of the file (from files).
+        :param start: First byte of the range.
+        :param length: Bytes to read, None for up to the end of the file.
+        """
+        offset, size, _ = entry
+        remaining = size - start if length is None else min(length, size - start)
+        with open(self.path, 'rb') as f:
+            f.seek(offset + start)
+            while remaining > 0:
+                chunk = f.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+
+
+def open_archive(path: str) -> BackupArchive | None:
+    """
+    Returns the archive at path, reusing the parsed index until the file changes.
+
+    :param path: Archive file.
+    :return: The archive, or None if there is none or it cannot be read.
+    """
+    try:
+        st = os.stat(path)
+        key = (path, st.st_mtime_ns, st.st_size)
+        with _archives_lock:
+            archive = _archives.get(key)
+            if archive is not None:
+                _archives.move_to_end(key)
+                return archive
+        archive = BackupArchive(path)
+    except (OSError, ValueError, KeyError, struct.error, ArchiveError):
+        return None
+    with _archives_lock:
+        # Older versions of the same archive are of no further use
+        for old_key in [k for k in _archives if k[0] == path]:
+            del _archives[old_key]
+        _archives[key] = archive
+        while len(_archives) > ARCHIVE_CACHE_SIZE:
+            _archives.popitem(last=False)
+    return archive
+
+
+def archived_backup(folder: str) -> tuple[BackupArchive, str] | None:
+    """
+    Finds the archived messages of a backup folder: the folder's own archive,
+    or the section of a thread folder in its group's archive.
+
+    :param folder: Backup folder (group or thread).
+    :return: (archive, section), or None if the folder is not packed.
+    """
+    archive = open_archive(os.path.join(folder, ARCHIVE_FILE))
+    if archive is not None and OWN_SECTION in archive.sections:
+        return archive, OWN_SECTION
+    folder = os.path.normpath(folder)
+    parent = open_archive(os.path.join(os.path.dirname(folder), ARCHIVE_FILE))
+    section = os.path.basename(folder)
+    if parent is not None and section in parent.sections:
+        return parent, section
+    return None
+
+
+def archived_file(path: str, root: str | None = None) -> tuple[BackupArchive, list] | None:
+    """
+    Finds a file that was packed into an archive: the archives of the file's
+    folder and of every folder above it (up to root) are searched, including
+    the thread archives next to them.
+
+    :param path: Path the file had before it was packed.
+    :param root: Folder to stop at, None to search up to the top.
+    :return: (archive, [offset, size, mtime]), or None if no archive holds the file.
+    """
+    path = os.path.normpath(path)
+    folder = os.path.dirname(path)
+    stop = os.path.normpath(root) if root is not None else None
+    while True:
+        candidates = [os.path.join(folder, ARCHIVE_FILE)]
+        candidates += sorted(glob.glob(os.path.join(glob.escape(folder), "thread_*", ARCHIVE_FILE)))
+        for candidate in candidates:
+            if not os.path.exists(candidate):
+                continue
+            archive = open_archive(candidate)
+            if archive is None:
+                continue
+            entry = archive.files.get(archive_key(path, os.path.dirname(candidate)))
+            if entry is not None:
+                return archive, entry
+        parent = os.path.dirname(folder)
+        if folder == stop or parent == folder or not folder:
+            return None
+        folder = parent
@@ -0,0 +1,230 @@
+"""
+Resumable downloads of large media files.
+
+Documents of RESUMABLE_SIZE bytes or more are not fetched with one
+``download_media`` call. They are written block by block to ``<file>.part``,
+and a ``<file>.part.json`` sidecar records how far every byte range has got.
+A request that fails because the connection dropped is retried on its own, and
+when the export is stopped the next run continues from the recorded offsets
+instead of starting over. Files of PARALLEL_SIZE bytes or more can be split
+into several ranges that are fetched at the same time. Every GetFile request
+is one call through the shared request scheduler, so the ranges stay within
+the global request budget.
+
+Telegram publishes no content hash for regular files, so the check before the
+``.part`` file is renamed into place is on byte counts: every request must
+return the bytes asked for, every block must be written in full, the written
+ranges must cover the file and the file must have the size Telegram reports.
+"""
+
+import os
+import json
+import asyncio
+from datetime import datetime
+
+from telethon import TelegramClient, utils
+from telethon.tl.types import (
+    Document,
+    DocumentAttributeAudio,
+    DocumentAttributeFilename,
+    DocumentAttributeVideo,
+    MessageMediaDocument,
+)
+
+from .manifest import write_json_atomic
+from .scheduler import RequestScheduler
+
+# Documents from this size on are downloaded resumably
+RESUMABLE_SIZE: int = 8 * 1024 * 1024
+# Documents from this size on are split into parallel ranges (when parts > 1)
+PARALLEL_SIZE: int = 64 * 1024 * 1024
+# Largest request Telegram serves (upload.getFile)
+REQUEST_SIZE: int = 512 * 1024
+# Bytes written (and recorded in the sidecar) at once; range boundaries are aligned to it
+BLOCK_SIZE: int = 8 * REQUEST_SIZE
+# Attempts per request when the connection drops
+REQUEST_RETRIES: int = 3
+DEFAULT_DOWNLOAD_PARTS: int = 1
+PART_SUFFIX: str = ".part"
+
+
+class IncompleteDownloadError(Exception):
+    """Raised when a downloaded file does not match the size Telegram reports."""
+
+
+def resumable_document(media) -> Document | None:
+    """
+    Returns the document of a media if it is large enough to be downloaded resumably.
+
+    :param media: Telethon message media.
+    """
+    if not isinstance(media, MessageMediaDocument) or not isinstance(media.document, Document):
+        return None
+    return media.document if (media.document.size or 0) >= RESUMABLE_SIZE else None
+
+
+def document_file_name(document: Document) -> str:
+    """
+    Returns the file name download_media would give a document: its own file
+    name if it has one, otherwise one made of its kind and date.
+
+    :param document: Telegram document.
+    """
+    kind = "document"
+    for attribute in document.attributes:
+        if isinstance(attribute, DocumentAttributeFilename) and attribute.file_name:
+            # The name comes from the sender, so no folders are taken from it
+            name = os.path.basename(attribute.file_name.replace("\\", "/"))
+            if name not in ("", ".", ".."):
+                return name
+        elif isinstance(attribute, DocumentAttributeVideo):
+            kind = "video"
+        elif isinstance(attribute, DocumentAttributeAudio):
+            kind = "voice" if attribute.voice else "audio"
+    date = document.date or datetime.now()
+    return f"{kind}_{date:%Y-%m-%d_%H-%M-%S}{utils.get_extension(document)}"
+
+
+def split_ranges(size: int, parts: int) -> list[list[int]]:
+    """
+    Splits a file into byte ranges aligned to BLOCK_SIZE.
+
+    :param size: File size.
+    :param parts: Number of ranges wanted.
+    :return: [start, end, downloaded up to] of every range.
+    """
+    blocks = -(-size // BLOCK_SIZE)
+    parts = max(1, min(parts, blocks))
+    ranges = []
+    for i in range(parts):
+        start = blocks * i // parts * BLOCK_SIZE
+        end = min(size, blocks * (i + 1) // parts * BLOCK_SIZE)
+        ranges.append([start, end, start])
+    return ranges
+
+
+def _load_progress(sidecar_path: str, part_path: str, document: Document) -> list[list[int]] | None:
+    """Returns the recorded ranges of an earlier attempt at the same file, None if there is none."""
+    try:
+        with open(sidecar_path, 'r', encoding='utf-8') as f:
+            progress = json.load(f)
+        if progress["file_id"] != document.id or progress["size"] != document.size:
+            return None
+        ranges = progress["ranges"]
+        # The ranges must follow each other from the first byte to the last
+        bounds = [0] + [end for _, end, _ in ranges]
+        if bounds[-1] != document.size or any(start != bounds[i] for i, (start, _, _) in enumerate(ranges)):
+            return None
+        if not all(start <= done <= end for start, end, done in ranges):
+            return None
+        # Every byte recorded as written must be in the file
+        if os.path.getsize(part_path) < max((done for start, _, done in ranges if done > start), default=0):
+            return None
+        return ranges
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+async def _fetch_request(client: TelegramClient, document: Document, offset: int) -> bytes:
+    """Fetches the REQUEST_SIZE bytes of a document at offset (one GetFile request)."""
+    async for chunk in client.iter_download(
+        document, offset=offset, request_size=REQUEST_SIZE, limit=1, file_size=document.size
+    ):
+        return chunk
+    return b""
+
+
+async def download_resumable(
+    client: TelegramClient,
+    scheduler: RequestScheduler,
+    document: Document,
+    folder: str,
+    parts: int = DEFAULT_DOWNLOAD_PARTS,
+) -> str:
+    """
+    Downloads a document into a folder, continuing an earlier interrupted download of it.
+
+    :param client: Authorized Telegram client.
+    :param scheduler: Shared request scheduler; every GetFile request is one call.
+    :param document: Telegram document.
+    :param folder: Destination folder.
+    :param parts: Ranges fetched in parallel for files of PARALLEL_SIZE bytes or more.
+    :return: Path of the finished file.
+    """
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, document_file_name(document))
+    part_path = path + PART_SUFFIX
+    sidecar_path = part_path + ".json"
+    size = document.size
+
+    ranges = _load_progress(sidecar_path, part_path, document)
+    if ranges is None:
+        # Starts empty: the file only grows by the bytes actually written
+        open(part_path, 'wb').close()
+        ranges = split_ranges(size, parts if size >= PARALLEL_SIZE else 1)
+
+    def save_progress() -> None:
+        write_json_atomic(sidecar_path, {"file_id": document.id, "size": size, "ranges": ranges})
+
+    save_progress()
+
+    async def fetch(offset: int, length: int) -> bytes:
+        for attempt in range(1, REQUEST_RETRIES + 1):
+            try:
+                data = await scheduler.call(_fetch_request, client, document, offset)
+                break
+            except (OSError, asyncio.TimeoutError) as e:
+                # A dropped connection costs this request, not the whole file
+                if attempt == REQUEST_RETRIES:
+                    raise
+                print(f"{path}: request at {offset} failed ({e}), retrying ({attempt}/{REQUEST_RETRIES})")
+                await asyncio.sleep(2 ** attempt)
+        if len(data) < length:
+            raise IncompleteDownloadError(f"{path}: got {len(data)} of {length} bytes at offset {offset}")
+        return data[:length]
+
+    async def fetch_range(byte_range: list[int]) -> None:
+        _, end, _ = byte_range
+        with open(part_path, 'r+b') as f:
+            while byte_range[2] < end:
+                offset = byte_range[2]
+                length = min(BLOCK_SIZE, end - offset)
+                block = bytearray()
+                while len(block) < length:
+                    block += await fetch(offset + len(block), min(REQUEST_SIZE, length - len(block)))
+                f.seek(offset)
+                written = f.write(block)
+                f.flush()
+                os.fsync(f.fileno())
+                if written != length:
+                    raise IncompleteDownloadError(f"{path}: wrote {written} of {length} bytes at offset {offset}")
+                # Recorded only once the block is on disk, so a resume never skips bytes
+                byte_range[2] = offset + written
+                save_progress()
+
+    pending = [byte_range for byte_range in ranges if byte_range[2] < byte_range[1]]
+    if len(pending) > 1:
+        await _gather(*(fetch_range(byte_range) for byte_range in pending))
+    elif pending:
+        await fetch_range(pending[0])
+
+    written = sum(done - start for start, _, done in ranges)
+    if any(done != end for _, end, done in ranges) or written != size or os.path.getsize(part_path) != size:
+        os.remove(part_path)
+        os.remove(sidecar_path)
+        raise IncompleteDownloadError(f"{path}: wrote {written} of {size} bytes, discarded")
+    os.replace(part_path, path)
+    os.remove(sidecar_path)
+    return path
+
+
+async def _gather(*coroutines) -> None:
+    """Runs coroutines concurrently; the others are cancelled when one fails."""
+    tasks = [asyncio.ensure_future(coroutine) for coroutine in coroutines]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
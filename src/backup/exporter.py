@@ -0,0 +1,624 @@
+"""
+Export of deleted Telegram messages and media from the admin log.
+
+export_messages walks the admin log of one group or channel and saves every
+deleted message into the backup folder of each requested thread. It is used by
+the interactive and batch command line (src/backup/__main__.py).
+"""
+
+import os
+import time
+import asyncio
+from datetime import datetime, timezone
+from functools import partial
+from telethon import TelegramClient
+from telethon.tl.types import PeerChannel
+from telethon.errors import RPCError
+
+from .downloads import DEFAULT_DOWNLOAD_PARTS, download_resumable, resumable_document
+from .manifest import MANIFEST_FILE, ManifestChanges, manifest_is_current, update_manifests
+from .media_store import MediaStore, link_into, media_identity
+from .metrics import BACKUP_METRICS, Metrics, Progress
+from .pipeline import MediaDownloadPipeline
+from .scheduler import RequestScheduler
+from .serializer import message_to_dict
+from .state import CrawlState, MessageIndex
+from .storage import iter_dump_records, open_dump_writer, records_after, segments_end
+from .thumbnails import create_thumbnail, thumbnail_path
+from .watch import MANIFEST_UPDATE_INTERVAL, AdaptiveInterval, wait_or_stop
+
+# Largest page the admin log API returns per request
+ADMIN_LOG_PAGE_MAX: int = 100
+
+# Media download pipeline limits
+DEFAULT_DOWNLOAD_WORKERS: int = 4
+DEFAULT_MAX_IN_FLIGHT: int = 16
+# Runs a failed media download is attempted in before the message is saved without it
+MEDIA_RETRY_RUNS: int = 3
+
+
+def thread_output_folder(base_folder: str, thread_id: int) -> str:
+    """
+    Returns the backup folder for a thread (the base folder when no thread filter is used).
+
+    :param base_folder: Base backup folder of the group or channel.
+    :param thread_id: Thread/topic ID, 0 = no thread filter.
+    """
+    if thread_id != 0:
+        return os.path.join(base_folder, f"thread_{thread_id}")
+    return base_folder
+
+
+def message_in_thread(message, thread_id: int) -> bool:
+    """
+    Checks whether a message belongs to the given thread or forum topic.
+
+    :param message: Telethon message object.
+    :param thread_id: Thread/topic ID, 0 = no thread filter (always matches).
+    """
+    if thread_id == 0:
+        return True
+
+    # Check for forum-style topics first
+    message_reply_to = getattr(message, 'reply_to', None)
+    if not message_reply_to:
+        # If no reply_to, check if the message itself is the thread starter
+        return message.id == thread_id
+
+    # Check for forum topic ID (reply_to_top_id is the actual topic ID)
+    forum_topic_id = getattr(message_reply_to, 'reply_to_top_id', None)
+    reply_msg_id = getattr(message_reply_to, 'reply_to_msg_id', None)
+    is_forum_topic = getattr(message_reply_to, 'forum_topic', False)
+
+    if is_forum_topic and forum_topic_id is not None:
+        # This is a forum topic message
+        return forum_topic_id == thread_id
+    if reply_msg_id is not None:
+        # This is a regular reply thread
+        return reply_msg_id == thread_id
+    return False
+
+
+def parse_date(text: str) -> datetime | None:
+    """
+    Parses a YYYY-MM-DD date as midnight UTC. An empty string means no date.
+
+    :param text: Date entered by the user.
+    """
+    text = text.strip()
+    if not text:
+        return None
+    return datetime.strptime(text, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+
+
+def media_folder_name(message) -> tuple[str, str]:
+    """
+    Returns the per-message media folder name and a readable description of it.
+    Messages of a media group (album) share one folder.
+
+    :param message: Telethon message object.
+    """
+    grouped_id = getattr(message, 'grouped_id', None)
+    if grouped_id:
+        return f"album_{grouped_id}", f"album {grouped_id}"
+    return f"msg_{message.id}", f"message {message.id}"
+
+
+def save_message(event, entries: list[tuple[dict, dict | None]], progress: Progress) -> None:
+    """
+    Writes a deleted message to the dump of every thread it belongs to.
+
+    :param event: Admin log event of the deleted message.
+    :param entries: (target, message JSON) pairs; the JSON is None when only media is exported.
+    :param progress: Progress of the export, counting the saved messages.
+    """
+    for target, target_json in entries:
+        if target_json is None:
+            # Media only: no record is written, so a later run may still save the message
+            continue
+        # Added before the write, so a checkpoint the write triggers commits it
+        target["index"].add(event.old.id)
+        target["writer"].write(target_json)
+        target["manifest"].add_message(target["folder"], target_json)
+        target["c"] += 1
+        progress.count("backup_messages_saved_total")
+
+
+async def fetch_admin_log_page(client: TelegramClient, group, **kwargs) -> list:
+    """
+    Fetches one page of deleted-message events from the admin log.
+
+    :param client: Authorized Telegram client.
+    :param group: Channel entity.
+    :param kwargs: Paging and filter arguments passed to iter_admin_log (min_id, max_id, limit, admins).
+    """
+    return [
+        event
+        async for event in client.iter_admin_log(
+            group,
+            delete=True,  # Interested only in deleted messages
+            **kwargs,
+        )
+    ]
+
+
+async def download_media_file(
+    client: TelegramClient, scheduler: RequestScheduler, media, folder: str, parts: int = DEFAULT_DOWNLOAD_PARTS
+) -> str | None:
+    """
+    Downloads media into a folder within the shared request budget. Large
+    documents are downloaded resumably (see downloads.py).
+
+    :param client: Authorized Telegram client.
+    :param scheduler: Shared request scheduler.
+    :param media: Telethon message media.
+    :param folder: Destination folder (the file name is generated automatically).
+    :param parts: Ranges fetched in parallel for very large files.
+    """
+    document = resumable_document(media)
+    if document is not None:
+        return await download_resumable(client, scheduler, document, folder, parts)
+    return await scheduler.call(client.download_media, media, folder)
+
+
+async def download_thumbnail_file(
+    client: TelegramClient, scheduler: RequestScheduler, media, path: str, thumb: str
+) -> str | None:
+    """
+    Downloads Telegram's embedded thumbnail of a media within the shared request budget.
+
+    :param client: Authorized Telegram client.
+    :param scheduler: Shared request scheduler.
+    :param media: Telethon message media.
+    :param path: Destination file.
+    :param thumb: Thumbnail type (see thumbnails.telegram_thumb_type).
+    """
+    return await scheduler.call(client.download_media, media, path, thumb=thumb)
+
+
+async def download_event_media(
+    event,
+    entries: list[tuple[dict, dict | None]],
+    store: MediaStore,
+    download,
+    progress: Progress,
+    thumbnail=None,
+    defer=None,
+) -> None:
+    """
+    Saves the media of a deleted message once and links it into the folder of
+    every thread the message belongs to. Photos and documents go through the
+    shared media store, so files saved before are not downloaded again.
+
+    :param event: Admin log event of the deleted message.
+    :param entries: (target, message JSON) pairs; the JSON is None when only media is exported.
+    :param store: Media store of the group.
+    :param download: Coroutine function downloading media into a folder.
+    :param progress: Progress of the export, counting the downloads.
+    :param thumbnail: Coroutine function creating the thumbnail of a downloaded file, None for no thumbnails.
+    :param defer: Called with the event when the media cannot be saved; if it returns True
+        the message is kept for the next run (which resumes the download) instead of
+        being saved without its media.
+    """
+    folder_name, _ = media_folder_name(event.old)
+    first_target = entries[0][0]
+    identity = media_identity(event.old.media)
+    reused = False
+
+    start = time.perf_counter()
+    try:
+        if identity:
+            downloaded_path, reused = await store.fetch(event.old.media, download)
+        else:
+            first_folder = os.path.join(first_target["folder"], folder_name)
+            os.makedirs(first_folder, exist_ok=True)
+            # Download media with automatic filename generation
+            downloaded_path = await download(event.old.media, first_folder)
+    except Exception as e:
+        print(f"Error downloading media for message {event.old.id}: {e}")
+        downloaded_path = None
+    else:
+        if not downloaded_path:
+            print(f"Failed to download media for message {event.old.id}")
+    if not downloaded_path:
+        progress.count("backup_media_failed_total")
+        if defer is not None and defer(event):
+            print(f"Media of message {event.old.id} will be retried in the next run")
+            return
+        # Keep the message even if its media could not be saved
+        save_message(event, entries, progress)
+        return
+    if reused:
+        progress.count("backup_media_reused_total")
+    else:
+        progress.metrics.observe("backup_media_download_seconds", time.perf_counter() - start, group=progress.group)
+        size = os.path.getsize(downloaded_path)
+        progress.count("backup_media_bytes_total", size)
+        progress.count("backup_media_downloaded_total")
+        # A file reused from the store was counted when it was downloaded
+        folders = [target["folder"] for target, target_json in entries if target_json is not None]
+        if folders:
+            first_target["manifest"].add_media_file(folders, size)
+
+    on_disk = os.path.exists(downloaded_path)
+    if on_disk:
+        thumb_path = await thumbnail(event.old.media, downloaded_path) if thumbnail else None
+    else:
+        # Reused from an archive (see pack.py), which holds its thumbnail too
+        thumb_path = thumbnail_path(downloaded_path)
+        if not thumbnail or store.archived(thumb_path) is None:
+            thumb_path = None
+
+    grouped_id = getattr(event.old, 'grouped_id', None)
+    for target, target_json in entries:
+        # Packed files cannot be linked; the viewer reads them from the archive
+        if on_disk and (identity or target is not first_target):
+            link_into(downloaded_path, os.path.join(target["folder"], folder_name))
+        target["m"] += 1
+        if target_json is not None:
+            # Relative path to the shared copy, for portability
+            target_json["local_media_file"] = {
+                "local_path": os.path.relpath(downloaded_path, target["folder"]),
+                "absolute_path": downloaded_path,
+                "filename": os.path.basename(downloaded_path),
+                "folder_type": "album" if grouped_id else "message",
+                "folder_id": grouped_id if grouped_id else event.old.id
+            }
+            if identity:
+                target_json["local_media_file"]["media_key"] = identity[0]
+            if thumb_path:
+                target_json["local_media_file"]["thumbnail"] = os.path.relpath(thumb_path, target["folder"])
+    save_message(event, entries, progress)
+
+
+async def export_messages(
+    client: TelegramClient,
+    target_group_id: int,
+    mode: int,
+    min_id: int = 0,
+    max_id: int = 0,
+    filter_user_id: int = 0,
+    message_thread_ids: list[int] | None = None,
+    base_folder: str = "",
+    download_workers: int = DEFAULT_DOWNLOAD_WORKERS,
+    max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+    storage: str = "json",
+    since: datetime | None = None,
+    until: datetime | None = None,
+    page_size: int = ADMIN_LOG_PAGE_MAX,
+    scheduler: RequestScheduler | None = None,
+    message_profile: str = "full",
+    compact: bool = False,
+    thumbnails: bool = True,
+    watch_interval: tuple[float, float] | None = None,
+    stop: asyncio.Event | None = None,
+    metrics: Metrics | None = None,
+    download_parts: int = DEFAULT_DOWNLOAD_PARTS,
+) -> int:
+    """
+    Exports messages from a Telegram group or channel.
+
+    The admin log is walked only once; every deleted message is written to the
+    backup folder of each requested thread it belongs to.
+
+    :param client: Authorized Telegram client.
+    :param target_group_id: ID of the Telegram group or channel.
+    :param mode: Export mode (1 - all, 2 - media only, 3 - text only).
+    :param min_id: Minimum message ID to export.
+    :param max_id: Maximum message ID to export.
+    :param filter_user_id: User ID to filter by (who deleted the message). 0 = no filter.
+    :param message_thread_ids: Thread IDs to export (topic/thread). [0] = no filter.
+    :param base_folder: Base backup folder of the group or channel.
+    :param download_workers: Number of concurrent media download workers.
+    :param max_in_flight: Maximum number of media downloads queued or running at once.
+    :param storage: Dump format, "json" (legacy dump.json) or "jsonl" (streaming segments).
+    :param since: Only export messages deleted at or after this time. None = no limit.
+    :param until: Only export messages deleted before this time. None = no limit.
+    :param page_size: Admin log events per request (at most 100, the API maximum).
+    :param scheduler: Request scheduler shared by every export using the same client.
+        A new one is created when omitted.
+    :param message_profile: Message fields to save, "full" (all raw fields) or "viewer"
+        (only what the viewer uses).
+    :param compact: Write dump.json without indentation.
+    :param thumbnails: Create small thumbnails of the downloaded media for the viewer.
+    :param watch_interval: (min, max) poll interval in seconds to keep watching the admin
+        log for new deletions after the crawl (needs jsonl storage); None exports once.
+    :param stop: Event that ends the export after the current page, e.g. on SIGTERM.
+    :param metrics: Registry the export reports to, shared like the scheduler (its series
+        are labelled with the group ID). A new one is created when omitted.
+    :param download_parts: Byte ranges of a very large file downloaded in parallel
+        (each range still goes through the scheduler).
+    :return: Number of deleted messages exported.
+    :raises RPCError: If Telegram refuses a request; what was exported up to then is saved.
+    """
+    if watch_interval is not None and storage != "jsonl":
+        raise ValueError("Watch mode needs jsonl storage, so memory use stays bounded")
+    metrics = metrics or Metrics(BACKUP_METRICS)
+    scheduler = scheduler or RequestScheduler(metrics=metrics)
+    download = partial(download_media_file, client, scheduler, parts=download_parts)
+    thumbnail = None
+    if thumbnails:
+        thumbnail = partial(create_thumbnail, download=partial(download_thumbnail_file, client, scheduler))
+    group: PeerChannel = await scheduler.call(client.get_entity, PeerChannel(target_group_id))
+
+    # Let Telegram filter by the deleting admin instead of discarding other events locally
+    admins = None
+    if filter_user_id != 0:
+        try:
+            admins = [await scheduler.call(client.get_input_entity, filter_user_id)]
+        except ValueError:
+            print(f"User {filter_user_id} is unknown to this session, filtering locally instead")
+
+    # Export settings the saved resume state must match
+    query = {
+        "mode": mode,
+        "min_id": min_id,
+        "max_id": max_id,
+        "filter_user_id": filter_user_id,
+        "since": since.isoformat() if since else None,
+        "until": until.isoformat() if until else None,
+    }
+
+    # What the manifests must add, unless they no longer match the dumps and are rebuilt
+    manifest_changes = ManifestChanges(rescan=not manifest_is_current(base_folder))
+
+    # One output target per requested thread
+    targets = []
+    for thread_id in message_thread_ids or [0]:
+        folder = thread_output_folder(base_folder, thread_id)
+        os.makedirs(folder, exist_ok=True)
+        index = MessageIndex(folder, iter_dump_records(folder))
+        if not index.created:
+            # Records a crashed run wrote after its last checkpoint are not indexed yet
+            index.add_records(records_after(folder, index.checkpoint))
+        index.commit(segments_end(folder))
+        # From now on the index is committed with every checkpoint of the records
+        writer = open_dump_writer(folder, storage, compact, on_flush=index.commit)
+        targets.append({
+            "thread_id": thread_id,
+            "folder": folder,
+            "writer": writer,
+            "index": index,
+            "state": CrawlState.load(folder, query),
+            "manifest": manifest_changes,
+            "c": 0,  # Counter for text messages
+            "m": 0,  # Counter for media messages
+        })
+
+    # All targets are crawled together, so only the range every one of them has done is skipped
+    state = CrawlState.combine([target["state"] for target in targets], query)
+
+    # Passes over the admin log: (kind, lower event bound, upper event bound)
+    passes = []
+    if state.newest_event_id:
+        # Only events newer than the last run
+        passes.append(("new", max(min_id, state.newest_event_id), max_id))
+        if not state.complete:
+            print(f"Resuming interrupted crawl below event {state.oldest_event_id}")
+    if not state.complete:
+        # First crawl, or continue an interrupted one from where it stopped
+        passes.append(("resume", min_id, state.oldest_event_id - 1 if state.oldest_event_id else max_id))
+
+    limit_per_request: int = max(1, min(page_size, ADMIN_LOG_PAGE_MAX))  # Number of events per request
+    checkpoint_pages: int = 10  # Pages between resume state checkpoints
+    pages: int = 0
+    exported: int = 0  # Deleted messages matching the filters, saved or being saved
+    interval = AdaptiveInterval(*watch_interval) if watch_interval is not None else None
+
+    store = MediaStore(base_folder)
+    failed_runs: dict[int, int] = {}  # Event ID -> runs its media failed in before this one
+    deferred: set[int] = set()  # Events whose media failed in this run, kept for the next
+    pipeline = MediaDownloadPipeline(workers=download_workers, max_in_flight=max_in_flight)
+    pipeline.start()
+    # Replaces a log line per message, which slows down large exports
+    progress = Progress(metrics, target_group_id, queue_depth=lambda: pipeline.in_flight)
+
+    async def checkpoint() -> None:
+        """Persists the resume state once every record before it is on disk."""
+        if not all(target["writer"].durable for target in targets):
+            return
+        await pipeline.drain()
+        for target in targets:
+            target["writer"].flush()
+            target["index"].commit()
+            state.save(target["folder"])
+
+    async def refresh_manifests() -> None:
+        """
+        Adds the messages saved since the last refresh to the group and global
+        manifests; a failure does not end the export. The file I/O (and a full
+        summary when one is needed) runs in a worker thread, so the other
+        exports on the event loop keep going.
+        """
+        changes = manifest_changes.take()
+        try:
+            await asyncio.get_running_loop().run_in_executor(
+                None, update_manifests, base_folder, target_group_id, changes
+            )
+        except OSError as e:
+            print(f"Could not update the backup manifest: {e}")
+            # The changes taken are lost, so the next refresh summarizes the group in full
+            manifest_changes.rescan = True
+
+    async def handle_event(event) -> bool:
+        """Filters an admin log event and saves its message; returns True if it is being saved."""
+        nonlocal exported
+        # Check if message was deleted and meets ID criteria
+        if not event.deleted_message or event.old.id < min_id:
+            return False
+        # Apply user filter if specified (0 means no filter)
+        if filter_user_id != 0 and event.user_id != filter_user_id:
+            return False
+        # Apply deletion date range if specified
+        if (since and event.date < since) or (until and event.date >= until):
+            return False
+
+        # Apply thread filter: fan the message out to every matching thread
+        # that has not saved this message yet
+        matched = [
+            target for target in targets
+            if message_in_thread(event.old, target["thread_id"])
+            and event.old.id not in target["index"]
+        ]
+        if not matched:
+            return False
+
+        if mode == 3 and event.old.media:
+            return False
+        if mode == 2 and not event.old.media:
+            return False
+
+        exported += 1
+        message_json = None
+        if mode in (1, 3):
+            message_json = message_to_dict(event.old, message_profile)
+            # Who deleted the message (indexed by the viewer's search)
+            message_json["deleted_by"] = event.user_id
+
+        entries = [
+            (target, dict(message_json) if message_json is not None else None)
+            for target in matched
+        ]
+
+        # Media is downloaded by the worker pool while paging continues;
+        # the worker saves the message once local_media_file is known
+        if mode in (1, 2) and event.old.media:
+            await pipeline.submit(download_event_media, event, entries, store, download, progress, thumbnail, defer)
+        else:
+            save_message(event, entries, progress)
+        return True
+
+    def defer(event) -> bool:
+        """Keeps a message whose media failed for the next run; False once it has failed too often."""
+        runs = failed_runs.get(event.id, 0) + 1
+        if runs >= MEDIA_RETRY_RUNS:
+            store.resolve(event.id)
+            return False
+        store.defer(event, runs)
+        deferred.add(event.id)
+        return True
+
+    async def retry_pending_media() -> None:
+        """Saves the messages whose media failed in an earlier run, resuming their downloads."""
+        for event, runs in store.pending_events():
+            # Fetched again while the admin log still has it, for a fresh file reference
+            events = await scheduler.call(
+                fetch_admin_log_page, client, group,
+                min_id=event.id - 1, max_id=event.id + 1, limit=3, admins=admins,
+            )
+            event = next((fresh for fresh in events if fresh.id == event.id), event)
+            failed_runs[event.id] = runs
+            print(f"Retrying the media of message {event.old.id} (failed in {runs} earlier runs)")
+            if not await handle_event(event):
+                # Saved in the meantime, or not part of this export
+                store.resolve(event.id)
+        await pipeline.drain()
+        for event_id in failed_runs:
+            if event_id not in deferred:
+                store.resolve(event_id)
+
+    async def run_pass(kind: str, pass_min_id: int, pass_max_id: int) -> bool:
+        """Reads one event range of the admin log; returns False if it was stopped early."""
+        nonlocal pages, exported
+        newest_seen = 0
+        while True:
+            if stop is not None and stop.is_set():
+                return False
+            events = await scheduler.call(
+                fetch_admin_log_page,
+                client,
+                group,
+                min_id=pass_min_id or 0,
+                max_id=pass_max_id or 0,
+                limit=limit_per_request,
+                admins=admins,
+            )
+
+            progress.count("backup_admin_log_pages_total")
+            progress.count("backup_events_total", len(events))
+            if not events:
+                if interval is None:
+                    print("Loading complete, no new messages.")
+                break
+            newest_seen = newest_seen or events[0].id
+
+            for event in events:
+                await handle_event(event)
+
+            pass_max_id = (
+                events[-1].id - 1
+            )  # Exclude the last received event from the next request
+
+            if kind == "resume":
+                state.newest_event_id = state.newest_event_id or newest_seen
+                state.oldest_event_id = events[-1].id
+            pages += 1
+            if pages % checkpoint_pages == 0:
+                await checkpoint()
+
+            if pass_max_id < pass_min_id:
+                print("Reached the lower message ID limit.")
+                break
+            # Events come newest first, so nothing older can match the date range
+            if since and events[-1].date < since:
+                print("Reached the start of the date range.")
+                break
+
+        # The pass finished: its whole range is now processed
+        if kind == "resume":
+            state.complete = True
+        elif newest_seen:
+            state.newest_event_id = max(state.newest_event_id, newest_seen)
+        return True
+
+    try:
+        await retry_pending_media()
+        for kind, pass_min_id, pass_max_id in passes:
+            if not await run_pass(kind, pass_min_id, pass_max_id):
+                break
+
+        if interval is not None:
+            # Watch mode: keep everything open and poll for events newer than the last one seen
+            await checkpoint()
+            manifest_updated = time.monotonic()
+            print(f"Watching {target_group_id} for new deletions (next poll in {interval.current:.0f}s)")
+            while not await wait_or_stop(stop, interval.current):
+                before = exported
+                try:
+                    await run_pass("new", max(min_id, state.newest_event_id), max_id)
+                except (RPCError, ConnectionError) as e:
+                    print(f"Polling {target_group_id} failed, retrying later: {e}")
+                await checkpoint()
+                found = exported - before
+                interval.update(found)
+                if found:
+                    print(f"{found} new deleted messages in {target_group_id}, next poll in {interval.current:.0f}s")
+                    if time.monotonic() - manifest_updated >= MANIFEST_UPDATE_INTERVAL:
+                        await refresh_manifests()
+                        manifest_updated = time.monotonic()
+    finally:
+        try:
+            # Wait for the remaining downloads so every local_media_file entry is filled in
+            await pipeline.close()
+        finally:
+            progress.update(force=True)
+            for target in targets:
+                target["writer"].close()
+                target["index"].close()
+                print(f"Saved {target['writer'].count} messages to {target['writer'].path}")
+            # Saved last, so the state never covers messages that are not on disk. After a
+            # failed job it is not saved at all: the next run continues from the last
+            # checkpoint and fetches the message whose save failed again.
+            if not pipeline.failed:
+                for target in targets:
+                    state.save(target["folder"])
+            store.close()
+            if store.reused:
+                print(
+                    f"Reused {store.reused} stored media files "
+                    f"({store.bytes_saved / 1024 / 1024:.1f} MB not downloaded again)"
+                )
+            # Nothing new to summarize unless messages were saved
+            if exported or not os.path.exists(os.path.join(base_folder, MANIFEST_FILE)):
+                await refresh_manifests()
+    return exported
@@ -0,0 +1,353 @@
+"""
+Backup manifests for the viewer.
+
+Each group folder gets a ``manifest.json`` describing its backups (the
+whole-group backup and every ``thread_<id>`` folder): message and media counts,
+the date range of the messages and the bytes used by the dump and the media.
+``backup/manifest.json`` summarizes every group. Both are rewritten atomically
+at the end of each export that saved messages, so the viewer can list and size
+backups without walking the tree.
+
+An export does not reread the backup for this: it records what it saved in a
+ManifestChanges and adds that to the previous manifest. The backup is only
+summarized in full when there is no manifest yet, or when the dumps on disk no
+longer match it (an export that crashed before updating it, a pack).
+
+Usage: python -m src.backup.manifest <group backup folder> [<group backup folder> ...]
+"""
+
+import os
+import sys
+import json
+import threading
+from datetime import datetime, timezone
+
+from .archive import archived_backup, archived_file
+from .storage import DUMP_FILE, dump_files, iter_dump_records, segment_files
+
+MANIFEST_FILE: str = "manifest.json"
+MANIFEST_VERSION: int = 1
+
+# Exports running in worker threads update the global manifest one at a time
+_global_manifest_lock: threading.Lock = threading.Lock()
+
+
+def write_json_atomic(path: str, data: dict) -> None:
+    """
+    Writes a JSON file so readers only ever see the old or the new version.
+
+    :param path: Destination file.
+    :param data: JSON data.
+    """
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def has_dump(folder: str) -> bool:
+    """
+    Tells whether a folder holds a backup (dump.json, JSONL segments or an archive).
+
+    :param folder: Backup folder (group or thread).
+    """
+    return bool(dump_files(folder))
+
+
+class ManifestChanges:
+    """
+    Messages and media an export saved since the manifests were last written.
+
+    :param rescan: Summarize the backups in full instead of adding the changes.
+    """
+
+    def __init__(self, rescan: bool = False) -> None:
+        self.rescan: bool = rescan
+        self.folders: dict[str, dict] = {}  # Backup folder -> counts added to its entry
+        self.media_bytes: int = 0  # Bytes of media files new to the group
+
+    def _folder(self, folder: str) -> dict:
+        return self.folders.setdefault(os.path.normpath(folder), {
+            "messages": 0, "media": 0, "first_date": None, "last_date": None, "media_bytes": 0,
+        })
+
+    def add_message(self, folder: str, record: dict) -> None:
+        """
+        Counts a message written to the dump of a backup folder.
+
+        :param folder: Backup folder (group or thread).
+        :param record: Message record.
+        """
+        changes = self._folder(folder)
+        changes["messages"] += 1
+        date = record.get("date")
+        if date:
+            changes["first_date"] = min(filter(None, (changes["first_date"], date)))
+            changes["last_date"] = max(filter(None, (changes["last_date"], date)))
+        local_media_file = record.get("local_media_file")
+        if local_media_file and local_media_file.get("local_path"):
+            changes["media"] += 1
+
+    def add_media_file(self, folders: list[str], size: int) -> None:
+        """
+        Counts a downloaded media file once for the group and once for every backup folder using it.
+
+        :param folders: Backup folders whose messages refer to the file.
+        :param size: File size.
+        """
+        self.media_bytes += size
+        for folder in folders:
+            self._folder(folder)["media_bytes"] += size
+
+    def take(self) -> "ManifestChanges":
+        """Returns the changes recorded so far and starts over."""
+        taken = ManifestChanges(self.rescan)
+        taken.folders, taken.media_bytes = self.folders, self.media_bytes
+        self.folders, self.media_bytes = {}, 0
+        self.rescan = False
+        return taken
+
+
+def summarize_folder(folder: str) -> tuple[dict, set[str]]:
+    """
+    Counts the messages and media of one backup folder.
+
+    :param folder: Backup folder (group or thread).
+    :return: (summary, paths of the media files the messages refer to).
+    """
+    messages = media = 0
+    first_date = last_date = None
+    media_paths: set[str] = set()
+    for record in iter_dump_records(folder):
+        messages += 1
+        date = record.get("date")
+        if date:
+            first_date = date if first_date is None else min(first_date, date)
+            last_date = date if last_date is None else max(last_date, date)
+        local_media_file = record.get("local_media_file")
+        if local_media_file and local_media_file.get("local_path"):
+            media += 1
+            media_paths.add(os.path.normpath(os.path.join(folder, local_media_file["local_path"])))
+
+    summary = {
+        "messages": messages,
+        "media": media,
+        "first_date": first_date,
+        "last_date": last_date,
+        "dump_bytes": dump_size(folder),
+        "media_bytes": sum(_file_size(path) for path in media_paths),
+    }
+    return summary, media_paths
+
+
+def dump_size(folder: str) -> int:
+    """
+    Returns the bytes used by the dump of a backup folder, packed or not.
+
+    :param folder: Backup folder (group or thread).
+    """
+    dump_paths = segment_files(folder) or [os.path.join(folder, DUMP_FILE)]
+    size = sum(_file_size(path) for path in dump_paths)
+    archived = archived_backup(folder)
+    if archived is not None:
+        archive, section = archived
+        size += archive.sections[section]["length"]
+    return size
+
+
+def _file_size(path: str) -> int:
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        # Packed media is no longer on disk
+        archived = archived_file(path)
+        return archived[1][1] if archived is not None else 0
+
+
+def build_group_manifest(base_folder: str, group_id: int) -> dict:
+    """
+    Summarizes every backup of a group.
+
+    :param base_folder: Base backup folder of the group or channel.
+    :param group_id: ID of the group or channel.
+    """
+    threads = []
+    all_media: set[str] = set()
+    for thread, folder in backup_folders(base_folder):
+        summary, media_paths = summarize_folder(folder)
+        all_media |= media_paths
+        threads.append({"thread": thread, "folder": os.path.relpath(folder, base_folder), **summary})
+    # Media shared by several threads is stored once, so it is counted once
+    return _group_manifest(group_id, threads, sum(_file_size(path) for path in all_media))
+
+
+def backup_folders(base_folder: str) -> list[tuple[str, str]]:
+    """
+    Lists the backups of a group in manifest order.
+
+    :param base_folder: Base backup folder of the group or channel.
+    :return: (thread name, folder) pairs, the whole-group backup as "no-thread".
+    """
+    folders = []
+    if has_dump(base_folder):
+        folders.append(("no-thread", base_folder))
+    for name in sorted(os.listdir(base_folder)):
+        thread = name.removeprefix("thread_")
+        path = os.path.join(base_folder, name)
+        if name.startswith("thread_") and thread.isdigit() and has_dump(path):
+            folders.append((thread, path))
+    return sorted(folders, key=lambda item: (item[0] != "no-thread", item[0].zfill(20)))
+
+
+def _group_manifest(group_id: int, threads: list[dict], media_bytes: int) -> dict:
+    first_dates = [t["first_date"] for t in threads if t["first_date"]]
+    last_dates = [t["last_date"] for t in threads if t["last_date"]]
+    return {
+        "version": MANIFEST_VERSION,
+        "group_id": abs(group_id),
+        "updated_at": datetime.now(timezone.utc).isoformat(),
+        "threads": threads,
+        "messages": sum(t["messages"] for t in threads),
+        "media": sum(t["media"] for t in threads),
+        "first_date": min(first_dates, default=None),
+        "last_date": max(last_dates, default=None),
+        "dump_bytes": sum(t["dump_bytes"] for t in threads),
+        "media_bytes": media_bytes,
+    }
+
+
+def load_group_manifest(base_folder: str) -> dict | None:
+    """
+    Reads the manifest of a group, None if there is none or it cannot be read.
+
+    :param base_folder: Base backup folder of the group or channel.
+    """
+    try:
+        with open(os.path.join(base_folder, MANIFEST_FILE), 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(manifest, dict) or manifest.get("version") != MANIFEST_VERSION:
+        return None
+    return manifest
+
+
+def manifest_is_current(base_folder: str) -> bool:
+    """
+    Tells whether the manifest of a group matches the dumps on disk, so an
+    export can add its changes to it instead of summarizing the group again.
+    Only file sizes are compared.
+
+    :param base_folder: Base backup folder of the group or channel.
+    """
+    manifest = load_group_manifest(base_folder)
+    if manifest is None:
+        return False
+    recorded = {
+        os.path.normpath(os.path.join(base_folder, t["folder"])): t["dump_bytes"]
+        for t in manifest.get("threads", [])
+    }
+    on_disk = {os.path.normpath(folder): dump_size(folder) for _, folder in backup_folders(base_folder)}
+    return recorded == on_disk
+
+
+def apply_changes(base_folder: str, group_id: int, changes: ManifestChanges) -> dict | None:
+    """
+    Adds the changes of an export to the previous manifest of a group.
+
+    :param base_folder: Base backup folder of the group or channel.
+    :param group_id: ID of the group or channel.
+    :param changes: What the export saved since the manifest was written.
+    :return: The updated manifest, None if it must be built in full instead.
+    """
+    manifest = load_group_manifest(base_folder)
+    if manifest is None:
+        return None
+    threads = {
+        os.path.normpath(os.path.join(base_folder, t["folder"])): t
+        for t in manifest.get("threads", [])
+    }
+    new_folders = {
+        os.path.normpath(folder): thread for thread, folder in backup_folders(base_folder)
+    }
+    for folder, thread in new_folders.items():
+        if folder not in threads:
+            if folder not in changes.folders:
+                # A backup the manifest does not know about was not made by this export
+                return None
+            threads[folder] = {
+                "thread": thread, "folder": os.path.relpath(folder, base_folder), "messages": 0,
+                "media": 0, "first_date": None, "last_date": None, "dump_bytes": 0, "media_bytes": 0,
+            }
+    for folder, added in changes.folders.items():
+        if folder not in threads:
+            return None
+        entry = threads[folder]
+        entry["messages"] += added["messages"]
+        entry["media"] += added["media"]
+        entry["media_bytes"] += added["media_bytes"]
+        entry["first_date"] = min(filter(None, (entry["first_date"], added["first_date"])), default=None)
+        entry["last_date"] = max(filter(None, (entry["last_date"], added["last_date"])), default=None)
+    for folder, entry in threads.items():
+        # Cheap to measure, and correct even for records still buffered when the manifest was written
+        entry["dump_bytes"] = dump_size(folder)
+    ordered = [threads[folder] for folder in new_folders if folder in threads]
+    return _group_manifest(group_id, ordered, manifest.get("media_bytes", 0) + changes.media_bytes)
+
+
+def update_manifests(base_folder: str, group_id: int, changes: ManifestChanges | None = None) -> dict:
+    """
+    Rewrites the manifest of a group and its entry in the global manifest next to it.
+
+    :param base_folder: Base backup folder of the group or channel (backup/<group id>).
+    :param group_id: ID of the group or channel.
+    :param changes: What an export saved since the manifest was written, added to it
+        instead of summarizing the whole group again. None to summarize in full.
+    :return: The group manifest.
+    """
+    manifest = None
+    if changes is not None and not changes.rescan:
+        manifest = apply_changes(base_folder, group_id, changes)
+    if manifest is None:
+        manifest = build_group_manifest(base_folder, group_id)
+    write_json_atomic(os.path.join(base_folder, MANIFEST_FILE), manifest)
+
+    backup_root = os.path.dirname(os.path.normpath(base_folder))
+    if not backup_root:
+        return manifest
+    global_path = os.path.join(backup_root, MANIFEST_FILE)
+    with _global_manifest_lock:
+        try:
+            with open(global_path, 'r', encoding='utf-8') as f:
+                global_manifest = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            global_manifest = {}
+        groups = global_manifest.get("groups", {})
+        groups[os.path.basename(os.path.normpath(base_folder))] = {
+            key: value for key, value in manifest.items() if key not in ("version", "threads")
+        } | {"threads": [t["thread"] for t in manifest["threads"]]}
+        write_json_atomic(global_path, {
+            "version": MANIFEST_VERSION,
+            "updated_at": manifest["updated_at"],
+            "groups": dict(sorted(groups.items())),
+        })
+    return manifest
+
+
+def main() -> int:
+    """Rewrites the manifests of the group folders given on the command line."""
+    folders = sys.argv[1:]
+    if not folders:
+        print("Usage: python -m src.backup.manifest <group backup folder> [<group backup folder> ...]")
+        return 1
+    for folder in folders:
+        manifest = update_manifests(folder, int(os.path.basename(os.path.normpath(folder))))
+        print(f"{folder}: {len(manifest['threads'])} backups, {manifest['messages']} messages, "
+              f"{manifest['media']} media files")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
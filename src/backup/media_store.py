@@ -0,0 +1,237 @@
+"""
+Content-addressed media store.
+
+Photos and documents are stored once per group under ``.media/<key>/``, where
+the key is Telegram's file identity (``photo_<id>`` or ``document_<id>``). An
+SQLite index maps keys to the stored files, so media that was reposted, that
+belongs to several threads or that was saved by an earlier run is never
+downloaded again. Per-message folders get hardlinks to the shared copy. Files
+that were packed into an archive and pruned (see pack.py) still count as
+stored: they are read from the archive instead.
+
+The index also keeps the deleted messages whose media could not be saved,
+serialized, so the next run can retry (and resume) the download even when the
+admin log no longer has the event.
+"""
+
+import os
+import asyncio
+import sqlite3
+from datetime import datetime
+from types import SimpleNamespace
+from typing import Any, Awaitable, Callable
+
+from telethon.extensions import BinaryReader
+from telethon.tl.types import MessageMediaDocument, MessageMediaPhoto
+
+from .archive import archived_file
+
+STORE_FOLDER: str = ".media"
+INDEX_FILE: str = "index.sqlite"
+
+
+def media_identity(media) -> tuple[str, int, int] | None:
+    """
+    Returns (key, file id, access hash) of a photo or document, or None for
+    media without a Telegram file (locations, polls, ...).
+
+    :param media: Telethon message media.
+    """
+    if isinstance(media, MessageMediaPhoto) and media.photo is not None:
+        file = media.photo
+        kind = "photo"
+    elif isinstance(media, MessageMediaDocument) and media.document is not None:
+        file = media.document
+        kind = "document"
+    else:
+        return None
+    file_id = getattr(file, "id", None)
+    if file_id is None:
+        return None
+    return f"{kind}_{file_id}", file_id, getattr(file, "access_hash", 0)
+
+
+def link_into(source_path: str, target_folder: str) -> str | None:
+    """
+    Hardlinks a stored file into a per-message folder (symlink if hardlinks are
+    not supported). No copy is made, so linking costs no extra disk. A different
+    file of the same name in the folder is kept: the link then gets a numbered
+    name, as Telethon does for downloads ("name (1).ext").
+
+    :param source_path: Path of the stored file.
+    :param target_folder: Per-message folder.
+    :return: Path of the link, None if no link could be made.
+    """
+    os.makedirs(target_folder, exist_ok=True)
+    stem, ext = os.path.splitext(os.path.basename(source_path))
+    target_path = os.path.join(target_folder, stem + ext)
+    i = 1
+    while os.path.lexists(target_path):
+        if _same_file(source_path, target_path):
+            return target_path
+        target_path = os.path.join(target_folder, f"{stem} ({i}){ext}")
+        i += 1
+    try:
+        os.link(source_path, target_path)
+    except OSError:
+        try:
+            os.symlink(os.path.relpath(source_path, target_folder), target_path)
+        except OSError:
+            return None
+    return target_path
+
+
+def _same_file(path: str, other_path: str) -> bool:
+    """Tells whether two paths lead to the same file (False for a dangling link)."""
+    try:
+        return os.path.samefile(path, other_path)
+    except OSError:
+        return False
+
+
+class MediaStore:
+    """
+    Shared media files of one group, indexed by Telegram file identity.
+
+    :param base_folder: Base backup folder of the group or channel.
+    """
+
+    def __init__(self, base_folder: str) -> None:
+        self.folder: str = os.path.join(base_folder, STORE_FOLDER)
+        os.makedirs(self.folder, exist_ok=True)
+        self._db: sqlite3.Connection = sqlite3.connect(os.path.join(self.folder, INDEX_FILE))
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS media ("
+            "key TEXT PRIMARY KEY, file_id INTEGER, access_hash INTEGER, "
+            "path TEXT NOT NULL, size INTEGER)"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS pending ("
+            "event_id INTEGER PRIMARY KEY, message BLOB NOT NULL, user_id INTEGER, "
+            "date TEXT, runs INTEGER NOT NULL)"
+        )
+        self._db.commit()
+        self._pending: dict[str, asyncio.Future] = {}
+        self.downloaded: int = 0  # Files fetched from Telegram
+        self.reused: int = 0  # Files served from the store
+        self.bytes_saved: int = 0  # Bytes not downloaded thanks to the store
+
+    def lookup(self, key: str) -> str | None:
+        """
+        Returns the stored file of a key, or None if it is neither on disk nor
+        in an archive of the group any more. A packed file's path is returned
+        although it is not on disk; readers find it in the archive.
+
+        :param key: Media key.
+        """
+        row = self._db.execute("SELECT path FROM media WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        path = os.path.join(self.folder, row[0])
+        if os.path.exists(path) or self.archived(path) is not None:
+            return path
+        return None
+
+    async def fetch(
+        self,
+        media,
+        download: Callable[[Any, str], Awaitable[str | None]],
+    ) -> tuple[str | None, bool]:
+        """
+        Returns the stored file of a media, downloading it only if it is new.
+        Concurrent requests for the same file share one download.
+
+        :param media: Telethon message media with a photo or document.
+        :param download: Coroutine function downloading media into a folder.
+        :return: (path, reused) where reused tells whether no download was needed.
+        """
+        key, file_id, access_hash = media_identity(media)
+        path = self.lookup(key)
+        if path:
+            self._count_reuse(path)
+            return path, True
+        if key in self._pending:
+            path = await asyncio.shield(self._pending[key])
+            if path:
+                self._count_reuse(path)
+            return path, True
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending[key] = future
+        try:
+            path = await download(media, os.path.join(self.folder, key))
+            if path:
+                self.downloaded += 1
+                self._db.execute(
+                    "INSERT OR REPLACE INTO media (key, file_id, access_hash, path, size) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (key, file_id, access_hash, os.path.relpath(path, self.folder),
+                     os.path.getsize(path)),
+                )
+                self._db.commit()
+            future.set_result(path)
+            return path, False
+        except BaseException:
+            future.set_result(None)
+            raise
+        finally:
+            del self._pending[key]
+
+    def defer(self, event, runs: int) -> None:
+        """
+        Keeps a deleted message whose media could not be saved for the next run.
+
+        :param event: Admin log event of the deleted message.
+        :param runs: Runs the media has failed in so far.
+        """
+        self._db.execute(
+            "INSERT OR REPLACE INTO pending (event_id, message, user_id, date, runs) VALUES (?, ?, ?, ?, ?)",
+            (event.id, bytes(event.old), event.user_id, event.date.isoformat(), runs),
+        )
+        self._db.commit()
+
+    def pending_events(self) -> list[tuple[Any, int]]:
+        """
+        Returns the kept messages as admin log events, with the runs their media failed in.
+        """
+        rows = self._db.execute("SELECT event_id, message, user_id, date, runs FROM pending ORDER BY event_id")
+        return [
+            (SimpleNamespace(
+                id=event_id,
+                deleted_message=True,
+                old=BinaryReader(message).tgread_object(),
+                user_id=user_id,
+                date=datetime.fromisoformat(date),
+            ), runs)
+            for event_id, message, user_id, date, runs in rows.fetchall()
+        ]
+
+    def resolve(self, event_id: int) -> None:
+        """
+        Forgets a kept message (saved, or given up on).
+
+        :param event_id: Admin log event ID.
+        """
+        self._db.execute("DELETE FROM pending WHERE event_id = ?", (event_id,))
+        self._db.commit()
+
+    def archived(self, path: str) -> list | None:
+        """
+        Returns the archive entry of a file of the group that was packed, None if it was not.
+
+        :param path: Path the file had before it was packed.
+        """
+        found = archived_file(path, os.path.dirname(self.folder))
+        return found[1] if found is not None else None
+
+    def _count_reuse(self, path: str) -> None:
+        self.reused += 1
+        try:
+            self.bytes_saved += os.path.getsize(path)
+        except OSError:
+            archived = self.archived(path)
+            self.bytes_saved += archived[1] if archived is not None else 0
+
+    def close(self) -> None:
+        """Closes the index."""
+        self._db.close()
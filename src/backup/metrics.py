@@ -0,0 +1,339 @@
+"""
+Counters, gauges and histograms for the exporter and the viewer.
+
+A Metrics registry is shared by everything that reports into it and is safe to
+use from several threads. It renders the Prometheus text format (served by
+serve_metrics or the viewer's /metrics) and a JSON snapshot (written
+periodically by StatsFile). Progress prints a throttled one-line summary of
+an export instead of a line per message.
+"""
+
+import time
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Iterator
+
+from .manifest import write_json_atomic
+
+# Seconds; covers fast local work up to slow media downloads
+DEFAULT_BUCKETS: tuple[float, ...] = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+PROGRESS_INTERVAL: float = 5.0
+STATS_INTERVAL: float = 15.0
+
+# Metrics reported by export_messages and the request scheduler
+BACKUP_METRICS: dict[str, str] = {
+    "backup_api_requests_total": "Telegram API calls made, by method",
+    "backup_api_request_seconds": "Duration of Telegram API calls, by method",
+    "backup_scheduler_wait_seconds": "Time API calls waited for a request slot",
+    "backup_flood_waits_total": "FloodWait answers received",
+    "backup_flood_wait_seconds_total": "Seconds Telegram asked to wait after FloodWait",
+    "backup_request_rate": "Current request scheduler rate (calls per second)",
+    "backup_admin_log_pages_total": "Admin log pages fetched",
+    "backup_events_total": "Admin log events read",
+    "backup_messages_saved_total": "Deleted messages saved (once per thread backup)",
+    "backup_media_downloaded_total": "Media files downloaded",
+    "backup_media_reused_total": "Media files served from the shared media store",
+    "backup_media_failed_total": "Media files that could not be downloaded",
+    "backup_media_bytes_total": "Bytes of media downloaded",
+    "backup_media_download_seconds": "Time to download one media file, including FloodWait retries",
+    "backup_download_queue_depth": "Media downloads queued or running",
+}
+
+
+def _label_key(labels: dict) -> tuple[tuple[str, str], ...]:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(key: tuple[tuple[str, str], ...], extra: tuple[tuple[str, str], ...] = ()) -> str:
+    pairs = key + extra
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Histogram:
+    """
+    Distribution of observed values in fixed buckets.
+
+    :param buckets: Upper bounds of the buckets, ascending.
+    """
+
+    def __init__(self, buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        self.buckets: tuple[float, ...] = buckets
+        self.counts: list[int] = [0] * len(buckets)
+        self.count: int = 0
+        self.sum: float = 0.0
+
+    def observe(self, value: float) -> None:
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def cumulative(self) -> list[tuple[float, int]]:
+        """Returns (upper bound, observations at or below it), ending with +Inf."""
+        total = 0
+        result = []
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            result.append((bound, total))
+        result.append((float("inf"), self.count))
+        return result
+
+
+class Metrics:
+    """
+    Thread-safe registry of labelled counters, gauges and histograms.
+
+    :param descriptions: Description of each metric name, used in the Prometheus output.
+    """
+
+    def __init__(self, descriptions: dict[str, str] | None = None) -> None:
+        self.descriptions: dict[str, str] = dict(descriptions or {})
+        self._lock: threading.Lock = threading.Lock()
+        self._counters: dict[str, dict[tuple, float]] = {}
+        self._gauges: dict[str, dict[tuple, float]] = {}
+        self._histograms: dict[str, dict[tuple, Histogram]] = {}
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        """
+        Adds to a counter.
+
+        :param name: Metric name (ending in _total by convention).
+        :param value: Amount to add.
+        :param labels: Label values of the series.
+        """
+        key = _label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels) -> None:
+        """
+        Sets a gauge.
+
+        :param name: Metric name.
+        :param value: Current value.
+        :param labels: Label values of the series.
+        """
+        with self._lock:
+            self._gauges.setdefault(name, {})[_label_key(labels)] = value
+
+    def observe(self, name: str, value: float, buckets: tuple[float, ...] = DEFAULT_BUCKETS, **labels) -> None:
+        """
+        Records a value in a histogram.
+
+        :param name: Metric name.
+        :param value: Observed value (seconds for durations).
+        :param buckets: Bucket bounds, used when the series is created.
+        :param labels: Label values of the series.
+        """
+        key = _label_key(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            if key not in series:
+                series[key] = Histogram(buckets)
+            series[key].observe(value)
+
+    @contextmanager
+    def timer(self, name: str, **labels) -> Iterator[None]:
+        """Observes the duration of the block in a histogram."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def value(self, name: str, **labels) -> float:
+        """
+        Returns a counter or gauge value. Without labels, every series of the name is summed.
+
+        :param name: Metric name.
+        :param labels: Label values of the series.
+        """
+        with self._lock:
+            series = self._counters.get(name) or self._gauges.get(name) or {}
+            if labels:
+                return series.get(_label_key(labels), 0)
+            return sum(series.values())
+
+    def render(self) -> str:
+        """Returns every metric in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            for kind, store in (("counter", self._counters), ("gauge", self._gauges)):
+                for name in sorted(store):
+                    self._header(lines, name, kind)
+                    for key, value in sorted(store[name].items()):
+                        lines.append(f"{name}{_format_labels(key)} {_format_value(value)}")
+            for name in sorted(self._histograms):
+                self._header(lines, name, "histogram")
+                for key, histogram in sorted(self._histograms[name].items()):
+                    for bound, count in histogram.cumulative():
+                        lines.append(f"{name}_bucket{_format_labels(key, (('le', _format_value(bound)),))} {count}")
+                    lines.append(f"{name}_sum{_format_labels(key)} {_format_value(histogram.sum)}")
+                    lines.append(f"{name}_count{_format_labels(key)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def _header(self, lines: list[str], name: str, kind: str) -> None:
+        if name in self.descriptions:
+            lines.append(f"# HELP {name} {self.descriptions[name]}")
+        lines.append(f"# TYPE {name} {kind}")
+
+    def snapshot(self) -> dict:
+        """Returns every metric as JSON-serializable data."""
+        metrics = {}
+        with self._lock:
+            for kind, store in (("counter", self._counters), ("gauge", self._gauges)):
+                for name, series in store.items():
+                    metrics[name] = {"type": kind, "series": [
+                        {"labels": dict(key), "value": value} for key, value in sorted(series.items())
+                    ]}
+            for name, series in self._histograms.items():
+                metrics[name] = {"type": "histogram", "series": [
+                    {
+                        "labels": dict(key),
+                        "count": histogram.count,
+                        "sum": histogram.sum,
+                        "buckets": {_format_value(bound): count for bound, count in histogram.cumulative()},
+                    }
+                    for key, histogram in sorted(series.items())
+                ]}
+        return {"updated_at": datetime.now(timezone.utc).isoformat(), "metrics": dict(sorted(metrics.items()))}
+
+
+class Progress:
+    """
+    Throttled progress line of one export, read from its metrics.
+
+    :param metrics: Registry the export reports into.
+    :param group: Group or channel ID, the label of the export's series.
+    :param queue_depth: Returns the number of downloads queued or running, None if unknown.
+    :param interval: Minimum seconds between two progress lines.
+    """
+
+    def __init__(self, metrics: Metrics, group: int, queue_depth=None, interval: float = PROGRESS_INTERVAL) -> None:
+        self.metrics: Metrics = metrics
+        self.group: str = str(abs(group))
+        self.queue_depth = queue_depth
+        self.interval: float = interval
+        self._start: float = time.monotonic()
+        self._last: float = self._start
+
+    def count(self, name: str, value: float = 1) -> None:
+        """Adds to a counter of the export and prints a progress line if one is due."""
+        self.metrics.inc(name, value, group=self.group)
+        self.update()
+
+    def update(self, force: bool = False) -> None:
+        """
+        Prints a progress line if the interval has passed since the last one.
+
+        :param force: Print regardless of the interval (e.g. at the end of the export).
+        """
+        now = time.monotonic()
+        if not force and now - self._last < self.interval:
+            return
+        self._last = now
+        queued = self.queue_depth() if self.queue_depth is not None else 0
+        self.metrics.set("backup_download_queue_depth", queued, group=self.group)
+
+        def value(name: str) -> float:
+            return self.metrics.value(name, group=self.group)
+
+        events = value("backup_events_total")
+        elapsed = max(now - self._start, 1e-9)
+        print(
+            f"[{self.group}] {events:.0f} events read ({events / elapsed:.0f}/s), "
+            f"{value('backup_messages_saved_total'):.0f} messages saved, "
+            f"{value('backup_media_downloaded_total'):.0f} media downloaded "
+            f"({value('backup_media_bytes_total') / 1024 / 1024:.1f} MB), "
+            f"{value('backup_media_reused_total'):.0f} reused, "
+            f"{value('backup_media_failed_total'):.0f} failed, {queued} downloads queued, "
+            f"FloodWait {self.metrics.value('backup_flood_wait_seconds_total'):.0f}s"
+        )
+
+
+class StatsFile:
+    """
+    Writes a JSON snapshot of the metrics to a file periodically, from a background thread.
+
+    :param metrics: Registry to snapshot.
+    :param path: Destination file (replaced atomically).
+    :param interval: Seconds between two snapshots.
+    """
+
+    def __init__(self, metrics: Metrics, path: str, interval: float = STATS_INTERVAL) -> None:
+        self.metrics: Metrics = metrics
+        self.path: str = path
+        self.interval: float = interval
+        self._stop: threading.Event = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def write(self) -> None:
+        try:
+            write_json_atomic(self.path, self.metrics.snapshot())
+        except OSError as e:
+            print(f"Could not write the stats file {self.path}: {e}")
+
+    def close(self) -> None:
+        """Stops the thread and writes a last snapshot."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.write()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.write()
+
+
+def serve_metrics(metrics: Metrics, host: str = "127.0.0.1", port: int = 9464) -> ThreadingHTTPServer:
+    """
+    Serves the metrics at http://host:port/metrics for Prometheus, from a background thread.
+
+    :param metrics: Registry to serve.
+    :param host: Address to bind to.
+    :param port: Port to listen on (0 picks a free one).
+    :return: The running server (call shutdown() to stop it).
+    """
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?", 1)[0] != "/metrics":
+                self.send_error(404, "Not found")
+                return
+            body = metrics.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
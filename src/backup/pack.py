@@ -0,0 +1,222 @@
+"""
+Packing of finished backups into single-file archives for cold storage.
+
+A group or thread backup folder, with the thread backups inside it, is
+streamed into ``backup.pack`` in that folder (see archive.py): the messages as
+compressed JSON lines and every media file and thumbnail the messages refer to,
+each stored once. The viewer reads messages and media straight from the
+archive. With ``--prune`` the packed dump files, media and thumbnails are
+removed afterwards, leaving the archive, the (empty) backup folders and the
+resume state, so the backup can still be continued. Messages exported later are
+written next to the archive as usual; packing again merges them in.
+
+Usage: python -m src.backup.pack [--prune] [--level N] <backup folder> [<backup folder> ...]
+"""
+
+import os
+import sys
+import argparse
+from typing import Iterator
+
+from .archive import ARCHIVE_FILE, ArchiveWriter, BackupArchive, archive_key, archived_file, zstd
+from .manifest import has_dump, update_manifests
+from .storage import DUMP_FILE, iter_dump_records, segment_files
+
+
+def backup_sections(folder: str) -> list[tuple[str, str]]:
+    """
+    Lists the backups packed together: the folder itself and its thread folders.
+
+    :param folder: Backup folder (group or thread).
+    :return: (section name, folder) pairs.
+    """
+    sections = [(".", folder)] if has_dump(folder) else []
+    for name in sorted(os.listdir(folder)):
+        path = os.path.join(folder, name)
+        if name.startswith("thread_") and name.removeprefix("thread_").isdigit() and has_dump(path):
+            sections.append((name, path))
+    return sections
+
+
+def record_files(folder: str, record: dict) -> list[str]:
+    """
+    Returns the media file and thumbnail a message refers to.
+
+    :param folder: Backup folder the message belongs to.
+    :param record: Message record.
+    """
+    local_media_file = record.get("local_media_file") or {}
+    return [
+        os.path.normpath(os.path.join(folder, local_media_file[field]))
+        for field in ("local_path", "thumbnail")
+        if local_media_file.get(field)
+    ]
+
+
+def _collect_files(folder: str, referenced: list[str]) -> Iterator[dict]:
+    """Yields the messages of a backup, adding the files they refer to to referenced."""
+    for record in iter_dump_records(folder):
+        referenced.extend(record_files(folder, record))
+        yield record
+
+
+def pack_backup(folder: str, level: int | None = None, prune: bool = False) -> dict:
+    """
+    Packs a backup folder into its archive.
+
+    :param folder: Backup folder (group or thread).
+    :param level: Compression level of the messages (zstd 1-22 or gzip 1-9).
+    :param prune: Remove the packed files once the archive has been verified.
+    :return: Summary of the packing.
+    """
+    sections = backup_sections(folder)
+    if not sections:
+        raise ValueError(f"{folder} holds no backup")
+    archive_path = os.path.join(folder, ARCHIVE_FILE)
+    writer = ArchiveWriter(archive_path, level)
+    packed_paths: set[str] = set()  # Loose files now stored in the archive
+    missing = 0
+    try:
+        for section, path in sections:
+            referenced: list[str] = []
+            writer.add_records(section, _collect_files(path, referenced))
+            for media_path in referenced:
+                key = archive_key(media_path, folder)
+                if os.path.isfile(media_path):
+                    writer.add_file(key, media_path)
+                    packed_paths.add(media_path)
+                    continue
+                # Packed before: copied over from the previous archive
+                archived = archived_file(media_path, folder)
+                if archived is not None:
+                    writer.add_entry(key, *archived)
+                elif key not in writer.files:
+                    missing += 1
+            packed_paths.update(segment_files(path))
+            if os.path.isfile(os.path.join(path, DUMP_FILE)):
+                packed_paths.add(os.path.join(path, DUMP_FILE))
+            # A thread packed on its own before is now part of this archive
+            if path != folder and os.path.isfile(os.path.join(path, ARCHIVE_FILE)):
+                packed_paths.add(os.path.join(path, ARCHIVE_FILE))
+    except BaseException:
+        writer.abort()
+        raise
+    writer.close()
+
+    # Read the archive back before anything is removed
+    archive = BackupArchive(archive_path)
+    for section, info in writer.sections.items():
+        if sum(1 for _ in archive.iter_records(section)) != info["count"]:
+            raise ValueError(f"{archive_path}: section {section} does not read back completely")
+    archive_size = os.path.getsize(archive_path)
+    if any(offset + size > archive_size for offset, size, _ in archive.files.values()):
+        raise ValueError(f"{archive_path}: file index points past the end of the archive")
+
+    summary = {
+        "archive": archive_path,
+        "backups": len(sections),
+        "messages": sum(info["count"] for info in writer.sections.values()),
+        "files": len(archive.files),
+        "missing_files": missing,
+        "packed_bytes": _total_size(packed_paths),
+        "archive_bytes": archive_size,
+        "removed_files": prune_packed(folder, packed_paths, [path for _, path in sections]) if prune else 0,
+    }
+    return summary
+
+
+def _total_size(paths: set[str]) -> int:
+    total = 0
+    seen = set()
+    for path in paths:
+        st = os.stat(path)
+        if (st.st_dev, st.st_ino) not in seen:
+            seen.add((st.st_dev, st.st_ino))
+            total += st.st_size
+    return total
+
+
+def prune_packed(folder: str, packed_paths: set[str], keep_folders: list[str]) -> int:
+    """
+    Removes the packed files inside a backup folder, and their hard links (the
+    per-message links into the shared media store), then the folders left empty.
+
+    :param folder: Packed backup folder; nothing outside it is removed.
+    :param packed_paths: Files stored in the archive.
+    :param keep_folders: Backup folders kept even when empty.
+    :return: Number of files removed.
+    """
+    root = os.path.normpath(folder)
+    packed_inodes = set()
+    for path in packed_paths:
+        st = os.stat(path)
+        packed_inodes.add((st.st_dev, st.st_ino))
+    keep = {os.path.normpath(path) for path in keep_folders} | {root}
+    archive_path = os.path.join(root, ARCHIVE_FILE)
+
+    removed = 0
+    for dirpath, _, names in os.walk(root, topdown=False):
+        for name in names:
+            path = os.path.join(dirpath, name)
+            if path == archive_path:
+                continue
+            st = os.lstat(path)
+            if path in packed_paths or (st.st_dev, st.st_ino) in packed_inodes:
+                os.remove(path)
+                removed += 1
+        if os.path.normpath(dirpath) not in keep and not os.listdir(dirpath):
+            os.rmdir(dirpath)
+    return removed
+
+
+def group_folder(folder: str) -> str | None:
+    """Returns the group backup folder (backup/<group id>) of a group or thread folder."""
+    folder = os.path.normpath(folder)
+    if os.path.basename(folder).isdigit():
+        return folder
+    parent = os.path.dirname(folder)
+    if os.path.basename(folder).startswith("thread_") and os.path.basename(parent).isdigit():
+        return parent
+    return None
+
+
+def main() -> int:
+    """Packs the backup folders given on the command line."""
+    parser = argparse.ArgumentParser(
+        prog="python3 -m src.backup.pack",
+        description="Pack finished backups into single-file archives the viewer can read.",
+    )
+    parser.add_argument('folders', nargs='+', help='Group or thread backup folders')
+    parser.add_argument('--prune', action='store_true',
+                        help='Remove the packed dump files, media and thumbnails afterwards')
+    parser.add_argument('--level', type=int,
+                        help='Compression level (zstd 1-22, default 10; gzip 1-9, default 6)')
+    args = parser.parse_args()
+
+    if zstd is None:
+        print("⚠️  zstandard is not installed (pip install zstandard), messages are gzip-compressed")
+    failed = 0
+    for folder in args.folders:
+        try:
+            summary = pack_backup(folder, args.level, args.prune)
+        except (OSError, ValueError) as e:
+            print(f"❌ {folder}: {e}")
+            failed += 1
+            continue
+        print(
+            f"{folder}: {summary['backups']} backups, {summary['messages']} messages, "
+            f"{summary['files']} files packed into {summary['archive']} "
+            f"({summary['packed_bytes'] / 1024 / 1024:.1f} MB -> {summary['archive_bytes'] / 1024 / 1024:.1f} MB)"
+        )
+        if summary["missing_files"]:
+            print(f"   {summary['missing_files']} media files the messages refer to were not found")
+        if args.prune:
+            print(f"   {summary['removed_files']} packed files removed")
+        group = group_folder(folder)
+        if group is not None:
+            update_manifests(group, int(os.path.basename(group)))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
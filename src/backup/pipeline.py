@@ -0,0 +1,103 @@
+"""
+Bounded producer/consumer pipeline for media downloads.
+
+The admin-log pager submits download jobs and keeps paging while a pool of
+workers drains the queue. The number of jobs that are queued or running at the
+same time is capped, so a fast pager blocks (backpressure) instead of queueing
+an unbounded number of downloads. A job that fails does not stop the workers,
+but its error is raised by the next drain() or close(), so the caller never
+checkpoints past it.
+"""
+
+import asyncio
+from typing import Any, Awaitable, Callable
+
+
+class MediaDownloadPipeline:
+    """
+    Runs submitted download jobs on a fixed number of worker tasks.
+
+    :param workers: Number of concurrent download workers.
+    :param max_in_flight: Maximum number of jobs queued or running at once.
+    """
+
+    def __init__(self, workers: int = 4, max_in_flight: int = 16) -> None:
+        self.workers: int = max(1, workers)
+        self.max_in_flight: int = max(self.workers, max_in_flight)
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._slots: asyncio.Semaphore = asyncio.Semaphore(self.max_in_flight)
+        self._tasks: list[asyncio.Task] = []
+        self.in_flight: int = 0  # Jobs queued or running
+        self.failed: int = 0  # Jobs that raised an error
+        self._errors: list[Exception] = []  # Errors not raised to the caller yet
+
+    async def __aenter__(self) -> "MediaDownloadPipeline":
+        self.start()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+    def start(self) -> None:
+        """Starts the worker tasks."""
+        if not self._tasks:
+            self._tasks = [
+                asyncio.create_task(self._worker()) for _ in range(self.workers)
+            ]
+
+    async def submit(self, job: Callable[..., Awaitable[Any]], *args: Any) -> None:
+        """
+        Queues a job, waiting while the in-flight limit is reached.
+
+        :param job: Coroutine function to run on a worker.
+        :param args: Arguments passed to the job.
+        """
+        await self._slots.acquire()
+        self.in_flight += 1
+        await self._queue.put((job, args))
+
+    async def drain(self) -> None:
+        """
+        Waits until every job submitted so far has finished.
+
+        :raises Exception: The first error of the jobs that failed since the last drain.
+        """
+        await self._queue.join()
+        self._raise_errors()
+
+    async def close(self) -> None:
+        """
+        Waits for every queued job to finish and stops the workers.
+
+        :raises Exception: The first error of the jobs that failed since the last drain.
+        """
+        if not self._tasks:
+            return
+        await self._queue.join()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._raise_errors()
+
+    def _raise_errors(self) -> None:
+        if not self._errors:
+            return
+        errors, self._errors = self._errors, []
+        if len(errors) > 1:
+            print(f"{len(errors)} download jobs failed, raising the first error")
+        raise errors[0]
+
+    async def _worker(self) -> None:
+        while True:
+            job, args = await self._queue.get()
+            try:
+                await job(*args)
+            except Exception as e:
+                print(f"Download job failed: {e}")
+                self.failed += 1
+                self._errors.append(e)
+            finally:
+                self.in_flight -= 1
+                self._slots.release()
+                self._queue.task_done()
@@ -0,0 +1,117 @@
+"""
+Shared request scheduler for Telegram API calls.
+
+Every call that reaches Telegram (admin-log pages, media downloads) goes through
+one scheduler, which spaces the calls out to a target rate. The rate grows
+by a fixed amount per second while calls succeed and is halved whenever
+Telegram answers with a FloodWait; the server-specified wait is then slept and
+the call retried. Growing per second rather than per call keeps the recovery
+after a FloodWait just as fast at a low rate as at a high one.
+Local work that does not go through the scheduler is never delayed.
+"""
+
+import asyncio
+import time
+from typing import Any, Awaitable, Callable
+
+from telethon.errors import FloodWaitError
+
+from .metrics import Metrics
+
+
+class RequestScheduler:
+    """
+    Adaptive rate limiter with FloodWait-aware backoff.
+
+    :param rate: Initial number of API calls per second.
+    :param min_rate: Lowest rate the scheduler backs off to.
+    :param max_rate: Highest rate the scheduler speeds up to.
+    :param increase: Calls per second the rate grows by per second of successful
+        calls (each call adds increase / rate).
+    :param max_retries: FloodWait retries per call before the error is raised.
+    :param metrics: Registry the call durations, slot waits and FloodWaits are reported to.
+    """
+
+    def __init__(
+        self,
+        rate: float = 5.0,
+        min_rate: float = 0.2,
+        max_rate: float = 20.0,
+        increase: float = 0.25,
+        max_retries: int = 5,
+        metrics: Metrics | None = None,
+    ) -> None:
+        self.min_rate: float = min_rate
+        self.max_rate: float = max_rate
+        self.rate: float = min(max(rate, min_rate), max_rate)
+        self.increase: float = increase
+        self.max_retries: int = max_retries
+        self.calls: int = 0  # API calls made
+        self.flood_waits: int = 0  # FloodWait responses received
+        self.flood_wait_seconds: float = 0.0  # Total time spent waiting on FloodWait
+        self._next_slot: float = 0.0
+        self._paused_until: float = 0.0
+        self._lock: asyncio.Lock = asyncio.Lock()
+        self.metrics: Metrics | None = metrics
+
+    async def call(self, func: Callable[..., Awaitable[Any]], *args: Any, **kwargs: Any) -> Any:
+        """
+        Runs an API call within the request budget, retrying after FloodWait.
+
+        :param func: Coroutine function making the API call.
+        :param args: Positional arguments for the call.
+        :param kwargs: Keyword arguments for the call.
+        """
+        retries = 0
+        while True:
+            await self._acquire()
+            start = time.perf_counter()
+            try:
+                result = await func(*args, **kwargs)
+            except FloodWaitError as e:
+                retries += 1
+                self._on_flood_wait(e.seconds)
+                if retries > self.max_retries:
+                    raise
+                print(
+                    f"FloodWait: sleeping {e.seconds}s, request rate lowered to {self.rate:.2f}/s "
+                    f"(retry {retries}/{self.max_retries})"
+                )
+                continue
+            finally:
+                self._record_call(func, start)
+            # About rate calls are made per second, so the rate grows by increase per second
+            self.rate = min(self.max_rate, self.rate + self.increase / self.rate)
+            return result
+
+    def _record_call(self, func: Callable[..., Awaitable[Any]], start: float) -> None:
+        """Reports the duration of an API call and the current rate."""
+        if self.metrics is None:
+            return
+        method = getattr(func, "__name__", "call")
+        self.metrics.inc("backup_api_requests_total", method=method)
+        self.metrics.observe("backup_api_request_seconds", time.perf_counter() - start, method=method)
+        self.metrics.set("backup_request_rate", self.rate)
+
+    async def _acquire(self) -> None:
+        """Waits for the next free call slot."""
+        async with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot, self._paused_until)
+            self._next_slot = slot + 1.0 / self.rate
+            self.calls += 1
+        delay = slot - now
+        if self.metrics is not None:
+            self.metrics.observe("backup_scheduler_wait_seconds", max(0.0, delay))
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def _on_flood_wait(self, seconds: float) -> None:
+        """Pauses every caller for the server-specified wait and halves the rate."""
+        self.flood_waits += 1
+        self.flood_wait_seconds += seconds
+        if self.metrics is not None:
+            self.metrics.inc("backup_flood_waits_total")
+            self.metrics.inc("backup_flood_wait_seconds_total", seconds)
+        self.rate = max(self.min_rate, self.rate / 2)
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
@@ -0,0 +1,70 @@
+"""
+Direct serialization of Telethon messages into the dump format.
+
+``json.loads(message.to_json())`` builds the message dict, encodes it to a JSON
+string and parses it back just to turn bytes and datetimes into JSON values.
+The functions here produce the same dicts in one pass over ``to_dict()``, or,
+with the ``viewer`` profile, only the fields the viewer and the tools in this
+repository read.
+"""
+
+import base64
+from datetime import datetime
+
+MESSAGE_PROFILES: tuple[str, ...] = ("full", "viewer")
+
+
+def to_jsonable(value):
+    """
+    Converts a Telethon ``to_dict()`` value into plain JSON types, the same way
+    ``TLObject.to_json`` does (base64 for bytes, ISO format for datetimes).
+
+    :param value: Value from a Telethon ``to_dict()`` result.
+    """
+    if isinstance(value, dict):
+        return {key: to_jsonable(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [to_jsonable(item) for item in value]
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    if isinstance(value, bytes):
+        return base64.b64encode(value).decode('ascii')
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return repr(value)
+
+
+def _tl_to_jsonable(obj):
+    """Serializes an optional nested TL object."""
+    if obj is None:
+        return None
+    return to_jsonable(obj.to_dict())
+
+
+def message_to_dict(message, profile: str = "full") -> dict:
+    """
+    Serializes a Telethon message for the dump.
+
+    :param message: Telethon message object.
+    :param profile: "full" keeps every raw field (same output as to_json),
+        "viewer" keeps only the fields the viewer uses.
+    """
+    if profile == "full":
+        return to_jsonable(message.to_dict())
+    if profile != "viewer":
+        raise ValueError(f"Unknown message profile: {profile} (expected one of {MESSAGE_PROFILES})")
+
+    media = getattr(message, 'media', None)
+    date = getattr(message, 'date', None)
+    return {
+        "_": "Message",
+        "id": message.id,
+        "date": date.isoformat() if date else None,
+        "message": getattr(message, 'message', None),
+        "out": getattr(message, 'out', False),
+        "from_id": _tl_to_jsonable(getattr(message, 'from_id', None)),
+        "fwd_from": _tl_to_jsonable(getattr(message, 'fwd_from', None)),
+        "reply_to": _tl_to_jsonable(getattr(message, 'reply_to', None)),
+        "grouped_id": getattr(message, 'grouped_id', None),
+        "media": {"_": type(media).__name__} if media else None,
+    }
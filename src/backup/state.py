@@ -0,0 +1,156 @@
+"""
+Resume state for incremental backups.
+
+Each backup folder (group or thread) keeps:
+- ``state.json``: the admin-log event ID range already processed. Events
+  between ``oldest_event_id`` and ``newest_event_id`` are done; ``complete``
+  tells whether the crawl has reached the bottom of the log. A rerun only asks
+  for events newer than ``newest_event_id`` and, if the first crawl was
+  interrupted, continues below ``oldest_event_id``.
+- ``index.sqlite``: an on-disk index of the message IDs already saved, so
+  duplicates are skipped with a key lookup instead of scanning the dump. It is
+  committed together with the dump's checkpoints and remembers the position of
+  the last one, so records a crashed run wrote after it can be indexed later.
+"""
+
+import os
+import json
+import sqlite3
+from typing import Iterable
+
+STATE_FILE: str = "state.json"
+INDEX_FILE: str = "index.sqlite"
+
+
+class CrawlState:
+    """
+    Processed admin-log event range of one backup folder.
+
+    :param folder: Backup folder (group or thread).
+    :param query: Export settings the state belongs to; a state saved with
+        different settings is ignored.
+    """
+
+    def __init__(self, folder: str, query: dict) -> None:
+        self.path: str = os.path.join(folder, STATE_FILE)
+        self.query: dict = query
+        self.newest_event_id: int = 0
+        self.oldest_event_id: int = 0
+        self.complete: bool = False
+
+    @classmethod
+    def load(cls, folder: str, query: dict) -> "CrawlState":
+        """
+        Loads the saved state of a folder, or an empty state if there is none
+        or it was saved with different export settings.
+
+        :param folder: Backup folder (group or thread).
+        :param query: Export settings of the current run.
+        """
+        state = cls(folder, query)
+        try:
+            with open(state.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return state
+        if data.get("query") != query:
+            print(f"Export settings changed since the last run, ignoring {state.path}")
+            return state
+        state.newest_event_id = data.get("newest_event_id", 0)
+        state.oldest_event_id = data.get("oldest_event_id", 0)
+        state.complete = data.get("complete", False)
+        return state
+
+    @classmethod
+    def combine(cls, states: list["CrawlState"], query: dict) -> "CrawlState":
+        """
+        Merges the states of several folders exported in one pass into the
+        range every one of them has already processed.
+
+        :param states: States of the folders.
+        :param query: Export settings of the current run.
+        """
+        combined = cls("", query)
+        if not states or any(not state.newest_event_id for state in states):
+            return combined
+        combined.newest_event_id = min(state.newest_event_id for state in states)
+        combined.oldest_event_id = max(state.oldest_event_id for state in states)
+        combined.complete = all(state.complete for state in states)
+        return combined
+
+    def save(self, folder: str) -> None:
+        """
+        Writes the state to a folder atomically.
+
+        :param folder: Backup folder (group or thread).
+        """
+        path = os.path.join(folder, STATE_FILE)
+        with open(f"{path}.tmp", 'w', encoding='utf-8') as f:
+            json.dump({
+                "query": self.query,
+                "newest_event_id": self.newest_event_id,
+                "oldest_event_id": self.oldest_event_id,
+                "complete": self.complete,
+            }, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(f"{path}.tmp", path)
+
+
+class MessageIndex:
+    """
+    SQLite index of the message IDs saved in a backup folder.
+
+    :param folder: Backup folder (group or thread).
+    :param existing: Records already on disk, indexed when the index is created.
+    """
+
+    def __init__(self, folder: str, existing: Iterable[dict] = ()) -> None:
+        self.path: str = os.path.join(folder, INDEX_FILE)
+        self.created: bool = not os.path.exists(self.path)
+        self._db: sqlite3.Connection = sqlite3.connect(self.path)
+        self._db.execute("CREATE TABLE IF NOT EXISTS messages (id INTEGER PRIMARY KEY)")
+        # Position in the dump of the last record the index was committed with
+        self._db.execute("CREATE TABLE IF NOT EXISTS checkpoint (segment TEXT, offset INTEGER)")
+        if self.created:
+            self.add_records(existing)
+        self._db.commit()
+
+    @property
+    def checkpoint(self) -> tuple[str, int] | None:
+        """(segment file name, byte offset) of the last commit, None if unknown."""
+        row = self._db.execute("SELECT segment, offset FROM checkpoint").fetchone()
+        return (row[0], row[1]) if row is not None else None
+
+    def add_records(self, records: Iterable[dict]) -> None:
+        """Marks the messages of saved records as saved (persisted on the next commit)."""
+        self._db.executemany(
+            "INSERT OR IGNORE INTO messages (id) VALUES (?)",
+            ((record["id"],) for record in records if "id" in record),
+        )
+
+    def __contains__(self, message_id: int) -> bool:
+        return self._db.execute(
+            "SELECT 1 FROM messages WHERE id = ?", (message_id,)
+        ).fetchone() is not None
+
+    def add(self, message_id: int) -> None:
+        """Marks a message as saved (persisted on the next commit)."""
+        self._db.execute("INSERT OR IGNORE INTO messages (id) VALUES (?)", (message_id,))
+
+    def commit(self, checkpoint: tuple[str, int] | None = None) -> None:
+        """
+        Persists the added message IDs.
+
+        :param checkpoint: Position in the dump up to which every record is indexed
+            (see storage.segments_end), None to keep the last one.
+        """
+        if checkpoint is not None:
+            self._db.execute("DELETE FROM checkpoint")
+            self._db.execute("INSERT INTO checkpoint (segment, offset) VALUES (?, ?)", checkpoint)
+        self._db.commit()
+
+    def close(self) -> None:
+        """Commits and closes the index."""
+        self._db.commit()
+        self._db.close()
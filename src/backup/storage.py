@@ -0,0 +1,373 @@
+"""
+Dump storage formats for exported messages.
+
+- ``json``: the legacy format, a single pretty-printed ``dump.json`` array that
+  is loaded at the start of a run and rewritten at the end.
+- ``jsonl``: an append-only stream of JSON lines split into numbered segment
+  files under ``dump_segments/``. Records are written as they arrive and
+  flushed to disk (fsync) at regular checkpoints, so memory use does not grow
+  with the history size and an interrupted run keeps everything written up to
+  the last checkpoint. Each run starts a new segment; existing segments are
+  never rewritten.
+
+``compact_dump`` turns the segments back into the legacy ``dump.json`` array
+for the viewer without loading them all into memory.
+
+Packed backups (see archive.py) are read from their archive; messages exported
+into the folder after it was packed are read from the dump files as usual.
+
+Usage: python -m src.backup.storage [--compact] <backup folder> [<backup folder> ...]
+"""
+
+import os
+import sys
+import json
+import time
+from typing import Callable, Iterator
+
+from .archive import archived_backup
+
+DUMP_FILE: str = "dump.json"
+SEGMENTS_FOLDER: str = "dump_segments"
+STORAGE_FORMATS: tuple[str, ...] = ("json", "jsonl")
+
+
+def load_existing_dump(dump_file: str) -> list:
+    """
+    Loads previously exported messages so a new run appends to them.
+
+    :param dump_file: Path to the dump.json file.
+    """
+    if not os.path.exists(dump_file):
+        return []
+    try:
+        with open(dump_file, 'r', encoding='utf-8') as f:
+            content = f.read().strip()
+            if not content:
+                return []
+            # Handle the old malformed format
+            if content.startswith('['):
+                return json.loads(content)
+            # Convert old comma-separated format
+            if content.endswith(','):
+                content = content[:-1]
+            return json.loads(f"[{content}]")
+    except (json.JSONDecodeError, FileNotFoundError):
+        return []
+
+
+def segment_files(folder: str) -> list[str]:
+    """
+    Returns the JSONL segment files of a backup folder in write order.
+
+    :param folder: Backup folder (group or thread).
+    """
+    segments_folder = os.path.join(folder, SEGMENTS_FOLDER)
+    if not os.path.isdir(segments_folder):
+        return []
+    return [
+        os.path.join(segments_folder, name)
+        for name in sorted(os.listdir(segments_folder))
+        if name.startswith("segment_") and name.endswith(".jsonl")
+    ]
+
+
+def dump_files(folder: str) -> list[str]:
+    """
+    Returns the files holding the messages of a backup folder: the segments or
+    dump.json, and the archive if the folder is packed.
+
+    :param folder: Backup folder (group or thread).
+    """
+    dump_file = os.path.join(folder, DUMP_FILE)
+    paths = segment_files(folder) or ([dump_file] if os.path.exists(dump_file) else [])
+    archived = archived_backup(folder)
+    if archived is not None:
+        paths.append(archived[0].path)
+    return paths
+
+
+def iter_dump_records(folder: str) -> Iterator[dict]:
+    """
+    Yields every exported message of a backup folder.
+
+    Segments are read line by line; a torn last line left by a crash is skipped.
+    Without segments the legacy dump.json is read instead. The messages of a
+    packed folder follow, without those already read from the dump files.
+
+    :param folder: Backup folder (group or thread).
+    """
+    archived = archived_backup(folder)
+    if archived is None:
+        yield from _iter_loose_records(folder)
+        return
+    seen = set()
+    for record in _iter_loose_records(folder):
+        seen.add(record.get("id"))
+        yield record
+    archive, section = archived
+    for record in archive.iter_records(section):
+        if record.get("id") not in seen:
+            yield record
+
+
+def segments_end(folder: str) -> tuple[str, int] | None:
+    """
+    Returns the position after the last record written to the segments of a
+    backup folder: (segment file name, byte offset), None if there are no segments.
+
+    :param folder: Backup folder (group or thread).
+    """
+    segments = segment_files(folder)
+    if not segments:
+        return None
+    return os.path.basename(segments[-1]), os.path.getsize(segments[-1])
+
+
+def records_after(folder: str, position: tuple[str, int] | None) -> Iterator[dict]:
+    """
+    Yields the records written to the segments of a backup folder after a
+    position (see segments_end), e.g. by a run that crashed before its last checkpoint.
+
+    :param folder: Backup folder (group or thread).
+    :param position: (segment file name, byte offset), None for every record.
+    """
+    for segment in segment_files(folder):
+        name = os.path.basename(segment)
+        if position is not None and name < position[0]:
+            continue
+        with open(segment, 'rb') as f:
+            if position is not None and name == position[0]:
+                f.seek(position[1])
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+
+
+def _iter_loose_records(folder: str) -> Iterator[dict]:
+    """Yields the messages of the segments or dump.json of a backup folder."""
+    segments = segment_files(folder)
+    if not segments:
+        yield from load_existing_dump(os.path.join(folder, DUMP_FILE))
+        return
+    for segment in segments:
+        with open(segment, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+
+
+def _write_json_array(records, path: str, compact: bool = False) -> int:
+    """Streams records into a JSON array file (pretty-printed unless compact) and returns the count."""
+    count = 0
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("[")
+        for record in records:
+            if compact:
+                f.write("," if count else "")
+                f.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")))
+            else:
+                f.write(",\n  " if count else "\n  ")
+                f.write(json.dumps(record, indent=2, ensure_ascii=False).replace("\n", "\n  "))
+            count += 1
+        f.write("\n]" if count and not compact else "]")
+        f.flush()
+        os.fsync(f.fileno())
+    return count
+
+
+def compact_dump(folder: str, compact: bool = False) -> int:
+    """
+    Writes the JSONL segments of a backup folder into the legacy dump.json array.
+    The file is replaced atomically, so the viewer never sees a partial dump.
+
+    :param folder: Backup folder (group or thread).
+    :param compact: Write the array without indentation.
+    """
+    dump_file = os.path.join(folder, DUMP_FILE)
+    tmp_file = f"{dump_file}.tmp"
+    count = _write_json_array(iter_dump_records(folder), tmp_file, compact)
+    os.replace(tmp_file, dump_file)
+    return count
+
+
+class LegacyDumpWriter:
+    """
+    Keeps all messages in memory and rewrites dump.json when closed.
+
+    :param folder: Backup folder (group or thread).
+    :param compact: Write dump.json without indentation.
+    """
+
+    # Nothing reaches the disk before close(), so mid-run checkpoints are not possible
+    durable: bool = False
+
+    def __init__(self, folder: str, compact: bool = False) -> None:
+        if segment_files(folder):
+            raise ValueError(
+                f"{folder} already uses jsonl storage; "
+                "continue with jsonl and compact it into dump.json instead"
+            )
+        self.path: str = os.path.join(folder, DUMP_FILE)
+        # Load existing messages if appending
+        self.messages: list = load_existing_dump(self.path)
+        self.count: int = len(self.messages)
+        self.compact: bool = compact
+
+    def write(self, record: dict) -> None:
+        """Adds a message to the dump."""
+        self.messages.append(record)
+        self.count += 1
+
+    def flush(self) -> None:
+        """Messages are only written on close."""
+
+    def close(self) -> None:
+        """Saves messages as proper JSON array."""
+        with open(self.path, 'w', encoding='utf-8') as f:
+            if self.compact:
+                json.dump(self.messages, f, ensure_ascii=False, separators=(",", ":"))
+            else:
+                json.dump(self.messages, f, indent=2, ensure_ascii=False)
+
+
+class JsonlDumpWriter:
+    """
+    Appends messages to a new JSONL segment with periodic fsync'd checkpoints.
+
+    :param folder: Backup folder (group or thread).
+    :param segment_records: Records per segment before a new one is started.
+    :param flush_records: Records between checkpoints.
+    :param flush_interval: Seconds between checkpoints.
+    :param on_flush: Called with the position of the last durable record (see
+        segments_end) after every checkpoint, e.g. to commit the message index
+        together with the records it lists.
+    """
+
+    durable: bool = True
+
+    def __init__(
+        self,
+        folder: str,
+        segment_records: int = 50000,
+        flush_records: int = 500,
+        flush_interval: float = 5.0,
+        on_flush: Callable[[tuple[str, int] | None], None] | None = None,
+    ) -> None:
+        self.folder: str = folder
+        self.segments_folder: str = os.path.join(folder, SEGMENTS_FOLDER)
+        self.path: str = self.segments_folder
+        self.segment_records: int = segment_records
+        self.flush_records: int = flush_records
+        self.flush_interval: float = flush_interval
+        self.count: int = 0
+        self._segment_count: int = 0
+        self._unflushed: int = 0
+        self._last_flush: float = time.monotonic()
+        self._file = None
+        self.on_flush: Callable[[tuple[str, int] | None], None] | None = on_flush
+
+        existing = segment_files(folder)
+        if not existing and os.path.exists(os.path.join(folder, DUMP_FILE)):
+            self._migrate_legacy_dump()
+            existing = segment_files(folder)
+        self._next_index: int = (
+            int(os.path.basename(existing[-1])[len("segment_"):-len(".jsonl")]) + 1
+            if existing else 1
+        )
+
+    def _migrate_legacy_dump(self) -> None:
+        """Converts an existing dump.json into the first segment (done once)."""
+        os.makedirs(self.segments_folder, exist_ok=True)
+        segment = os.path.join(self.segments_folder, "segment_000000.jsonl")
+        with open(f"{segment}.tmp", 'w', encoding='utf-8') as f:
+            for record in load_existing_dump(os.path.join(self.folder, DUMP_FILE)):
+                f.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")))
+                f.write("\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(f"{segment}.tmp", segment)
+
+    def _open_segment(self) -> None:
+        os.makedirs(self.segments_folder, exist_ok=True)
+        segment = os.path.join(self.segments_folder, f"segment_{self._next_index:06d}.jsonl")
+        self._next_index += 1
+        self._segment_count = 0
+        self._file = open(segment, 'a', encoding='utf-8')
+
+    def write(self, record: dict) -> None:
+        """Appends a message to the current segment."""
+        if self._file is None or self._segment_count >= self.segment_records:
+            self._close_segment()
+            self._open_segment()
+        self._file.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")))
+        self._file.write("\n")
+        self.count += 1
+        self._segment_count += 1
+        self._unflushed += 1
+        if (
+            self._unflushed >= self.flush_records
+            or time.monotonic() - self._last_flush >= self.flush_interval
+        ):
+            self.flush()
+
+    def flush(self) -> None:
+        """Checkpoint: makes every written record durable on disk."""
+        if self._file is not None and self._unflushed:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        self._unflushed = 0
+        self._last_flush = time.monotonic()
+        if self.on_flush is not None:
+            self.on_flush(
+                (os.path.basename(self._file.name), self._file.tell()) if self._file is not None else None
+            )
+
+    def _close_segment(self) -> None:
+        if self._file is not None:
+            self.flush()
+            self._file.close()
+            self._file = None
+
+    def close(self) -> None:
+        """Flushes and closes the current segment."""
+        self._close_segment()
+
+
+def open_dump_writer(
+    folder: str,
+    storage: str = "json",
+    compact: bool = False,
+    on_flush: Callable[[tuple[str, int] | None], None] | None = None,
+):
+    """
+    Creates the dump writer for a storage format.
+
+    :param folder: Backup folder (group or thread).
+    :param storage: Storage format, "json" (legacy dump.json) or "jsonl" (streaming segments).
+    :param compact: Write dump.json without indentation (JSONL is always compact).
+    :param on_flush: Called after every checkpoint of the JSONL writer.
+    """
+    if storage == "jsonl":
+        return JsonlDumpWriter(folder, on_flush=on_flush)
+    if storage == "json":
+        return LegacyDumpWriter(folder, compact)
+    raise ValueError(f"Unknown storage format: {storage} (expected one of {STORAGE_FORMATS})")
+
+
+if __name__ == "__main__":
+    compact_output = "--compact" in sys.argv[1:]
+    backup_folders = [arg for arg in sys.argv[1:] if arg != "--compact"]
+    if not backup_folders:
+        print("Usage: python -m src.backup.storage [--compact] <backup folder> [<backup folder> ...]")
+        sys.exit(1)
+    for backup_folder in backup_folders:
+        compacted = compact_dump(backup_folder, compact_output)
+        print(f"Compacted {compacted} messages into {os.path.join(backup_folder, DUMP_FILE)}")
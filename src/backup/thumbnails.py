@@ -0,0 +1,193 @@
+"""
+Thumbnails of backed-up media for the viewer.
+
+The thumbnail of a media file ``<dir>/<name>`` is ``<dir>/.thumbs/<name>.jpg``,
+at most THUMB_SIZE pixels on its longest side. During the export it is built
+from the downloaded file when possible: images are scaled with Pillow and
+video posters are taken with ffmpeg, both optional. Media that cannot be
+thumbnailed locally (including images when Pillow is not installed) fall back
+to Telegram's own embedded thumbnail, which costs another request but keeps
+full-size files out of the viewer's timeline. Thumbnails can also be added to
+an existing backup afterwards, from the local files only.
+
+Usage: python -m src.backup.thumbnails <backup folder> [<backup folder> ...]
+"""
+
+import os
+import sys
+import asyncio
+import shutil
+import subprocess
+from typing import Awaitable, Callable
+
+from telethon.tl.types import (
+    MessageMediaDocument,
+    MessageMediaPhoto,
+    PhotoCachedSize,
+    PhotoSize,
+    PhotoSizeProgressive,
+    PhotoStrippedSize,
+)
+
+try:
+    from PIL import Image
+except ImportError:  # Optional: images are not scaled locally without Pillow
+    Image = None
+
+THUMBS_FOLDER: str = ".thumbs"
+THUMB_SIZE: int = 320
+IMAGE_EXTENSIONS: tuple[str, ...] = (".jpg", ".jpeg", ".png", ".webp", ".bmp", ".gif")
+VIDEO_EXTENSIONS: tuple[str, ...] = (".mp4", ".mov", ".avi", ".mkv", ".webm", ".m4v", ".3gp")
+
+
+def thumbnail_path(media_path: str) -> str:
+    """
+    Returns where the thumbnail of a media file is stored.
+
+    :param media_path: Path of the media file.
+    """
+    return os.path.join(
+        os.path.dirname(media_path), THUMBS_FOLDER, f"{os.path.basename(media_path)}.jpg"
+    )
+
+
+def telegram_thumb_type(media) -> str | None:
+    """
+    Picks the embedded Telegram thumbnail closest to THUMB_SIZE: the smallest one
+    at least that large, else the largest one, else the tiny inline preview.
+
+    :param media: Telethon message media.
+    :return: Thumbnail type for download_media(thumb=...), or None if there is none.
+    """
+    if isinstance(media, MessageMediaPhoto) and media.photo is not None:
+        sizes = getattr(media.photo, "sizes", None) or []
+    elif isinstance(media, MessageMediaDocument) and media.document is not None:
+        sizes = getattr(media.document, "thumbs", None) or []
+    else:
+        return None
+    sized = [s for s in sizes if isinstance(s, (PhotoSize, PhotoCachedSize, PhotoSizeProgressive))]
+    if sized:
+        large = [s for s in sized if max(s.w, s.h) >= THUMB_SIZE]
+        if large:
+            return min(large, key=lambda s: max(s.w, s.h)).type
+        return max(sized, key=lambda s: max(s.w, s.h)).type
+    stripped = [s for s in sizes if isinstance(s, PhotoStrippedSize)]
+    return stripped[0].type if stripped else None
+
+
+def local_thumbnail(media_path: str, thumb_path: str) -> bool:
+    """
+    Builds a thumbnail from a local file: images with Pillow, video posters with ffmpeg.
+
+    :param media_path: Path of the media file.
+    :param thumb_path: Where to write the JPEG thumbnail.
+    :return: True if a thumbnail was written.
+    """
+    extension = os.path.splitext(media_path)[1].lower()
+    tmp_path = f"{thumb_path}.tmp"
+    if extension in IMAGE_EXTENSIONS and Image is not None:
+        try:
+            with Image.open(media_path) as image:
+                image.thumbnail((THUMB_SIZE, THUMB_SIZE))
+                image.convert("RGB").save(tmp_path, "JPEG", quality=80)
+        except (OSError, ValueError) as e:
+            print(f"Could not create a thumbnail of {media_path}: {e}")
+            return False
+    elif extension in VIDEO_EXTENSIONS and shutil.which("ffmpeg"):
+        result = subprocess.run(
+            ["ffmpeg", "-v", "error", "-y", "-i", media_path, "-frames:v", "1",
+             "-vf", f"scale={THUMB_SIZE}:{THUMB_SIZE}:force_original_aspect_ratio=decrease",
+             "-f", "image2", tmp_path],
+            stdin=subprocess.DEVNULL, capture_output=True, check=False,
+        )
+        if result.returncode != 0 or not os.path.exists(tmp_path):
+            return False
+    else:
+        return False
+    os.replace(tmp_path, thumb_path)
+    return True
+
+
+async def create_thumbnail(
+    media,
+    media_path: str,
+    download: Callable[[object, str, str], Awaitable[str | None]],
+) -> str | None:
+    """
+    Creates the thumbnail of a downloaded media file unless it already exists.
+
+    :param media: Telethon message media the file was downloaded from.
+    :param media_path: Path of the downloaded file.
+    :param download: Coroutine function downloading a Telegram thumbnail (media, path, thumb type).
+    :return: Path of the thumbnail, or None if none could be made.
+    """
+    thumb_path = thumbnail_path(media_path)
+    if os.path.exists(thumb_path):
+        return thumb_path
+    os.makedirs(os.path.dirname(thumb_path), exist_ok=True)
+
+    # Building the thumbnail from the file on disk costs no request to Telegram
+    if await asyncio.to_thread(local_thumbnail, media_path, thumb_path):
+        return thumb_path
+    thumb_type = telegram_thumb_type(media)
+    if thumb_type is not None:
+        try:
+            if await download(media, f"{thumb_path}.tmp", thumb_type):
+                os.replace(f"{thumb_path}.tmp", thumb_path)
+                return thumb_path
+        except Exception as e:
+            print(f"Could not download the thumbnail of {media_path}: {e}")
+    return None
+
+
+def thumbnail_folder(folder: str) -> tuple[int, int]:
+    """
+    Adds missing thumbnails to every media file of a backup folder (recursively),
+    from the local files only.
+
+    :param folder: Backup folder (group or thread).
+    :return: (thumbnails created, media files without a thumbnail).
+    """
+    created = missing = 0
+    seen = set()
+    for root, dirs, files in os.walk(folder):
+        # Thumbnails and the dump segments are no media; sorting visits the
+        # shared .media store before the per-message links into it
+        dirs[:] = sorted(name for name in dirs if name not in (THUMBS_FOLDER, "dump_segments"))
+        for name in files:
+            if not name.lower().endswith(IMAGE_EXTENSIONS + VIDEO_EXTENSIONS):
+                continue
+            media_path = os.path.join(root, name)
+            st = os.stat(media_path)
+            if (st.st_dev, st.st_ino) in seen:
+                continue
+            seen.add((st.st_dev, st.st_ino))
+            thumb_path = thumbnail_path(media_path)
+            if os.path.exists(thumb_path):
+                continue
+            os.makedirs(os.path.dirname(thumb_path), exist_ok=True)
+            if local_thumbnail(media_path, thumb_path):
+                created += 1
+            else:
+                missing += 1
+    return created, missing
+
+
+def main() -> int:
+    """Adds thumbnails to the backup folders given on the command line."""
+    folders = sys.argv[1:]
+    if not folders:
+        print(__doc__)
+        return 1
+    if Image is None:
+        print("⚠️  Pillow is not installed (pip install Pillow), images get no thumbnails")
+    if not shutil.which("ffmpeg"):
+        print("⚠️  ffmpeg is not installed, videos get no poster")
+    for folder in folders:
+        created, missing = thumbnail_folder(folder)
+        print(f"{folder}: {created} thumbnails created, {missing} media files without a thumbnail")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
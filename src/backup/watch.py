@@ -0,0 +1,92 @@
+"""
+Continuous watch mode.
+
+The admin log keeps deleted messages only for a limited time, so a backup that
+is rerun now and then can miss deletions. In watch mode export_messages keeps
+its dump writers, indexes and media store open after the first crawl and polls
+the admin log for events newer than the last one seen. Each poll ends with a
+checkpoint, so new deletions reach the backup as they are found. The poll
+interval adapts to the channel: it halves after a poll that found deletions
+and grows after quiet ones.
+"""
+
+import signal
+import asyncio
+
+DEFAULT_MIN_INTERVAL: float = 15.0
+DEFAULT_MAX_INTERVAL: float = 600.0
+# Manifests are rebuilt from the whole backup, so a watching export refreshes them at most this often
+MANIFEST_UPDATE_INTERVAL: float = 600.0
+
+
+class AdaptiveInterval:
+    """
+    Poll interval that speeds up while deletions keep coming and backs off when quiet.
+
+    :param min_interval: Shortest interval in seconds (used while busy).
+    :param max_interval: Longest interval in seconds (reached when quiet).
+    :param backoff: Factor the interval grows by after a quiet poll.
+    """
+
+    def __init__(
+        self,
+        min_interval: float = DEFAULT_MIN_INTERVAL,
+        max_interval: float = DEFAULT_MAX_INTERVAL,
+        backoff: float = 1.5,
+    ) -> None:
+        self.min_interval: float = min_interval
+        self.max_interval: float = max(min_interval, max_interval)
+        self.backoff: float = backoff
+        self.current: float = min_interval
+
+    def update(self, new_messages: int) -> float:
+        """
+        Adjusts the interval after a poll and returns it.
+
+        :param new_messages: Deleted messages the poll found.
+        """
+        if new_messages:
+            self.current = max(self.min_interval, self.current / 2)
+        else:
+            self.current = min(self.max_interval, self.current * self.backoff)
+        return self.current
+
+
+async def wait_or_stop(stop: asyncio.Event | None, seconds: float) -> bool:
+    """
+    Sleeps until the next poll.
+
+    :param stop: Event set when the watch should end, None to just sleep.
+    :param seconds: Time to wait.
+    :return: True if stopping was requested.
+    """
+    if stop is None:
+        await asyncio.sleep(seconds)
+        return False
+    try:
+        await asyncio.wait_for(stop.wait(), seconds)
+    except asyncio.TimeoutError:
+        return False
+    return True
+
+
+def install_stop_handlers(stop: asyncio.Event) -> None:
+    """
+    Sets stop on SIGTERM and SIGINT, so watching exports finish the current page,
+    save their state and close cleanly instead of being killed mid-write.
+
+    :param stop: Event passed to the watching exports.
+    """
+    loop = asyncio.get_running_loop()
+
+    def request_stop() -> None:
+        if not stop.is_set():
+            print("\nStopping after the current page...")
+        stop.set()
+
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, request_stop)
+        except (NotImplementedError, RuntimeError):
+            # Not supported on Windows; Ctrl+C still interrupts there
+            pass
@@ -0,0 +1 @@
+"""Offline benchmarks for the backup exporter and viewer."""
@@ -0,0 +1,198 @@
+"""
+End-to-end benchmark of export_messages against a fake Telegram client.
+
+Runs every export mode over the same synthetic admin log (see fake_client)
+into a temporary backup folder and reports events/sec, wall time and peak RSS.
+Each mode runs in its own process, so its peak RSS is not hidden by the modes
+before it. Latency and FloodWait can be simulated to check the scheduler and
+the download pipeline under network conditions.
+
+Usage: python -m src.bench.exporter [--events 20000] [--modes 1,2,3] [--latency 0.05]
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import argparse
+import resource
+import tempfile
+import subprocess
+import contextlib
+
+from src.backup.exporter import export_messages
+from src.backup.scheduler import RequestScheduler
+from src.bench.fake_client import FakeTelegramClient, make_admin_log
+
+MODES: dict[int, str] = {1: "all", 2: "media only", 3: "text only"}
+GROUP_ID: int = 1234567890
+
+
+def peak_rss_mb() -> float:
+    """Returns the peak resident set size of this process in MiB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+def folder_size(folder: str) -> int:
+    """Returns the bytes used by the files of a folder, counting hard links once."""
+    total = 0
+    seen = set()
+    for root, _, files in os.walk(folder):
+        for name in files:
+            st = os.lstat(os.path.join(root, name))
+            if (st.st_dev, st.st_ino) not in seen:
+                seen.add((st.st_dev, st.st_ino))
+                total += st.st_size
+    return total
+
+
+def build_client(args: argparse.Namespace) -> FakeTelegramClient:
+    """Creates the fake client described by the command line arguments."""
+    events = make_admin_log(
+        args.events,
+        media_ratio=args.media_ratio,
+        threads=args.threads,
+        unique_media=args.unique_media,
+    )
+    return FakeTelegramClient(
+        events,
+        latency=args.latency,
+        flood_every=args.flood_every,
+        flood_seconds=args.flood_seconds,
+        file_size=args.file_size,
+    )
+
+
+def thread_ids(args: argparse.Namespace) -> list[int]:
+    """Exports the whole group plus every synthetic forum topic."""
+    return [0] + list(range(1, args.threads + 1))
+
+
+async def export_backup(args: argparse.Namespace, mode: int, base_folder: str) -> dict:
+    """
+    Runs one export and measures it.
+
+    :param args: Command line arguments.
+    :param mode: Export mode (1 - all, 2 - media only, 3 - text only).
+    :param base_folder: Backup folder of the synthetic group.
+    """
+    client = build_client(args)
+    # The real default budget would make the benchmark measure the rate limit only
+    scheduler = RequestScheduler(rate=args.rate, max_rate=args.rate)
+    start = time.perf_counter()
+    # Keep the exporter's progress and summary lines off the benchmark table
+    with open(os.devnull, 'w', encoding='utf-8') as devnull, contextlib.redirect_stdout(devnull):
+        exported = await export_messages(
+            client,
+            GROUP_ID,
+            mode,
+            message_thread_ids=thread_ids(args),
+            base_folder=base_folder,
+            storage=args.storage,
+            scheduler=scheduler,
+            thumbnails=args.thumbnails,
+        )
+    elapsed = time.perf_counter() - start
+    return {
+        "mode": mode,
+        "events": len(client.events),
+        "exported": exported,
+        "seconds": elapsed,
+        "events_per_sec": len(client.events) / elapsed if elapsed else 0,
+        "peak_rss_mb": peak_rss_mb(),
+        "api_calls": client.api_calls,
+        "downloads": client.downloads,
+        "flood_waits": scheduler.flood_waits,
+        "backup_bytes": folder_size(base_folder),
+    }
+
+
+def run_mode(args: argparse.Namespace, mode: int) -> dict:
+    """
+    Benchmarks one mode in a fresh process, so the peak RSS is its own.
+
+    :param args: Command line arguments.
+    :param mode: Export mode.
+    """
+    command = [sys.executable, "-m", "src.bench.exporter", "--run-mode", str(mode)]
+    for name, value in vars(args).items():
+        if name in ("modes", "run_mode", "keep") or value is None:
+            continue
+        option = "--" + name.replace("_", "-")
+        if isinstance(value, bool):
+            command.append(option if value else f"--no-{name.replace('_', '-')}")
+        else:
+            command += [option, str(value)]
+    result = subprocess.run(command, capture_output=True, text=True, check=False)
+    if result.returncode != 0:
+        raise RuntimeError(f"mode {mode} failed:\n{result.stderr}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main() -> None:
+    """Runs each export mode against the fake client and reports its measurements."""
+    parser = argparse.ArgumentParser(description='Export benchmark with a fake Telegram client')
+    parser.add_argument('--events', type=int, default=20000,
+                        help='Number of deleted-message events')
+    parser.add_argument('--media-ratio', type=float, default=0.3,
+                        help='Share of messages with media')
+    parser.add_argument('--unique-media', type=int, default=0,
+                        help='Distinct media files (reposts share one), 0 = one per message')
+    parser.add_argument('--threads', type=int, default=0,
+                        help='Forum topics the messages are spread over')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds every API call takes')
+    parser.add_argument('--flood-every', type=int, default=0,
+                        help='FloodWait on every Nth API call, 0 = never')
+    parser.add_argument('--flood-seconds', type=int, default=1,
+                        help='Seconds each simulated FloodWait lasts')
+    parser.add_argument('--file-size', type=int, default=4096,
+                        help='Bytes per downloaded media file')
+    parser.add_argument('--rate', type=float, default=1000.0,
+                        help='Request scheduler rate (calls per second)')
+    parser.add_argument('--storage', choices=["json", "jsonl"], default="jsonl", help='Dump format')
+    parser.add_argument('--thumbnails', action=argparse.BooleanOptionalAction, default=True,
+                        help='Create thumbnails of downloaded media')
+    parser.add_argument('--modes', default="1,2,3", help='Comma-separated export modes to run')
+    parser.add_argument('--keep', action='store_true', help='Keep the generated backups')
+    parser.add_argument('--run-mode', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_mode is not None:
+        # Child process: export one mode and print the measurements as JSON
+        folder = tempfile.mkdtemp(prefix=f"bench_mode{args.run_mode}_")
+        try:
+            backup_folder = os.path.join(folder, str(GROUP_ID))
+            result = asyncio.run(export_backup(args, args.run_mode, backup_folder))
+        finally:
+            shutil.rmtree(folder, ignore_errors=True)
+        print(json.dumps(result))
+        return
+
+    if args.keep:
+        folder = tempfile.mkdtemp(prefix="bench_backup_")
+        for mode in (int(m) for m in args.modes.split(",")):
+            backup_folder = os.path.join(folder, f"mode{mode}", str(GROUP_ID))
+            asyncio.run(export_backup(args, mode, backup_folder))
+        print(f"Backups kept in {folder}")
+        return
+
+    results = [run_mode(args, int(mode)) for mode in args.modes.split(",")]
+    print(f"{args.events} events, media ratio {args.media_ratio}, {args.threads} threads, "
+          f"latency {args.latency * 1000:.0f} ms, FloodWait every {args.flood_every or '-'} calls")
+    print(f"{'mode':<12} {'events/s':>10} {'wall s':>8} {'peak MB':>8} {'calls':>7} "
+          f"{'downloads':>9} {'floods':>6} {'backup MB':>10}")
+    for result in results:
+        print(
+            f"{MODES[result['mode']]:<12} {result['events_per_sec']:>10.0f} "
+            f"{result['seconds']:>8.2f} "
+            f"{result['peak_rss_mb']:>8.1f} {result['api_calls']:>7} {result['downloads']:>9} "
+            f"{result['flood_waits']:>6} {result['backup_bytes'] / 1024 / 1024:>10.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
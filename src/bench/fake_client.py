@@ -0,0 +1,219 @@
+"""
+Local stand-in for TelegramClient, for benchmarks without a Telegram account.
+
+FakeTelegramClient serves a synthetic admin log of deleted messages with the
+same paging semantics as ``iter_admin_log`` (newest first, ``max_id`` and
+``min_id`` bounds, at most ``limit`` events), writes dummy files for
+``download_media`` and streams dummy bytes from ``iter_download``. Every API
+call can be delayed to simulate network latency, and every Nth call can fail
+with a FloodWait.
+"""
+
+import os
+import asyncio
+import bisect
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+from telethon.errors import FloodWaitError
+from telethon.tl.types import (
+    Document,
+    DocumentAttributeFilename,
+    DocumentAttributeVideo,
+    Message,
+    MessageMediaDocument,
+    MessageMediaPhoto,
+    MessageReplyHeader,
+    PeerChannel,
+    PeerUser,
+    Photo,
+    PhotoSize,
+    PhotoStrippedSize,
+)
+
+FIRST_EVENT_ID: int = 1_000_000
+
+
+def make_admin_log(
+    count: int,
+    media_ratio: float = 0.3,
+    video_ratio: float = 0.2,
+    threads: int = 0,
+    unique_media: int = 0,
+    deleters: int = 5,
+    start: datetime = datetime(2024, 1, 1, tzinfo=timezone.utc),
+) -> list:
+    """
+    Generates deleted-message events, newest first like the admin log returns them.
+
+    :param count: Number of events.
+    :param media_ratio: Share of messages with media.
+    :param video_ratio: Share of the media that are videos (documents) instead of photos.
+    :param threads: Number of forum topics the messages are spread over, 0 for none.
+    :param unique_media: Number of distinct files the media is drawn from (reposts
+        share a file), 0 for a new file per message.
+    :param deleters: Number of distinct users deleting messages.
+    :param start: Date of the first message.
+    """
+    media_every = max(1, round(1 / media_ratio)) if media_ratio else 0
+    video_every = max(1, round(1 / video_ratio)) if video_ratio else 0
+    events = []
+    for i in range(1, count + 1):
+        date = start + timedelta(seconds=i * 30)
+        media = None
+        if media_every and i % media_every == 0:
+            media_number = i // media_every
+            file_id = 10_000_000 + (media_number % unique_media if unique_media else media_number)
+            if video_every and media_number % video_every == 0:
+                media = MessageMediaDocument(document=Document(
+                    id=file_id, access_hash=file_id * 3, file_reference=b"\x01" * 8, date=date,
+                    mime_type="video/mp4", size=2_000_000, dc_id=2,
+                    attributes=[DocumentAttributeVideo(duration=12, w=1280, h=720),
+                                DocumentAttributeFilename(file_name=f"video_{file_id}.mp4")],
+                    thumbs=[PhotoStrippedSize(type="i", bytes=b"\x01" * 40),
+                            PhotoSize(type="m", w=320, h=180, size=9_000)],
+                ))
+            else:
+                media = MessageMediaPhoto(photo=Photo(
+                    id=file_id, access_hash=file_id * 3, file_reference=b"\x01" * 8,
+                    date=date, dc_id=2,
+                    sizes=[PhotoSize(type="m", w=320, h=240, size=20_000),
+                           PhotoSize(type="y", w=1280, h=960, size=200_000)],
+                ))
+        reply_to = None
+        if threads:
+            topic = 1 + i % threads
+            reply_to = MessageReplyHeader(
+                reply_to_msg_id=topic, reply_to_top_id=topic, forum_topic=True
+            )
+        message = Message(
+            id=i,
+            peer_id=PeerChannel(1),
+            date=date,
+            message=f"Synthetic deleted message number {i} " * (1 + i % 4),
+            from_id=PeerUser(1000 + i % 50),
+            reply_to=reply_to,
+            media=media,
+        )
+        events.append(SimpleNamespace(
+            id=FIRST_EVENT_ID + i,
+            deleted_message=True,
+            old=message,
+            user_id=500 + i % max(1, deleters),
+            date=date + timedelta(minutes=5),
+        ))
+    events.reverse()
+    return events
+
+
+class FakeTelegramClient:
+    """
+    TelegramClient stand-in serving a synthetic admin log.
+
+    :param events: Events from make_admin_log (newest first).
+    :param latency: Seconds every API call takes.
+    :param flood_every: Every Nth API call fails with a FloodWait, 0 for never.
+    :param flood_seconds: Seconds the simulated FloodWait asks to wait.
+    :param file_size: Bytes written per downloaded media file.
+    """
+
+    def __init__(
+        self,
+        events: list,
+        latency: float = 0.0,
+        flood_every: int = 0,
+        flood_seconds: int = 1,
+        file_size: int = 4096,
+    ) -> None:
+        self.events: list = events
+        # Ascending event IDs for bisecting the max_id/min_id bounds
+        self._ascending_ids: list[int] = [event.id for event in reversed(events)]
+        self.latency: float = latency
+        self.flood_every: int = flood_every
+        self.flood_seconds: int = flood_seconds
+        self.file_size: int = file_size
+        self.flood_sleep_threshold: int = 0
+        self.api_calls: int = 0
+        self.downloads: int = 0
+
+    async def _api_call(self) -> None:
+        """Simulates the latency and FloodWait of one request."""
+        self.api_calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.flood_every and self.api_calls % self.flood_every == 0:
+            raise FloodWaitError(request=None, capture=self.flood_seconds)
+
+    # The stubs below keep TelegramClient's signatures, including the arguments they ignore
+    # pylint: disable=unused-argument
+
+    async def connect(self) -> None:
+        """Does nothing, there is no server to connect to."""
+
+    async def start(self) -> "FakeTelegramClient":
+        """Returns the client, which is always logged in."""
+        return self
+
+    async def is_user_authorized(self) -> bool:
+        """Always True, the fake session needs no login."""
+        return True
+
+    async def get_entity(self, entity):
+        """Returns the entity it is given, after one API call."""
+        await self._api_call()
+        return entity
+
+    async def get_input_entity(self, entity):
+        """Turns a user ID into its peer, without an API call."""
+        return PeerUser(entity) if isinstance(entity, int) else entity
+
+    async def iter_admin_log(
+        self, entity, limit=None, min_id=0, max_id=0, admins=None, delete=None, **kwargs
+    ):
+        """Yields one page of events below max_id (inclusive, as the exporter expects)
+        and above min_id."""
+        await self._api_call()
+        ids = self._ascending_ids
+        upper = bisect.bisect_right(ids, max_id) if max_id else len(ids)
+        lower = bisect.bisect_right(ids, min_id) if min_id else 0
+        admin_ids = {admin.user_id for admin in admins} if admins else None
+        returned = 0
+        total = len(self.events)
+        # Events are stored newest first, so ascending index i is events[total - 1 - i]
+        for index in range(upper - 1, lower - 1, -1):
+            event = self.events[total - 1 - index]
+            if admin_ids is not None and event.user_id not in admin_ids:
+                continue
+            yield event
+            returned += 1
+            if limit and returned >= limit:
+                return
+
+    async def download_media(self, media, file=None, thumb=None, **kwargs):
+        """Writes a dummy file; a folder gets a generated file name like Telethon's."""
+        await self._api_call()
+        self.downloads += 1
+        if file is None or os.path.isdir(file) or not os.path.splitext(str(file))[1]:
+            os.makedirs(file or ".", exist_ok=True)
+            if isinstance(media, MessageMediaDocument):
+                name = f"video_{media.document.id}.mp4"
+            else:
+                name = f"photo_{media.photo.id}.jpg"
+            file = os.path.join(file or ".", name)
+        with open(file, 'wb') as f:
+            f.write(b"\0" * (self.file_size // 20 if thumb is not None else self.file_size))
+        return file
+
+    async def iter_download(
+        self, file, offset=0, limit=None, request_size=512 * 1024, file_size=None, **kwargs
+    ):
+        """Yields limit requests of dummy bytes from offset, up to the end of the file."""
+        document = file.document if isinstance(file, MessageMediaDocument) else file
+        size = file_size or document.size
+        requests = 0
+        while offset < size and (limit is None or requests < limit):
+            await self._api_call()
+            chunk = min(request_size, size - offset)
+            yield bytes([document.id % 251]) * chunk
+            offset += chunk
+            requests += 1
@@ -0,0 +1,123 @@
+"""
+Benchmark of message serialization for the dump.
+
+Builds synthetic Telethon messages offline and compares the legacy
+``json.loads(to_json())`` + ``json.dump(indent=2)`` path with the direct
+serializer in its full and viewer profiles, pretty-printed and compact.
+
+Usage: python -m src.bench.serializer [--count 20000]
+"""
+
+import io
+import json
+import time
+import argparse
+from datetime import datetime, timedelta, timezone
+
+from telethon.tl.types import (
+    Message,
+    MessageEntityBold,
+    MessageFwdHeader,
+    MessageMediaPhoto,
+    MessageReplyHeader,
+    PeerChannel,
+    PeerUser,
+    Photo,
+    PhotoSize,
+)
+
+from src.backup.serializer import message_to_dict
+
+
+def make_messages(count: int, media_ratio: float = 0.3) -> list:
+    """
+    Generates Telethon messages resembling deleted chat messages.
+
+    :param count: Number of messages.
+    :param media_ratio: Share of messages with a photo.
+    """
+    base = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    media_every = max(1, round(1 / media_ratio)) if media_ratio else 0
+    messages = []
+    for i in range(1, count + 1):
+        media = None
+        if media_every and i % media_every == 0:
+            media = MessageMediaPhoto(photo=Photo(
+                id=10_000 + i, access_hash=i * 7, file_reference=b"\x01\x02\x03\x04" * 4,
+                date=base, dc_id=2,
+                sizes=[PhotoSize(type="m", w=320, h=240, size=20_000),
+                       PhotoSize(type="y", w=1280, h=960, size=200_000)],
+            ))
+        messages.append(Message(
+            id=i,
+            peer_id=PeerChannel(1234567890),
+            date=base + timedelta(seconds=i * 37),
+            message=f"Synthetic deleted message number {i} " * (1 + i % 4),
+            from_id=PeerUser(100 + i % 50),
+            fwd_from=MessageFwdHeader(date=base, from_id=PeerUser(7)) if i % 10 == 0 else None,
+            reply_to=MessageReplyHeader(reply_to_msg_id=19, reply_to_top_id=19, forum_topic=True),
+            entities=[MessageEntityBold(offset=0, length=9)],
+            media=media,
+        ))
+    return messages
+
+
+def bench(name: str, messages: list, serialize, dump_kwargs: dict) -> dict:
+    """
+    Serializes and writes all messages once and measures the time and output size.
+
+    :param name: Variant name for the report.
+    :param messages: Messages to serialize.
+    :param serialize: Function turning a message into a dict.
+    :param dump_kwargs: Arguments for json.dump.
+    """
+    out = io.StringIO()
+    start = time.perf_counter()
+    records = [serialize(message) for message in messages]
+    json.dump(records, out, ensure_ascii=False, **dump_kwargs)
+    elapsed = time.perf_counter() - start
+    return {
+        "variant": name,
+        "seconds": elapsed,
+        "messages_per_sec": len(messages) / elapsed if elapsed else 0,
+        "bytes": len(out.getvalue().encode("utf-8")),
+    }
+
+
+def main() -> None:
+    """Checks the direct serializer against the legacy output and compares their speed."""
+    parser = argparse.ArgumentParser(description='Message serialization benchmark')
+    parser.add_argument('--count', type=int, default=20000, help='Number of messages')
+    args = parser.parse_args()
+
+    messages = make_messages(args.count)
+
+    # The direct serializer must match the legacy output exactly
+    legacy = json.loads(messages[-1].to_json())
+    assert message_to_dict(messages[-1]) == legacy, "full profile differs from to_json output"
+
+    pretty = {"indent": 2}
+    compact = {"separators": (",", ":")}
+    results = [
+        bench("legacy to_json+loads, indent=2", messages,
+              lambda m: json.loads(m.to_json()), pretty),
+        bench("direct full, indent=2", messages, message_to_dict, pretty),
+        bench("direct full, compact", messages, message_to_dict, compact),
+        bench("direct viewer, compact", messages,
+              lambda m: message_to_dict(m, "viewer"), compact),
+    ]
+
+    baseline = results[0]
+    print(f"{args.count} messages")
+    print(f"{'variant':<34} {'msg/s':>10} {'speedup':>8} {'MB':>8} {'size':>6}")
+    for result in results:
+        print(
+            f"{result['variant']:<34} {result['messages_per_sec']:>10.0f} "
+            f"{baseline['seconds'] / result['seconds']:>7.2f}x "
+            f"{result['bytes'] / 1024 / 1024:>8.2f} "
+            f"{result['bytes'] / baseline['bytes']:>6.0%}"
+        )
+
+
+if __name__ == "__main__":
+    main()
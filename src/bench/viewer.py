@@ -0,0 +1,246 @@
+"""
+Load benchmark of the viewer server.
+
+Generates a backup tree with the export benchmark's fake client, serves it
+with the viewer's request handler on a local port and sends concurrent
+requests: message API pages (following the cursor), searches, whole dumps
+with compression, media byte ranges, thumbnails and ETag revalidations.
+Reports requests/sec, latency percentiles and bytes per kind of request. The
+clients run in the server's process, so the numbers are a lower bound.
+
+Usage: python -m src.bench.viewer [--events 20000] [--requests 2000] [--concurrency 16]
+"""
+
+import os
+import sys
+import time
+import json
+import gzip
+import base64
+import shutil
+import asyncio
+import argparse
+import tempfile
+import threading
+import statistics
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer
+
+from src.bench.exporter import GROUP_ID, export_backup
+from src.viewer.search import SearchIndex
+
+REPO_ROOT: str = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, REPO_ROOT)
+
+# Lives at the repository root, importable only once the root is on the path
+import run_viewer  # pylint: disable=wrong-import-position
+
+REVALIDATE_FILES: int = 10
+SEARCH_TERMS: tuple[str, ...] = ("synthetic", "deleted message", "number 42", "nothingmatches")
+
+
+class QuietHandler(run_viewer.AuthHandler):
+    """Viewer handler without the per-request log line."""
+
+    def log_message(self, format, *args):
+        pass
+
+
+def collect_files(backup_root: str) -> dict[str, list[str]]:
+    """Finds the dump, media and thumbnail files of a backup tree, as URL paths."""
+    files = {"dump": [], "media": [], "thumbnail": []}
+    for root, _, names in os.walk(backup_root):
+        for name in names:
+            path = os.path.relpath(os.path.join(root, name), os.path.dirname(backup_root))
+            path = path.replace(os.sep, "/")
+            if name.endswith((".tmp", ".sqlite", ".sqlite-wal", ".sqlite-shm", ".idx")):
+                continue
+            if "/.thumbs/" in path:
+                files["thumbnail"].append("/" + path)
+            elif "/.media/" in path:
+                # The shared store; messages link their files into msg_<id> folders
+                continue
+            elif name == "dump.json" or (name.endswith(".jsonl") and "/dump_segments/" in path):
+                files["dump"].append("/" + path)
+            elif not name.endswith(".json"):
+                files["media"].append("/" + path)
+    return files
+
+
+class LoadClient:
+    """
+    Sends benchmark requests to the viewer and records latencies.
+
+    :param base_url: Server URL.
+    :param files: URL paths of the backup files (see collect_files).
+    """
+
+    def __init__(self, base_url: str, files: dict[str, list[str]]) -> None:
+        self.base_url: str = base_url
+        self.files: dict[str, list[str]] = files
+        self.auth: str = "Basic " + base64.b64encode(b"admin:default").decode()
+        self.etags: dict[str, str] = {}
+        self.samples: dict[str, list[tuple[float, int, bool]]] = {}
+        self.lock: threading.Lock = threading.Lock()
+
+    def get(self, kind: str, path: str, headers: dict | None = None) -> tuple[int, dict, bytes]:
+        """Requests a path and records (latency, bytes, ok) under kind."""
+        request = urllib.request.Request(
+            self.base_url + path, headers={"Authorization": self.auth, **(headers or {})}
+        )
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=30) as response:
+                status, response_headers = response.status, dict(response.headers)
+                body = response.read()
+        except urllib.error.HTTPError as e:
+            status, response_headers, body = e.code, dict(e.headers), e.read()
+        except OSError:
+            status, response_headers, body = 0, {}, b""
+        elapsed = time.perf_counter() - start
+        with self.lock:
+            ok = status in (200, 206, 304)
+            self.samples.setdefault(kind, []).append((elapsed, len(body), ok))
+        return status, response_headers, body
+
+    def api_pages(self, _: int) -> None:
+        """Reads up to five message pages of a backup, following the cursor."""
+        cursor = ""
+        for _ in range(5):
+            path = f"/api/messages?group={GROUP_ID}&thread=no-thread&limit=100&cursor={cursor}"
+            status, headers, body = self.get("api page", path, {"Accept-Encoding": "gzip"})
+            if status != 200:
+                return
+            if headers.get("Content-Encoding") == "gzip":
+                body = gzip.decompress(body)
+            cursor = json.loads(body).get("next_cursor")
+            if not cursor:
+                return
+
+    def search(self, i: int) -> None:
+        """Runs the i-th search of the rotation."""
+        term = urllib.request.quote(SEARCH_TERMS[i % len(SEARCH_TERMS)])
+        self.get("search", f"/api/search?q={term}&limit=50", {"Accept-Encoding": "gzip"})
+
+    def dump(self, i: int) -> None:
+        """Downloads a whole dump file, gzip-compressed."""
+        dumps = self.files["dump"]
+        if dumps:
+            self.get("dump gzip", dumps[i % len(dumps)], {"Accept-Encoding": "gzip"})
+
+    def media_range(self, i: int) -> None:
+        """Requests the first 64 KB of a media file, as a video player does."""
+        media = self.files["media"]
+        if media:
+            self.get("media range", media[i % len(media)], {"Range": "bytes=0-65535"})
+
+    def thumbnail(self, i: int) -> None:
+        """Downloads a thumbnail."""
+        thumbnails = self.files["thumbnail"]
+        if thumbnails:
+            self.get("thumbnail", thumbnails[i % len(thumbnails)])
+
+    def revalidate(self, i: int) -> None:
+        """Asks for a media file again with its ETag, as a browser cache does."""
+        if not self.files["media"]:
+            return
+        # A small working set, so most requests are repeats
+        path = self.files["media"][i % min(len(self.files["media"]), REVALIDATE_FILES)]
+        etag = self.etags.get(path)
+        if etag is None:
+            _, headers, _ = self.get("revalidate", path)
+            self.etags[path] = headers.get("ETag", "")
+        else:
+            self.get("revalidate", path, {"If-None-Match": etag})
+
+    def run(self, requests: int, concurrency: int) -> float:
+        """Sends the requests round-robin over the scenarios and returns the wall time."""
+        scenarios = [
+            self.api_pages, self.search, self.dump,
+            self.media_range, self.thumbnail, self.revalidate,
+        ]
+
+        def send(i: int) -> None:
+            scenarios[i % len(scenarios)](i // len(scenarios))
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(send, range(requests)))
+        return time.perf_counter() - start
+
+
+def percentile(values: list[float], share: float) -> float:
+    """Returns the value below which the given share of the sorted values lies."""
+    if len(values) < 2:
+        return values[0] if values else 0.0
+    return statistics.quantiles(values, n=100, method="inclusive")[int(share * 100) - 1]
+
+
+def main() -> None:
+    """Generates a backup, serves it and reports the latencies of each kind of request."""
+    parser = argparse.ArgumentParser(description='Viewer server load benchmark')
+    parser.add_argument('--events', type=int, default=20000,
+                        help='Messages in the generated backup')
+    parser.add_argument('--media-ratio', type=float, default=0.3,
+                        help='Share of messages with media')
+    parser.add_argument('--file-size', type=int, default=256 * 1024, help='Bytes per media file')
+    parser.add_argument('--threads', type=int, default=0,
+                        help='Forum topics the messages are spread over')
+    parser.add_argument('--storage', choices=["json", "jsonl"], default="json", help='Dump format')
+    parser.add_argument('--requests', type=int, default=2000,
+                        help='Number of benchmark requests')
+    parser.add_argument('--concurrency', type=int, default=16, help='Concurrent clients')
+    parser.add_argument('--keep', action='store_true', help='Keep the generated backup')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_viewer_")
+    backup_root = os.path.join(workdir, "backup")
+    export_args = argparse.Namespace(
+        events=args.events, media_ratio=args.media_ratio, threads=args.threads, unique_media=0,
+        latency=0.0, flood_every=0, flood_seconds=1, file_size=args.file_size, rate=1000.0,
+        storage=args.storage, thumbnails=True,
+    )
+    print(f"Generating a backup of {args.events} messages in {workdir}...")
+    asyncio.run(export_backup(export_args, 1, os.path.join(backup_root, str(GROUP_ID))))
+
+    # The viewer serves the current directory
+    os.chdir(workdir)
+    QuietHandler.search_index = SearchIndex("backup")
+    start = time.perf_counter()
+    QuietHandler.search_index.refresh()
+    print(f"Search index built in {time.perf_counter() - start:.2f}s")
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), QuietHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        base_url = f"http://127.0.0.1:{server.server_address[1]}"
+        client = LoadClient(base_url, collect_files(backup_root))
+        wall = client.run(args.requests, args.concurrency)
+    finally:
+        server.shutdown()
+        server.server_close()
+        os.chdir(REPO_ROOT)
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    total = sum(len(samples) for samples in client.samples.values())
+    print(f"{total} requests with {args.concurrency} clients in {wall:.2f}s: "
+          f"{total / wall:.0f} req/s")
+    print(f"{'request':<12} {'count':>6} {'errors':>6} "
+          f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'MB':>8}")
+    for kind, samples in client.samples.items():
+        latencies = [latency * 1000 for latency, _, _ in samples]
+        errors = sum(1 for *_, ok in samples if not ok)
+        megabytes = sum(size for _, size, _ in samples) / 1024 / 1024
+        print(
+            f"{kind:<12} {len(samples):>6} {errors:>6} "
+            f"{percentile(latencies, 0.50):>8.1f} {percentile(latencies, 0.95):>8.1f} "
+            f"{percentile(latencies, 0.99):>8.1f} {megabytes:>8.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1 @@
+"""Server-side helpers for run_viewer.py."""
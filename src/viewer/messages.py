@@ -0,0 +1,182 @@
+"""
+Sorted, paginated access to the messages of a backup folder.
+
+Each backup (dump.json or JSONL segments) is loaded and sorted by date once and
+kept in memory; the cache entry is rebuilt when any dump file changes (mtime or
+size). Up to MAX_CACHED_MESSAGES messages are kept over all backups, dropping
+the least recently viewed backups first. Pages are addressed with a cursor, the
+(date, id) key of the last message returned, so pages stay consistent when new
+messages are added.
+"""
+
+import os
+import bisect
+import threading
+from collections import OrderedDict
+
+from src.backup.storage import dump_files, iter_dump_records
+
+MESSAGE_TYPES = ("all", "media", "images", "videos", "audio", "documents", "text")
+MAX_PAGE_SIZE = 500
+# Messages kept in memory over all cached backups
+MAX_CACHED_MESSAGES = 200_000
+
+_IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".bmp")
+_VIDEO_EXTENSIONS = (".mp4", ".mov", ".avi", ".mkv", ".webm", ".m4v", ".3gp")
+_AUDIO_EXTENSIONS = (".mp3", ".wav", ".ogg", ".m4a", ".aac", ".flac")
+_DOCUMENT_EXTENSIONS = (".pdf", ".doc", ".docx", ".txt", ".rtf")
+_ARCHIVE_EXTENSIONS = (".zip", ".rar", ".7z", ".tar", ".gz")
+
+
+def file_type(filename):
+    """Classifies a media file name the same way getFileType() in index.html does."""
+    name = filename.lower()
+    if name.endswith(_IMAGE_EXTENSIONS):
+        return "image"
+    if name.endswith(".gif"):
+        return "gif"
+    if name.endswith(_VIDEO_EXTENSIONS):
+        return "video"
+    if name.endswith(_AUDIO_EXTENSIONS):
+        return "audio"
+    if name.endswith(_DOCUMENT_EXTENSIONS):
+        return "document"
+    if name.endswith(_ARCHIVE_EXTENSIONS):
+        return "archive"
+    return "file"
+
+
+def matches_type(message, type_filter):
+    """Applies a filterType value of the viewer to one message."""
+    if type_filter == "all":
+        return True
+    media = message.get("local_media_file")
+    if type_filter == "text":
+        return bool(message.get("message")) and not media
+    if not media:
+        return False
+    kind = file_type(media.get("filename", ""))
+    if type_filter == "media":
+        return True
+    if type_filter == "images":
+        return kind in ("image", "gif")
+    if type_filter == "videos":
+        return kind == "video"
+    if type_filter == "audio":
+        return kind == "audio"
+    if type_filter == "documents":
+        return kind in ("document", "archive", "file")
+    return False
+
+
+def sort_key(message):
+    """Orders messages by date, then by ID."""
+    return (message.get("date") or "", message.get("id") or 0)
+
+
+def encode_cursor(message):
+    """Returns the cursor of the page ending with a message."""
+    date, message_id = sort_key(message)
+    return f"{date}|{message_id}"
+
+
+def decode_cursor(cursor):
+    """Returns the sort key a cursor stands for."""
+    date, _, message_id = cursor.rpartition("|")
+    return date, int(message_id)
+
+
+def dump_signature(folder):
+    """Identifies the current version of a backup's dump files."""
+    signature = []
+    for path in dump_files(folder):
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        signature.append((path, st.st_mtime_ns, st.st_size))
+    return tuple(signature)
+
+
+class SortedMessages:
+    """The messages of one backup version, sorted by date, with per-type views."""
+
+    def __init__(self, messages):
+        self.messages = sorted(messages, key=sort_key)
+        self._views = {}
+        self._lock = threading.Lock()
+
+    def view(self, type_filter):
+        """Returns (messages, keys) for a type filter, built on first use."""
+        with self._lock:
+            if type_filter not in self._views:
+                messages = [m for m in self.messages if matches_type(m, type_filter)]
+                self._views[type_filter] = (messages, [sort_key(m) for m in messages])
+            return self._views[type_filter]
+
+
+class MessageCache:
+    """
+    Thread-safe LRU cache of SortedMessages per backup folder, invalidated on file changes.
+
+    :param max_messages: Messages kept over all backups. The backup loaded last is
+        always kept, even when it alone holds more.
+    """
+
+    def __init__(self, max_messages=MAX_CACHED_MESSAGES):
+        self.max_messages = max_messages
+        self.size = 0  # Messages held by the cached backups
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, folder):
+        """Returns the sorted messages of a backup folder, loading them if needed."""
+        signature = dump_signature(folder)
+        with self._lock:
+            entry = self._entries.get(folder)
+            if entry and entry[0] == signature:
+                self._entries.move_to_end(folder)
+                return entry[1]
+        # Load outside the lock so other backups can still be served meanwhile
+        sorted_messages = SortedMessages(iter_dump_records(folder))
+        with self._lock:
+            old_entry = self._entries.pop(folder, None)
+            if old_entry:
+                self.size -= len(old_entry[1].messages)
+            self._entries[folder] = (signature, sorted_messages)
+            self.size += len(sorted_messages.messages)
+            while self.size > self.max_messages and len(self._entries) > 1:
+                _, (_, dropped) = self._entries.popitem(last=False)
+                self.size -= len(dropped.messages)
+        return sorted_messages
+
+    def page(self, folder, type_filter="all", cursor=None, limit=100, order="desc"):
+        """
+        Returns one page of messages in date order.
+
+        :param folder: Backup folder (group or thread).
+        :param type_filter: Viewer type filter (all, media, images, videos, audio, documents, text).
+        :param cursor: Cursor of the previous page, None for the first page.
+        :param limit: Page size (capped at MAX_PAGE_SIZE).
+        :param order: "desc" (newest first) or "asc" (oldest first).
+        """
+        sorted_messages = self.get(folder)
+        messages, keys = sorted_messages.view(type_filter)
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+
+        if order == "asc":
+            start = bisect.bisect_right(keys, decode_cursor(cursor)) if cursor else 0
+            page = messages[start:start + limit]
+            has_more = start + limit < len(messages)
+        else:
+            end = bisect.bisect_left(keys, decode_cursor(cursor)) if cursor else len(messages)
+            start = max(0, end - limit)
+            page = messages[start:end][::-1]
+            has_more = start > 0
+
+        return {
+            "messages": page,
+            "next_cursor": encode_cursor(page[-1]) if page and has_more else None,
+            "total": len(messages),
+            "all_total": len(sorted_messages.messages),
+        }
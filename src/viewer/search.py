@@ -0,0 +1,385 @@
+"""
+Full-text search over all backups.
+
+``backup/search.sqlite`` holds one row per saved message of every backup folder
+(group or thread) with its date, sender, deleter and media type, plus an FTS5
+index over the message text and media file name. ``refresh()`` brings it up to
+date incrementally: JSONL segments are append-only, so only the lines written
+since the last refresh are read, and a rewritten dump.json re-indexes just its
+own folder.
+
+Usage: python -m src.viewer.search [--rebuild] [--query TEXT] [<backup root>]
+"""
+
+import os
+import re
+import json
+import time
+import sqlite3
+import argparse
+import threading
+from datetime import timedelta
+
+from src.backup.archive import archived_backup
+from src.backup.storage import dump_files, iter_dump_records, segment_files
+from src.viewer.messages import MESSAGE_TYPES, file_type
+
+INDEX_FILE = "search.sqlite"
+MAX_RESULTS = 200
+# Searches refresh the index at most this often (seconds)
+REFRESH_INTERVAL = 10
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sources (
+    folder TEXT PRIMARY KEY, kind TEXT NOT NULL, signature TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS segments (
+    folder TEXT NOT NULL, name TEXT NOT NULL, offset INTEGER NOT NULL,
+    PRIMARY KEY (folder, name)
+);
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    folder TEXT NOT NULL,
+    group_id INTEGER NOT NULL,
+    thread_id INTEGER NOT NULL,
+    message_id INTEGER NOT NULL,
+    date TEXT,
+    sender_id INTEGER,
+    deleted_by INTEGER,
+    media_type TEXT,
+    text TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    record TEXT NOT NULL,
+    UNIQUE (folder, message_id)
+);
+CREATE INDEX IF NOT EXISTS messages_group_date ON messages (group_id, thread_id, date);
+CREATE INDEX IF NOT EXISTS messages_deleted_by ON messages (deleted_by);
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+    text, filename, content='messages', content_rowid='id',
+    tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS messages_ai AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_fts (rowid, text, filename) VALUES (new.id, new.text, new.filename);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_ad AFTER DELETE ON messages BEGIN
+    INSERT INTO messages_fts (messages_fts, rowid, text, filename)
+    VALUES ('delete', old.id, old.text, old.filename);
+END;
+"""
+
+# SQL conditions of the viewer's type filter (see matches_type in messages.py)
+_TYPE_CONDITIONS = {
+    "all": None,
+    "media": "m.media_type IS NOT NULL",
+    "images": "m.media_type IN ('image', 'gif')",
+    "videos": "m.media_type = 'video'",
+    "audio": "m.media_type = 'audio'",
+    "documents": "m.media_type IN ('document', 'archive', 'file')",
+    "text": "m.media_type IS NULL AND m.text != ''",
+}
+
+
+def fts_query(text):
+    """Turns search box input into an FTS5 query: every word must match, as a prefix."""
+    return " ".join(f'"{term}"*' for term in re.findall(r"\w+", text))
+
+
+def backup_folders(root):
+    """
+    Yields (relative folder, group ID, thread ID) of every backup under root;
+    thread 0 is the whole group.
+    """
+    if not os.path.isdir(root):
+        return
+    for group in sorted(os.listdir(root)):
+        group_path = os.path.join(root, group)
+        if not group.isdigit() or not os.path.isdir(group_path):
+            continue
+        yield group, int(group), 0
+        for name in sorted(os.listdir(group_path)):
+            thread = name.removeprefix("thread_")
+            is_thread = name.startswith("thread_") and thread.isdigit()
+            if is_thread and os.path.isdir(os.path.join(group_path, name)):
+                yield f"{group}/{name}", int(group), int(thread)
+
+
+def read_new_records(path, offset):
+    """Reads the complete JSON lines a segment got after offset; returns (records, new offset)."""
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        data = f.read()
+    # A line still being written is picked up by the next refresh
+    end = data.rfind(b"\n") + 1
+    records = []
+    for line in data[:end].splitlines():
+        if not line.strip():
+            continue
+        try:
+            records.append(json.loads(line))
+        except json.JSONDecodeError:
+            continue
+    return records, offset + end
+
+
+def index_row(record):
+    """Returns the indexed columns of a dump record, from message_id to record."""
+    media = record.get("local_media_file") or {}
+    filename = media.get("filename") or ""
+    from_id = record.get("from_id")
+    sender_id = from_id.get("user_id") if isinstance(from_id, dict) else None
+    return (
+        record["id"],
+        record.get("date"),
+        sender_id,
+        record.get("deleted_by"),
+        file_type(filename) if media else None,
+        record.get("message") or "",
+        filename,
+        json.dumps(record, ensure_ascii=False, separators=(",", ":")),
+    )
+
+
+class SearchIndex:
+    """
+    SQLite FTS5 index of the messages in every backup under a root folder.
+
+    Searches run on per-thread connections while one thread refreshes the index
+    (WAL mode), so results are served during a long first indexing run.
+
+    :param root: Folder holding the group backups (backup/).
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.path = os.path.join(root, INDEX_FILE)
+        os.makedirs(root, exist_ok=True)
+        db = sqlite3.connect(self.path)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.executescript(_SCHEMA)
+        db.close()
+        self._local = threading.local()
+        self._refresh_lock = threading.Lock()
+        self._last_refresh = 0.0
+
+    def _db(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path)
+            self._local.db = db
+        return db
+
+    @property
+    def indexing(self):
+        """True while a refresh is running."""
+        return self._refresh_lock.locked()
+
+    def refresh(self, wait=True):
+        """
+        Indexes new and changed backups and drops removed ones.
+
+        :param wait: Wait for a running refresh to finish first; if False, return 0
+            right away instead.
+        :return: Number of messages added.
+        """
+        if not self._refresh_lock.acquire(blocking=wait):
+            return 0
+        try:
+            return self._refresh()
+        finally:
+            self._last_refresh = time.monotonic()
+            self._refresh_lock.release()
+
+    def refresh_if_stale(self):
+        """
+        Starts a refresh in a background thread unless the index was refreshed
+        recently or a refresh is running. Searches are served from the current
+        index meanwhile, so a large export never blocks a search request.
+        """
+        if self.indexing or time.monotonic() - self._last_refresh < REFRESH_INTERVAL:
+            return
+        # One refresh per interval, however many searches arrive meanwhile
+        self._last_refresh = time.monotonic()
+        threading.Thread(target=self.refresh, kwargs={"wait": False}, daemon=True).start()
+
+    def _refresh(self):
+        db = self._db()
+        folders = {
+            folder: (group_id, thread_id)
+            for folder, group_id, thread_id in backup_folders(self.root)
+        }
+        sources = {
+            row[0]: row[1:]
+            for row in db.execute("SELECT folder, kind, signature FROM sources")
+        }
+        for folder in sources.keys() - folders.keys():
+            self._forget(db, folder)
+            db.commit()
+
+        added = 0
+        for folder, (group_id, thread_id) in folders.items():
+            added += self._refresh_folder(db, folder, group_id, thread_id, sources.get(folder))
+            db.commit()
+        return added
+
+    def _refresh_folder(self, db, folder, group_id, thread_id, source):
+        path = os.path.join(self.root, folder)
+        segments = segment_files(path)
+        # A packed folder is re-indexed whole when its archive or dump files change
+        if segments and archived_backup(path) is None:
+            names = {os.path.basename(segment): segment for segment in segments}
+            offsets = dict(db.execute(
+                "SELECT name, offset FROM segments WHERE folder = ?", (folder,)
+            ))
+            # Segments are only appended to; anything else means the folder was rewritten
+            rewritten = source is None or source[0] != "segments" or any(
+                name not in names or os.path.getsize(names[name]) < offset
+                for name, offset in offsets.items()
+            )
+            if rewritten:
+                self._forget(db, folder)
+                db.execute("INSERT INTO sources VALUES (?, 'segments', '')", (folder,))
+                offsets = {}
+            added = 0
+            for name, segment in names.items():
+                offset = offsets.get(name, 0)
+                if os.path.getsize(segment) == offset:
+                    continue
+                records, offset = read_new_records(segment, offset)
+                added += self._insert(db, folder, group_id, thread_id, records)
+                db.execute(
+                    "INSERT OR REPLACE INTO segments VALUES (?, ?, ?)", (folder, name, offset)
+                )
+            return added
+
+        signature = []
+        for dump_file in dump_files(path):
+            try:
+                st = os.stat(dump_file)
+            except OSError:
+                continue
+            signature.append(f"{st.st_mtime_ns}-{st.st_size}")
+        signature = ",".join(signature)
+        if source is not None and source == ("dump", signature):
+            return 0
+        self._forget(db, folder)
+        db.execute("INSERT INTO sources VALUES (?, 'dump', ?)", (folder, signature))
+        records = iter_dump_records(path) if signature else []
+        return self._insert(db, folder, group_id, thread_id, records)
+
+    @staticmethod
+    def _forget(db, folder):
+        db.execute("DELETE FROM messages WHERE folder = ?", (folder,))
+        db.execute("DELETE FROM segments WHERE folder = ?", (folder,))
+        db.execute("DELETE FROM sources WHERE folder = ?", (folder,))
+
+    @staticmethod
+    def _insert(db, folder, group_id, thread_id, records):
+        cursor = db.executemany(
+            "INSERT INTO messages (folder, group_id, thread_id, message_id, date, sender_id, "
+            "deleted_by, media_type, text, filename, record) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT DO NOTHING",
+            (
+                (folder, group_id, thread_id, *index_row(record))
+                for record in records if "id" in record
+            ),
+        )
+        return cursor.rowcount
+
+    def search(self, text, group_id=None, thread_id=None, since=None, until=None,
+               deleted_by=None, type_filter="all", limit=50, offset=0):
+        """
+        Returns one page of messages matching a search, best matches first.
+
+        :param text: Search box input; every word must match (as a prefix).
+        :param group_id: Only this group, None for all backups.
+        :param thread_id: Only this thread (0 for the whole-group backup), None for all.
+        :param since: Only messages sent on or after this date.
+        :param until: Only messages sent on or before this date.
+        :param deleted_by: Only messages deleted by this user ID.
+        :param type_filter: Viewer type filter (all, media, images, videos, audio, documents, text).
+        :param limit: Page size (capped at MAX_RESULTS).
+        :param offset: Number of results to skip.
+        """
+        if type_filter not in MESSAGE_TYPES:
+            raise ValueError(f"Unknown type filter: {type_filter}")
+        match = fts_query(text)
+        if not match:
+            return {"results": [], "total": 0, "next_offset": None}
+
+        conditions = ["messages_fts MATCH ?"]
+        params = [match]
+        for condition, value in (
+            ("m.group_id = ?", group_id),
+            ("m.thread_id = ?", thread_id),
+            ("m.date >= ?", since.isoformat() if since else None),
+            ("m.date < ?", (until + timedelta(days=1)).isoformat() if until else None),
+            ("m.deleted_by = ?", deleted_by),
+        ):
+            if value is not None:
+                conditions.append(condition)
+                params.append(value)
+        if _TYPE_CONDITIONS[type_filter]:
+            conditions.append(_TYPE_CONDITIONS[type_filter])
+        where = " AND ".join(conditions)
+        query = f"FROM messages_fts JOIN messages m ON m.id = messages_fts.rowid WHERE {where}"
+
+        limit = max(1, min(limit, MAX_RESULTS))
+        db = self._db()
+        total = db.execute(f"SELECT count(*) {query}", params).fetchone()[0]
+        rows = db.execute(
+            # Matches in the text weigh more than matches in the file name
+            f"SELECT m.group_id, m.thread_id, m.record, bm25(messages_fts, 10.0, 1.0) AS rank "
+            f"{query} ORDER BY rank, m.date DESC LIMIT ? OFFSET ?",
+            params + [limit, offset],
+        ).fetchall()
+        results = [
+            {
+                "group": str(group),
+                "thread": str(thread) if thread else "no-thread",
+                "rank": rank,
+                "message": json.loads(record),
+            }
+            for group, thread, record, rank in rows
+        ]
+        next_offset = offset + len(results)
+        return {
+            "results": results,
+            "total": total,
+            "next_offset": next_offset if next_offset < total else None,
+        }
+
+
+def main():
+    """Brings the index of a backup root up to date and optionally runs a search."""
+    parser = argparse.ArgumentParser(description='Build or query the backup search index')
+    parser.add_argument('root', nargs='?', default='backup',
+                        help='Backup root folder (default: backup)')
+    parser.add_argument('--rebuild', action='store_true',
+                        help='Delete the index and index everything again')
+    parser.add_argument('--query', help='Print the best matches of a search after indexing')
+    args = parser.parse_args()
+
+    if args.rebuild:
+        for suffix in ("", "-wal", "-shm"):
+            path = os.path.join(args.root, INDEX_FILE + suffix)
+            if os.path.exists(path):
+                os.remove(path)
+
+    index = SearchIndex(args.root)
+    start = time.perf_counter()
+    added = index.refresh()
+    print(f"Indexed {added} new messages in {time.perf_counter() - start:.2f}s ({index.path})")
+
+    if args.query:
+        start = time.perf_counter()
+        page = index.search(args.query, limit=10)
+        print(f"{page['total']} matches in {(time.perf_counter() - start) * 1000:.1f} ms")
+        for result in page["results"]:
+            message = result["message"]
+            print(f"  [{result['group']}/{result['thread']}] "
+                  f"{message.get('id')} {message.get('date')}: "
+                  f"{(message.get('message') or '')[:80]}")
+
+
+if __name__ == "__main__":
+    main()
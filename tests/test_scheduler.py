@@ -0,0 +1,125 @@
+"""
+Tests of the request scheduler's backoff and recovery.
+
+The scheduler's clock and sleep are replaced by a virtual clock, so minutes of
+request pacing run instantly.
+
+Usage: python -m pytest tests
+"""
+
+import asyncio
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from telethon.errors import FloodWaitError
+
+from src.backup import scheduler as scheduler_module
+from src.backup.scheduler import RequestScheduler
+
+
+class VirtualClock:
+    """Time that only moves when the scheduler sleeps."""
+
+    def __init__(self) -> None:
+        self.now: float = 0.0
+
+    def time(self) -> float:
+        """Current virtual time in seconds."""
+        return self.now
+
+    async def sleep(self, seconds: float) -> None:
+        """Moves the clock forward instead of waiting."""
+        self.now += max(0.0, seconds)
+        await asyncio.sleep(0)
+
+
+class SchedulerTestCase(unittest.TestCase):
+    """RequestScheduler driven by the virtual clock."""
+
+    def setUp(self) -> None:
+        self.clock = VirtualClock()
+        patches = [
+            mock.patch.object(
+                scheduler_module, "time",
+                SimpleNamespace(monotonic=self.clock.time, perf_counter=self.clock.time),
+            ),
+            mock.patch.object(
+                scheduler_module, "asyncio",
+                SimpleNamespace(Lock=asyncio.Lock, sleep=self.clock.sleep),
+            ),
+            # The FloodWait notice is not part of what is tested
+            mock.patch("builtins.print"),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def run_calls(
+        self, scheduler: RequestScheduler, until: float, flood=lambda call, now: False
+    ) -> list[float]:
+        """
+        Makes calls one after another until the virtual clock reaches until.
+
+        :param flood: Tells from the call number and time whether Telegram answers
+            with a 5 s FloodWait.
+        :return: Rate right before each FloodWait.
+        """
+        rates_before_flood = []
+        calls = 0
+
+        async def api_call() -> None:
+            nonlocal calls
+            calls += 1
+            if flood(calls, self.clock.now):
+                rates_before_flood.append(scheduler.rate)
+                raise FloodWaitError(request=None, capture=5)
+
+        async def run() -> None:
+            while self.clock.now < until:
+                await scheduler.call(api_call)
+
+        asyncio.run(run())
+        return rates_before_flood
+
+    def test_flood_wait_halves_rate_and_pauses(self) -> None:
+        """A FloodWait lowers the rate and waits out the requested seconds."""
+        scheduler = RequestScheduler(rate=8.0)
+        self.run_calls(scheduler, until=1.0, flood=lambda call, now: call == 4)
+        self.assertEqual(scheduler.flood_waits, 1)
+        self.assertGreaterEqual(self.clock.now, 5.0)
+        self.assertLess(scheduler.rate, 8.0)
+
+    def test_recovers_from_min_rate_within_seconds(self) -> None:
+        """The rate climbs back from a very low start in seconds, not minutes."""
+        scheduler = RequestScheduler(rate=0.2)
+        self.run_calls(scheduler, until=20.0)
+        # About increase per second, whatever the starting rate
+        self.assertGreaterEqual(scheduler.rate, 4.5)
+
+    def test_repeated_floods_do_not_pin_rate_to_minimum(self) -> None:
+        """Periodic FloodWaits settle the rate instead of driving it to min_rate."""
+        scheduler = RequestScheduler()
+        # A FloodWait on every 7th call for ten minutes, then none
+        rates = self.run_calls(
+            scheduler, until=630.0, flood=lambda call, now: now < 600.0 and call % 7 == 0
+        )
+        self.assertGreater(scheduler.flood_waits, 10)
+        # The rate settles where the calls between two floods win back the halving
+        for rate in rates[10:]:
+            self.assertGreater(rate, 1.5)
+        # And is back to the initial rate soon after the floods stop
+        self.assertGreaterEqual(scheduler.rate, 5.0)
+
+    def test_rate_stays_within_bounds(self) -> None:
+        """The rate never leaves [min_rate, max_rate]."""
+        scheduler = RequestScheduler(rate=1.0, min_rate=0.5, max_rate=3.0)
+        rates = self.run_calls(
+            scheduler, until=60.0, flood=lambda call, now: call <= 4 or call % 50 == 0
+        )
+        self.assertTrue(all(rate >= 0.5 for rate in rates))
+        self.assertLessEqual(scheduler.rate, 3.0)
+
+
+if __name__ == "__main__":
+    unittest.main()